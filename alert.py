@@ -1,70 +1,569 @@
+import argparse
 import socket
 import json
 import threading
+import asyncio
+import logging
+import queue
+import alert_protocol
+import alert_bus
 import alerts_db  # Import the alerts database functions
-from app import socketio  # Import socketio from your Flask app
+import offload
+import os
 
-ALERT_SERVER_HOST = '127.0.0.1'
-ALERT_SERVER_PORT = 5003
+logger = logging.getLogger(__name__)
+
+ALERT_SERVER_HOST = os.environ.get('WEATHER_ALERT_HOST', '127.0.0.1')
+ALERT_SERVER_PORT = int(os.environ.get('WEATHER_ALERT_PORT', '5003'))
 CONNECTED_CLIENTS = []  # List to store connected clients for broadcasting alerts
+CLIENT_ENCODINGS = {}  # Negotiated encoding per client socket (None for unframed clients)
+CLIENT_OUTBOXES = {}  # Bounded outgoing queue per client socket of the threaded server
+CLIENTS_LOCK = threading.Lock()  # Guards CONNECTED_CLIENTS in the threaded server
+LEGACY_SNIFF_TIMEOUT = 0.2  # Seconds to wait for a hello before assuming an unframed client
+LEGACY_REPLAY_LIMIT = 1000  # Most recent alerts replayed to clients that can't send a cursor
+LISTEN_BACKLOG = 4096
 
-# Function to handle incoming client connections and send alerts
-def handle_alert_client(client_socket):
-    CONNECTED_CLIENTS.append(client_socket)
-    print(f"Client connected for alerts. Total connected: {len(CONNECTED_CLIENTS)}")
-    
-    # Retrieve and send existing alerts to the client
-    try:
-        alerts = alerts_db.get_weather_alerts()  # Get all alerts from the database
-        for alert in alerts:
-            alert_data = {"type": "alert", "message": alert[1]}  # alert[1] is the message
-            client_socket.send(json.dumps(alert_data).encode())  # Send existing alerts
+# Both servers give each client a bounded queue of outgoing alerts, so a
+# broadcast never waits on a slow client. What happens when a client's queue
+# is full is decided by SLOW_CLIENT_POLICY:
+#   'drop_oldest'  discard the oldest queued alert to make room (default)
+#   'drop_newest'  discard the alert being broadcast
+#   'disconnect'   close the slow client
+# Both are set with WEATHER_ALERT_QUEUE_SIZE / WEATHER_ALERT_SLOW_CLIENT_POLICY
+# or `python alert.py --queue-size N --policy NAME`.
+CLIENT_QUEUE_SIZE = int(os.environ.get('WEATHER_ALERT_QUEUE_SIZE', '256'))
+SLOW_CLIENT_POLICY = os.environ.get('WEATHER_ALERT_SLOW_CLIENT_POLICY', 'drop_oldest')
+SLOW_CLIENT_POLICIES = ('drop_oldest', 'drop_newest', 'disconnect')
 
-        while True:
-            data = client_socket.recv(1024).decode()
-            if data:
-                request = json.loads(data)
-                if request['type'] == 'get_latest_alert':
-                    alert = alerts_db.get_latest_alert()
-                    if alert:
-                        alert_data = {"type": "alert", "message": alert[1]}  # alert[1] is the message
-                        client_socket.send(json.dumps(alert_data).encode())
-                elif request['type'] == 'alert':
-                    message = request.get('message', '')
-                    # Broadcast the alert to all connected clients
-                    broadcast_alert(message)
+# Unframed payload sent to clients that never sent a hello
+def legacy_payload(message):
+    return json.dumps({"type": "alert", "message": message}).encode()
+
+# Reply to a request the server can't act on, in the client's wire format
+def error_payload(reason, encoding):
+    message = {"type": "error", "message": reason}
+    if encoding is None:
+        return json.dumps(message).encode()
+    return alert_protocol.encode_frame(message, encoding)
+
+# Encode an alert once per wire format, for broadcasting to mixed clients
+class AlertPayloads:
+    def __init__(self, message, alert_id=None):
+        self.message = message
+        self.alert_id = alert_id
+        self._cache = {}
+
+    def get(self, encoding):
+        if encoding not in self._cache:
+            if encoding is None:
+                self._cache[encoding] = legacy_payload(self.message)
             else:
+                frame = {"type": "alert", "message": self.message}
+                if self.alert_id is not None:
+                    frame['id'] = self.alert_id
+                self._cache[encoding] = alert_protocol.encode_frame(frame, encoding)
+        return self._cache[encoding]
+
+# Outgoing alerts for one client of the threaded server: broadcasts are
+# queued without blocking and a writer thread (a green thread under serve.py)
+# sends them, coalescing whatever is pending into one write
+class ClientOutbox:
+    def __init__(self, client_socket, queue_size=CLIENT_QUEUE_SIZE, policy=SLOW_CLIENT_POLICY):
+        self.client_socket = client_socket
+        self.queue = queue.Queue(queue_size)
+        self.policy = policy
+        # Held for every write, so frames from different threads never interleave
+        self.send_lock = threading.Lock()
+        self.dropped = 0
+        self.closed = False
+        threading.Thread(target=self._pump, name='alert-client-writer', daemon=True).start()
+
+    # Enqueue a payload without blocking; returns False if the client must go
+    def offer(self, payload):
+        if self.closed:
+            return True
+        try:
+            self.queue.put_nowait(payload)
+            return True
+        except queue.Full:
+            pass
+        if self.policy == 'disconnect':
+            return False
+        self.dropped += 1
+        if self.policy == 'drop_oldest':
+            try:
+                self.queue.get_nowait()
+                self.queue.put_nowait(payload)
+            except (queue.Empty, queue.Full):
+                pass
+        return True
+
+    def _pump(self):
+        while not self.closed:
+            chunks = [self.queue.get()]
+            while not self.queue.empty():
+                chunks.append(self.queue.get_nowait())
+            if self.closed:
                 break
+            try:
+                with self.send_lock:
+                    self.client_socket.sendall(b''.join(chunks))
+            except OSError:
+                break
+
+    # Stop the writer; the client's own thread closes the socket
+    def close(self):
+        self.closed = True
+        try:
+            self.queue.put_nowait(b'')
+        except queue.Full:
+            pass
+
+# Send a whole payload to one client of the threaded server, from its own thread
+def send_to_client(client_socket, data):
+    outbox = CLIENT_OUTBOXES.get(client_socket)
+    with outbox.send_lock if outbox else threading.Lock():
+        client_socket.sendall(data)
+
+# Database reads and writes below go through offload.call, so when the threaded
+# server runs green inside the web server (serve.py) they don't stall its loop
+
+# Most recent alerts for an unframed client, newest first, via the timestamp index
+def legacy_history():
+    return offload.call(lambda: list(alerts_db.iter_alerts(LEGACY_REPLAY_LIMIT)))
+
+# Work out where a framed session resumes: the explicit "since", else the
+# subscriber's stored cursor, else the beginning
+def resume_point(since, subscriber):
+    if since is not None:
+        return since
+    if subscriber:
+        return offload.call(alerts_db.get_alert_cursor, subscriber)
+    return 0
+
+# Yield (frame, last_id) for the replay of every alert newer than `since`, one
+# batch per frame, where last_id is the newest alert sent so far. The caller
+# advances the subscriber's cursor with save_cursor once the frames are written.
+def history_frames(since, encoding):
+    last_id = since
+    while True:
+        rows = offload.call(alerts_db.get_alerts_since, last_id, alert_protocol.REPLAY_BATCH_SIZE)
+        if rows:
+            last_id = rows[-1][0]
+            for frame in alert_protocol.replay_frames(rows, encoding):
+                yield frame, last_id
+        if len(rows) < alert_protocol.REPLAY_BATCH_SIZE:
+            break
+    yield alert_protocol.encode_frame({"type": "replay_done", "last_id": last_id}, encoding), last_id
+
+# Record that a replay from `since` up to last_id has been written to the subscriber
+def save_cursor(subscriber, since, last_id):
+    if subscriber and last_id > since:
+        offload.call(alerts_db.set_alert_cursor, subscriber, last_id)
+
+# Send a replay to a client of the threaded server, then advance its cursor
+def send_history(client_socket, since, encoding, subscriber=None):
+    last_id = since
+    for frame, last_id in history_frames(since, encoding):
+        send_to_client(client_socket, frame)
+    save_cursor(subscriber, since, last_id)
+
+# Wait briefly for a hello frame. Returns (encoding, since, subscriber), or
+# (None, 0, None) for an old client that sends nothing (or bare JSON) before reading.
+def negotiate_protocol(client_socket):
+    client_socket.settimeout(LEGACY_SNIFF_TIMEOUT)
+    try:
+        first = client_socket.recv(1, socket.MSG_PEEK)
+    except socket.timeout:
+        return None, 0, None
+    finally:
+        client_socket.settimeout(None)
+    if not first or first == b'{':
+        return None, 0, None
+    encoding, since, subscriber = alert_protocol.accept_hello(alert_protocol.recv_frame(client_socket))
+    client_socket.sendall(alert_protocol.welcome(encoding))
+    return encoding, resume_point(since, subscriber), subscriber
+
+# Function to handle incoming client connections and send alerts
+def handle_alert_client(client_socket, queue_size=CLIENT_QUEUE_SIZE, policy=SLOW_CLIENT_POLICY):
+    try:
+        encoding, since, subscriber = negotiate_protocol(client_socket)
+    except Exception as e:
+        logger.warning("Error negotiating alert protocol: %s", e)
+        client_socket.close()
+        return
+
+    with CLIENTS_LOCK:
+        CONNECTED_CLIENTS.append(client_socket)
+        CLIENT_ENCODINGS[client_socket] = encoding
+        CLIENT_OUTBOXES[client_socket] = ClientOutbox(client_socket, queue_size, policy)
+    logger.debug("Alert client connected", extra={'connected': len(CONNECTED_CLIENTS)})
+
+    try:
+        if encoding is None:
+            serve_legacy_client(client_socket)
+        else:
+            serve_framed_client(client_socket, encoding, since, subscriber)
     except Exception as e:
-        print(f"Error handling alert client: {e}")
+        logger.warning("Error handling alert client: %s", e)
     finally:
         # Remove client when disconnected
-        if client_socket in CONNECTED_CLIENTS:
-            CONNECTED_CLIENTS.remove(client_socket)
+        with CLIENTS_LOCK:
+            if client_socket in CONNECTED_CLIENTS:
+                CONNECTED_CLIENTS.remove(client_socket)
+            CLIENT_ENCODINGS.pop(client_socket, None)
+            outbox = CLIENT_OUTBOXES.pop(client_socket, None)
+        if outbox is not None:
+            outbox.close()
         client_socket.close()
-        print(f"Client disconnected. Total connected: {len(CONNECTED_CLIENTS)}")
+        logger.debug("Alert client disconnected", extra={'connected': len(CONNECTED_CLIENTS)})
 
-# Function to broadcast an alert to all connected clients
-def broadcast_alert(alert_message):
-    print(f"Broadcasting alert: {alert_message}")
-    for client_socket in CONNECTED_CLIENTS:
-        try:
-            alert_data = {"type": "alert", "message": alert_message}
-            client_socket.send(json.dumps(alert_data).encode())
-        except Exception as e:
-            print(f"Error broadcasting alert: {e}")
+# Old protocol: bare JSON objects in both directions
+def serve_legacy_client(client_socket):
+    # Send the most recent alerts to the client in one write
+    alerts = legacy_history()
+    send_to_client(client_socket, b''.join(legacy_payload(alert[1]) for alert in alerts))
+
+    while True:
+        data = client_socket.recv(1024).decode()
+        if not data:
+            break
+        request = json.loads(data)
+        error = alert_protocol.request_error(request)
+        if error:
+            send_to_client(client_socket, error_payload(error, None))
+        elif request['type'] == 'get_latest_alert':
+            alert = offload.call(alerts_db.get_latest_alert)
+            if alert:
+                send_to_client(client_socket, legacy_payload(alert[1]))
+        elif request['type'] == 'alert':
+            # Broadcast the alert to every process through the alert bus
+            alert_bus.publish_alert(request.get('message', ''))
+
+# Framed protocol: batched replay from the client's cursor, then framed requests
+def serve_framed_client(client_socket, encoding, since, subscriber=None):
+    send_history(client_socket, since, encoding, subscriber)
+
+    while True:
+        request = alert_protocol.recv_frame(client_socket, encoding)
+        if request is None:
+            break
+        error = alert_protocol.request_error(request)
+        if error:
+            send_to_client(client_socket, error_payload(error, encoding))
+        elif request['type'] == 'get_latest_alert':
+            alert = offload.call(alerts_db.get_latest_alert)
+            if alert:
+                send_to_client(client_socket, AlertPayloads(alert[1], alert[4]).get(encoding))
+        elif request['type'] == 'replay':
+            since = resume_point(request.get('since'), subscriber)
+            send_history(client_socket, int(since), encoding, subscriber)
+        elif request['type'] == 'ack' and subscriber:
+            offload.call(alerts_db.set_alert_cursor, subscriber, int(request['id']))
+        elif request['type'] == 'alert':
+            alert_bus.publish_alert(request.get('message', ''))
+
+# Function to broadcast an alert to all connected clients; pass the alert's
+# id when it has been stored so framed clients can ack it
+def broadcast_alert(alert_message, alert_id=None):
+    logger.debug("Broadcasting alert", extra={'alert_id': alert_id, 'clients': len(CLIENT_ENCODINGS)})
+    payloads = AlertPayloads(alert_message, alert_id)
+    with CLIENTS_LOCK:
+        clients = [(client_socket, encoding, CLIENT_OUTBOXES.get(client_socket))
+                   for client_socket, encoding in CLIENT_ENCODINGS.items()]
+    for client_socket, encoding, outbox in clients:
+        if outbox is not None and not outbox.offer(payloads.get(encoding)):
+            logger.info("Disconnecting slow alert client", extra={'dropped': outbox.dropped})
+            # Wakes the client's thread, which unregisters it
+            try:
+                client_socket.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
+
+# Deliver alerts published on the bus (by any process) to this server's clients
+def broadcast_bus_alert(event):
+    broadcast_alert(event['message'], event.get('id'))
 
-# Start the alert server
-def start_alert_server():
+# Start the alert server (blocks; one thread, or green thread, per client)
+def start_alert_server(host=ALERT_SERVER_HOST, port=ALERT_SERVER_PORT, queue_size=CLIENT_QUEUE_SIZE,
+                       policy=SLOW_CLIENT_POLICY):
+    if policy not in SLOW_CLIENT_POLICIES:
+        raise ValueError(f"Unknown slow client policy: {policy}")
+    alert_bus.get_bus().subscribe(alert_bus.ALERT_CHANNEL, broadcast_bus_alert)
     alert_server = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-    alert_server.bind((ALERT_SERVER_HOST, ALERT_SERVER_PORT))
-    alert_server.listen(5)
-    print(f"Alert server listening on {ALERT_SERVER_HOST}:{ALERT_SERVER_PORT}...")
+    alert_server.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    alert_server.bind((host, port))
+    alert_server.listen(LISTEN_BACKLOG)
+    logger.info("Alert server listening on %s:%s", host, port)
 
     while True:
         client_socket, client_address = alert_server.accept()
-        print(f"New connection from {client_address}")
-        threading.Thread(target=handle_alert_client, args=(client_socket,)).start()
+        logger.debug("New alert connection", extra={'client': client_address})
+        threading.Thread(target=handle_alert_client, args=(client_socket, queue_size, policy)).start()
+
+# ---------------------------------------------------------------------------
+# Event-driven (asyncio/selectors) alert server
+#
+# One event loop serves every subscriber. Each client's bounded outgoing
+# queue (see SLOW_CLIENT_POLICY above) is drained by its own writer task.
+# ---------------------------------------------------------------------------
+
+
+# Replay frames queued for a subscriber. Its cursor moves to last_id only once
+# they have been written, so a replay dropped from a full queue isn't skipped.
+class ReplayPayload(bytes):
+    def __new__(cls, frames, since, last_id):
+        payload = super().__new__(cls, frames)
+        payload.since = since
+        payload.last_id = last_id
+        return payload
+
+
+class AlertSubscriber:
+    def __init__(self, writer, queue_size, policy, encoding=None, subscriber_id=None):
+        self.writer = writer
+        self.encoding = encoding
+        self.subscriber_id = subscriber_id
+        self.queue = asyncio.Queue(queue_size)
+        self.policy = policy
+        self.dropped = 0
+        self.closed = False
+
+    # Enqueue a payload without blocking; returns False if the client must go
+    def offer(self, payload):
+        try:
+            self.queue.put_nowait(payload)
+            return True
+        except asyncio.QueueFull:
+            pass
+        if self.policy == 'disconnect':
+            return False
+        self.dropped += 1
+        if self.policy == 'drop_oldest':
+            self.queue.get_nowait()
+            self.queue.put_nowait(payload)
+        return True
+
+    # Write queued payloads, coalescing whatever is pending into one write
+    async def pump(self):
+        try:
+            while True:
+                chunks = [await self.queue.get()]
+                while not self.queue.empty():
+                    chunks.append(self.queue.get_nowait())
+                self.writer.write(b''.join(chunks))
+                await self.writer.drain()
+                for chunk in chunks:
+                    if isinstance(chunk, ReplayPayload) and self.subscriber_id:
+                        await asyncio.get_running_loop().run_in_executor(
+                            None, save_cursor, self.subscriber_id, chunk.since, chunk.last_id)
+        except ConnectionError:
+            self.close()
+
+    def close(self):
+        if not self.closed:
+            self.closed = True
+            self.writer.close()
+
+
+class AsyncAlertServer:
+    def __init__(self, host=ALERT_SERVER_HOST, port=ALERT_SERVER_PORT,
+                 queue_size=CLIENT_QUEUE_SIZE, policy=SLOW_CLIENT_POLICY, replay_history=True, bus=None):
+        if policy not in SLOW_CLIENT_POLICIES:
+            raise ValueError(f"Unknown slow client policy: {policy}")
+        self.host = host
+        self.port = port
+        self.queue_size = queue_size
+        self.policy = policy
+        self.replay_history = replay_history
+        self.bus = bus
+        self.subscribers = set()
+        self.loop = None
+        self.server = None
+        self.dropped = 0
+        self.disconnected = 0
+
+    async def start(self):
+        self.loop = asyncio.get_running_loop()
+        self.bus = self.bus or alert_bus.get_bus()
+        self.bus.subscribe(alert_bus.ALERT_CHANNEL,
+                           lambda event: self.broadcast_threadsafe(event['message'], event.get('id')))
+        self.server = await asyncio.start_server(self.handle_client, self.host, self.port,
+                                                 backlog=LISTEN_BACKLOG)
+        self.port = self.server.sockets[0].getsockname()[1]
+        logger.info("Async alert server listening on %s:%s", self.host, self.port)
+        return self.server
+
+    async def serve_forever(self):
+        if self.server is None:
+            await self.start()
+        async with self.server:
+            await self.server.serve_forever()
+
+    # Fan an alert out to every subscriber; must run on the server's loop
+    def broadcast(self, alert_message, alert_id=None):
+        payloads = AlertPayloads(alert_message, alert_id)
+        for subscriber in list(self.subscribers):
+            if not subscriber.offer(payloads.get(subscriber.encoding)):
+                self.disconnected += 1
+                self._drop(subscriber)
+
+    # Broadcast from any other thread (e.g. a Flask worker)
+    def broadcast_threadsafe(self, alert_message, alert_id=None):
+        self.loop.call_soon_threadsafe(self.broadcast, alert_message, alert_id)
+
+    def _drop(self, subscriber):
+        if subscriber in self.subscribers:
+            self.subscribers.discard(subscriber)
+            self.dropped += subscriber.dropped
+        subscriber.close()
+
+    # Async counterpart of negotiate_protocol(). Returns (encoding, since,
+    # subscriber, leftover bytes already read from an unframed client).
+    async def negotiate(self, reader, writer):
+        try:
+            header = await asyncio.wait_for(reader.readexactly(alert_protocol.HEADER.size),
+                                            LEGACY_SNIFF_TIMEOUT)
+        except asyncio.TimeoutError:
+            return None, 0, None, b''
+        except asyncio.IncompleteReadError as e:
+            return None, 0, None, e.partial
+        if header[:1] == b'{':
+            return None, 0, None, header
+        (length,) = alert_protocol.HEADER.unpack(header)
+        if length > alert_protocol.MAX_FRAME_SIZE:
+            raise alert_protocol.ProtocolError(f"Frame of {length} bytes exceeds limit")
+        encoding, since, subscriber = alert_protocol.accept_hello(
+            json.loads(await reader.readexactly(length)))
+        writer.write(alert_protocol.welcome(encoding))
+        since = await self.loop.run_in_executor(None, resume_point, since, subscriber)
+        return encoding, since, subscriber, b''
+
+    # Replay history to a new subscriber straight to the socket, batch by batch
+    async def replay(self, writer, encoding, since, subscriber=None):
+        if encoding is None:
+            alerts = await self.loop.run_in_executor(None, legacy_history)
+            writer.write(b''.join(legacy_payload(alert[1]) for alert in alerts))
+            await writer.drain()
+            return
+        frames = history_frames(since, encoding)
+        last_id = since
+        while True:
+            # Each step reads one batch from the database off the event loop
+            step = await self.loop.run_in_executor(None, next, frames, None)
+            if step is None:
+                break
+            frame, last_id = step
+            writer.write(frame)
+            await writer.drain()
+        await self.loop.run_in_executor(None, save_cursor, subscriber, since, last_id)
+
+    async def handle_client(self, reader, writer):
+        pump = None
+        subscriber = None
+        try:
+            encoding, since, subscriber_id, leftover = await self.negotiate(reader, writer)
+            subscriber = AlertSubscriber(writer, self.queue_size, self.policy, encoding, subscriber_id)
+            # Subscribe first so alerts broadcast during the replay are queued, not lost
+            self.subscribers.add(subscriber)
+            if self.replay_history:
+                await self.replay(writer, encoding, since, subscriber_id)
+            pump = asyncio.create_task(subscriber.pump())
+
+            if encoding is None:
+                await self.serve_legacy(reader, subscriber, leftover)
+            else:
+                await self.serve_framed(reader, subscriber)
+        except (ConnectionError, ValueError, KeyError, asyncio.IncompleteReadError,
+                alert_protocol.ProtocolError) as e:
+            logger.warning("Error handling alert client: %s", e)
+        finally:
+            if pump is not None:
+                pump.cancel()
+            if subscriber is not None:
+                self._drop(subscriber)
+            else:
+                writer.close()
+
+    async def serve_legacy(self, reader, subscriber, leftover):
+        while not subscriber.closed:
+            data = leftover + await reader.read(65536)
+            leftover = b''
+            if not data:
+                break
+            await self.handle_request(json.loads(data.decode()), subscriber)
+
+    async def serve_framed(self, reader, subscriber):
+        while not subscriber.closed:
+            try:
+                request = await alert_protocol.read_frame(reader, subscriber.encoding)
+            except asyncio.IncompleteReadError:
+                break
+            await self.handle_request(request, subscriber)
+
+    async def handle_request(self, request, subscriber):
+        error = alert_protocol.request_error(request)
+        if error:
+            if not subscriber.offer(error_payload(error, subscriber.encoding)):
+                self.disconnected += 1
+                self._drop(subscriber)
+        elif request['type'] == 'get_latest_alert':
+            alert = await self.loop.run_in_executor(None, alerts_db.get_latest_alert)
+            if alert:
+                subscriber.offer(AlertPayloads(alert[1], alert[4]).get(subscriber.encoding))
+        elif request['type'] == 'replay' and subscriber.encoding is not None:
+            since = int(await self.loop.run_in_executor(None, resume_point, request.get('since'),
+                                                        subscriber.subscriber_id))
+            frames = await self.loop.run_in_executor(None, lambda: list(history_frames(since, subscriber.encoding)))
+            # The pump advances the cursor once it has written these
+            if not subscriber.offer(ReplayPayload(b''.join(frame for frame, _ in frames), since, frames[-1][1])):
+                self.disconnected += 1
+                self._drop(subscriber)
+        elif request['type'] == 'ack' and subscriber.subscriber_id:
+            await self.loop.run_in_executor(None, alerts_db.set_alert_cursor,
+                                            subscriber.subscriber_id, int(request['id']))
+        elif request['type'] == 'alert':
+            await self.loop.run_in_executor(None, lambda: alert_bus.publish_alert(
+                request.get('message', ''), bus=self.bus))
+
+    def stats(self):
+        return {
+            'clients': len(self.subscribers),
+            'dropped': self.dropped + sum(s.dropped for s in self.subscribers),
+            'disconnected': self.disconnected,
+        }
+
+
+# Start the event-driven alert server (blocks until interrupted)
+def start_async_alert_server(host=ALERT_SERVER_HOST, port=ALERT_SERVER_PORT, **options):
+    server = AsyncAlertServer(host, port, **options)
+    loop = asyncio.SelectorEventLoop()
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_until_complete(server.serve_forever())
+    finally:
+        loop.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='TCP server that pushes weather alerts to subscribers')
+    parser.add_argument('--host', default=ALERT_SERVER_HOST)
+    parser.add_argument('--port', type=int, default=ALERT_SERVER_PORT)
+    parser.add_argument('--async', dest='use_async', action='store_true',
+                        help='serve every client from one event loop with bounded queues')
+    parser.add_argument('--queue-size', type=int, default=CLIENT_QUEUE_SIZE,
+                        help='alerts queued per client before the slow client policy applies')
+    parser.add_argument('--policy', choices=SLOW_CLIENT_POLICIES, default=SLOW_CLIENT_POLICY,
+                        help='what to do when a client falls behind')
+    args = parser.parse_args(argv)
+
+    import logs
+    logs.configure()
+    if args.use_async:
+        start_async_alert_server(args.host, args.port, queue_size=args.queue_size, policy=args.policy)
+    else:
+        start_alert_server(args.host, args.port, queue_size=args.queue_size, policy=args.policy)
+
 
 if __name__ == "__main__":
-    start_alert_server()
+    main()
@@ -0,0 +1,229 @@
+import json
+import logging
+import os
+import threading
+import time
+import broadcast
+import db
+import migrations
+import offload
+
+try:
+    import redis
+except ImportError:  # only needed for the redis:// backend
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+# Message bus that carries alert events between processes: every Flask-SocketIO
+# worker and every TCP alert server subscribes, so one add_weather_alert reaches
+# all of their clients.
+#
+# WEATHER_ALERT_BUS selects the backend:
+#   'local'       in-process only (single worker, development)
+#   'sqlite'      default; events go through the bus_events table in
+#                 weather_net.db and each process polls for new rows
+#   'redis://...' Redis pub/sub; the same URL is used as Flask-SocketIO's
+#                 message_queue so Socket.IO emits fan out on their own
+
+ALERT_CHANNEL = 'alerts'
+BUS_URL = os.environ.get('WEATHER_ALERT_BUS', 'sqlite')
+POLL_INTERVAL = float(os.environ.get('WEATHER_ALERT_BUS_POLL', '0.05'))
+RETENTION_SECONDS = 300
+
+
+class LocalBus:
+    # SocketIO message_queue URL to use alongside this bus (None: emit locally)
+    socketio_message_queue = None
+
+    def __init__(self):
+        self._subscribers = {}
+        self._lock = threading.Lock()
+
+    # Register callback(event) for a channel; returns a function that unsubscribes
+    def subscribe(self, channel, callback):
+        with self._lock:
+            self._subscribers.setdefault(channel, []).append(callback)
+
+        def unsubscribe():
+            with self._lock:
+                if callback in self._subscribers.get(channel, []):
+                    self._subscribers[channel].remove(callback)
+        return unsubscribe
+
+    def publish(self, channel, event):
+        self._dispatch(channel, event)
+
+    def _dispatch(self, channel, event):
+        with self._lock:
+            callbacks = list(self._subscribers.get(channel, []))
+        for callback in callbacks:
+            try:
+                callback(event)
+            except Exception as e:
+                logger.exception("Error delivering %s event", channel)
+
+    def close(self):
+        pass
+
+
+# Cross-process bus on top of SQLite: publish inserts a row, and a poller
+# thread in every subscribing process dispatches rows newer than the last one
+# it has seen. Old rows are pruned after RETENTION_SECONDS.
+class SQLiteBus(LocalBus):
+    def __init__(self, poll_interval=POLL_INTERVAL):
+        super().__init__()
+        self.poll_interval = poll_interval
+        self._wakeup = threading.Event()
+        self._stopped = threading.Event()
+        self._poller = None
+        self._last_id = None
+
+    def subscribe(self, channel, callback):
+        unsubscribe = super().subscribe(channel, callback)
+        self._start()
+        return unsubscribe
+
+    # Inside the caller's transaction the event goes out when that commits
+    # (and not at all if it rolls back); otherwise it is committed at once
+    def publish(self, channel, event):
+        conn = db.get_connection()
+        conn.execute('SAVEPOINT bus_publish')
+        try:
+            conn.execute('INSERT INTO bus_events (channel, payload, created_at) VALUES (?, ?, ?)',
+                         (channel, json.dumps(event), time.time()))
+        except BaseException:
+            conn.execute('ROLLBACK TO bus_publish')
+            conn.execute('RELEASE bus_publish')
+            raise
+        conn.execute('RELEASE bus_publish')
+        # Deliver to this process's subscribers without waiting for the next poll
+        self._wakeup.set()
+
+    def _start(self):
+        with self._lock:
+            if self._poller is not None:
+                return
+            migrations.migrate()
+            # Only events published from now on are delivered
+            row = db.get_connection().execute('SELECT max(id) FROM bus_events').fetchone()
+            self._last_id = row[0] or 0
+            self._poller = threading.Thread(target=self._poll_forever, name='alert-bus-poller', daemon=True)
+            self._poller.start()
+
+    def _poll_forever(self):
+        polls = 0
+        while not self._stopped.is_set():
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+            try:
+                self.poll()
+                polls += 1
+                if polls % 1000 == 0:
+                    self.prune()
+            except Exception as e:
+                logger.warning("Error polling alert bus: %s", e)
+        db.close_connection()
+
+    def _fetch(self, last_id):
+        return db.get_connection().execute('''
+            SELECT id, channel, payload FROM bus_events WHERE id > ? ORDER BY id LIMIT 1000
+        ''', (last_id,)).fetchall()
+
+    # Dispatch every event newer than the last one seen. The read runs off the
+    # event loop; callbacks run in the poller (a green thread under eventlet/gevent).
+    def poll(self):
+        rows = offload.call(self._fetch, self._last_id)
+        for event_id, channel, payload in rows:
+            self._last_id = event_id
+            self._dispatch(channel, json.loads(payload))
+        return len(rows)
+
+    def prune(self):
+        conn = db.get_connection()
+        with conn:
+            conn.execute('DELETE FROM bus_events WHERE created_at < ?', (time.time() - RETENTION_SECONDS,))
+
+    def close(self):
+        self._stopped.set()
+        self._wakeup.set()
+
+
+class RedisBus(LocalBus):
+    def __init__(self, url):
+        if redis is None:
+            raise RuntimeError("The redis package is required for a redis:// alert bus")
+        super().__init__()
+        self.socketio_message_queue = url
+        self._client = redis.Redis.from_url(url)
+        self._pubsub = self._client.pubsub(ignore_subscribe_messages=True)
+        self._listener = None
+
+    def subscribe(self, channel, callback):
+        unsubscribe = super().subscribe(channel, callback)
+        self._pubsub.subscribe(channel)
+        with self._lock:
+            if self._listener is None:
+                self._listener = threading.Thread(target=self._listen, name='alert-bus-listener', daemon=True)
+                self._listener.start()
+        return unsubscribe
+
+    def publish(self, channel, event):
+        self._client.publish(channel, json.dumps(event))
+
+    def _listen(self):
+        for message in self._pubsub.listen():
+            channel = message['channel']
+            if isinstance(channel, bytes):
+                channel = channel.decode()
+            self._dispatch(channel, json.loads(message['data']))
+
+    def close(self):
+        self._pubsub.close()
+
+
+def create_bus(url=BUS_URL):
+    if url == 'local':
+        return LocalBus()
+    if url == 'sqlite':
+        return SQLiteBus()
+    if url.startswith(('redis://', 'rediss://', 'unix://')):
+        return RedisBus(url)
+    raise ValueError(f"Unknown alert bus: {url}")
+
+
+_bus = None
+_bus_lock = threading.Lock()
+_external_socketio = None
+
+
+# Process-wide bus, created on first use
+def get_bus():
+    global _bus
+    with _bus_lock:
+        if _bus is None:
+            _bus = create_bus()
+        return _bus
+
+
+# Write-only Socket.IO emitter for processes that aren't the Flask app, for
+# buses that share their Redis instance with Socket.IO
+def external_socketio(bus):
+    global _external_socketio
+    if _external_socketio is None:
+        from flask_socketio import SocketIO
+        _external_socketio = SocketIO(message_queue=bus.socketio_message_queue)
+    return _external_socketio
+
+
+# Publish a stored alert to every process. When Socket.IO fans out through the
+# same Redis instance, also emit to Socket.IO clients from here (unless the
+# caller does that itself, emit_socketio=False), as a batch of one in the shape
+# the web workers' scheduler sends; otherwise each web worker re-emits the bus
+# event to its own clients (see app.py).
+def publish_alert(message, alert_id=None, city=None, socketio=None, bus=None, emit_socketio=True):
+    bus = bus or get_bus()
+    bus.publish(ALERT_CHANNEL, {'message': message, 'id': alert_id, 'city': city, 'sent_at': time.time()})
+    if bus.socketio_message_queue and emit_socketio:
+        alert = {'city': city or 'Global', 'message': message, 'id': alert_id, 'merged': 0}
+        (socketio or external_socketio(bus)).emit('new_alert', broadcast.batch_event([alert]))
@@ -0,0 +1,187 @@
+import json
+import struct
+
+try:
+    import msgpack
+except ImportError:  # msgpack is optional; JSON is always available
+    msgpack = None
+
+# Framed wire protocol for the alert server.
+#
+# Every frame is a 4-byte big-endian payload length followed by the payload.
+# A framed client opens with a JSON-encoded hello frame:
+#     {"type": "hello", "version": 1, "encoding": "json" | "msgpack",
+#      "since": <alert id>, "subscriber": <stable client id>}
+# and the server answers with a welcome frame in the same (JSON) encoding:
+#     {"type": "welcome", "version": 1, "encoding": <accepted encoding>}
+# After that both sides use the negotiated encoding. History newer than
+# "since" is replayed as "alerts" frames of up to REPLAY_BATCH_SIZE alerts,
+# followed by {"type": "replay_done", "last_id": <id>}.
+#
+# A client that names itself with "subscriber" may leave out "since": the
+# server then resumes from the last id it delivered to that subscriber, which
+# advances once a replay has been written to it and on
+# {"type": "ack", "id": <alert id>} frames.
+#
+# A request the server can't act on (not an object, no "type", a bad "id") is
+# answered with {"type": "error", "message": <reason>} and the connection
+# stays open.
+#
+# Clients that don't send a hello (they never send anything before reading)
+# are served the old unframed protocol: one bare JSON object per alert.
+
+PROTOCOL_VERSION = 1
+HEADER = struct.Struct('>I')
+MAX_FRAME_SIZE = 16 * 1024 * 1024
+REPLAY_BATCH_SIZE = 500
+
+ENCODINGS = ('json', 'msgpack') if msgpack else ('json',)
+
+
+class ProtocolError(Exception):
+    pass
+
+
+def _dumps(message, encoding):
+    if encoding == 'msgpack':
+        return msgpack.packb(message, use_bin_type=True)
+    return json.dumps(message, separators=(',', ':')).encode()
+
+
+def _loads(payload, encoding):
+    if encoding == 'msgpack':
+        return msgpack.unpackb(payload, raw=False)
+    return json.loads(payload)
+
+
+# Encode one message as a length-prefixed frame
+def encode_frame(message, encoding='json'):
+    payload = _dumps(message, encoding)
+    if len(payload) > MAX_FRAME_SIZE:
+        raise ProtocolError(f"Frame of {len(payload)} bytes exceeds {MAX_FRAME_SIZE}")
+    return HEADER.pack(len(payload)) + payload
+
+
+# Encode several messages into one buffer, ready for a single send
+def encode_frames(messages, encoding='json'):
+    return b''.join(encode_frame(message, encoding) for message in messages)
+
+
+# Incremental decoder: feed it whatever recv() returned and get back every
+# complete message, however the stream was split or coalesced.
+class FrameDecoder:
+    def __init__(self, encoding='json'):
+        self.encoding = encoding
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        self._buffer += data
+        messages = []
+        while len(self._buffer) >= HEADER.size:
+            (length,) = HEADER.unpack_from(self._buffer)
+            if length > MAX_FRAME_SIZE:
+                raise ProtocolError(f"Frame of {length} bytes exceeds {MAX_FRAME_SIZE}")
+            end = HEADER.size + length
+            if len(self._buffer) < end:
+                break
+            messages.append(_loads(bytes(self._buffer[HEADER.size:end]), self.encoding))
+            del self._buffer[:end]
+        return messages
+
+
+# Build the client's opening frame
+def hello(encoding='json', since=None, subscriber=None):
+    message = {"type": "hello", "version": PROTOCOL_VERSION, "encoding": encoding}
+    if since is not None:
+        message['since'] = since
+    if subscriber is not None:
+        message['subscriber'] = subscriber
+    return encode_frame(message)
+
+
+# Validate a hello message and return (encoding, since, subscriber) for the
+# session; since is None when the client wants to resume from its cursor
+def accept_hello(message):
+    if message.get('type') != 'hello':
+        raise ProtocolError("Expected a hello frame")
+    if message.get('version') != PROTOCOL_VERSION:
+        raise ProtocolError(f"Unsupported protocol version: {message.get('version')}")
+    encoding = message.get('encoding', 'json')
+    if encoding not in ENCODINGS:
+        encoding = 'json'
+    since = message.get('since')
+    subscriber = message.get('subscriber')
+    return encoding, (int(since) if since is not None else None), (str(subscriber) if subscriber else None)
+
+
+def welcome(encoding):
+    return encode_frame({"type": "welcome", "version": PROTOCOL_VERSION, "encoding": encoding})
+
+
+# Return why a request frame can't be handled, or None if it looks valid
+def request_error(request):
+    if not isinstance(request, dict):
+        return "Request must be an object"
+    if not isinstance(request.get('type'), str):
+        return "Request has no type"
+    if request['type'] == 'ack':
+        try:
+            int(request['id'])
+        except (KeyError, TypeError, ValueError):
+            return "Ack needs an integer id"
+    if request['type'] == 'replay' and request.get('since') is not None:
+        try:
+            int(request['since'])
+        except (TypeError, ValueError):
+            return "Replay since must be an integer"
+    return None
+
+
+# Turn alert rows (id, city, alert_description, username, timestamp) into
+# replay frames of at most batch_size alerts each
+def replay_frames(rows, encoding='json', batch_size=REPLAY_BATCH_SIZE):
+    batch = []
+    for alert_id, city, description, username, timestamp in rows:
+        batch.append({"id": alert_id, "city": city, "message": description,
+                      "username": username, "timestamp": timestamp})
+        if len(batch) == batch_size:
+            yield encode_frame({"type": "alerts", "alerts": batch}, encoding)
+            batch = []
+    if batch:
+        yield encode_frame({"type": "alerts", "alerts": batch}, encoding)
+
+
+# Blocking helpers for plain sockets
+def send_frame(sock, message, encoding='json'):
+    sock.sendall(encode_frame(message, encoding))
+
+
+def recv_exactly(sock, size, eof_ok=False):
+    data = bytearray()
+    while len(data) < size:
+        chunk = sock.recv(size - len(data))
+        if not chunk:
+            if eof_ok and not data:
+                return None
+            raise ConnectionError("Connection closed mid-frame")
+        data += chunk
+    return bytes(data)
+
+
+# Returns None when the peer closes the connection between frames
+def recv_frame(sock, encoding='json'):
+    header = recv_exactly(sock, HEADER.size, eof_ok=True)
+    if header is None:
+        return None
+    (length,) = HEADER.unpack(header)
+    if length > MAX_FRAME_SIZE:
+        raise ProtocolError(f"Frame of {length} bytes exceeds {MAX_FRAME_SIZE}")
+    return _loads(recv_exactly(sock, length), encoding)
+
+
+# asyncio helper for StreamReader
+async def read_frame(reader, encoding='json'):
+    (length,) = HEADER.unpack(await reader.readexactly(HEADER.size))
+    if length > MAX_FRAME_SIZE:
+        raise ProtocolError(f"Frame of {length} bytes exceeds {MAX_FRAME_SIZE}")
+    return _loads(await reader.readexactly(length), encoding)
@@ -1,41 +1,37 @@
 import sqlite3
+import db
+import data_versions
+import migrations
 
-# Path to SQLite database file for alerts
-DATABASE = 'weather_net.db'
+# Path to SQLite database file (the connection pool lives in db.py)
+DATABASE = db.DATABASE
 
-# Connect to the SQLite database
+# Get the pooled connection for the current thread; callers must not close it
 def connect_db():
-    conn = sqlite3.connect(DATABASE)
-    return conn
+    return db.get_connection()
 
-# Create alerts table if it doesn't exist
+# Create alerts table if it doesn't exist (part of the versioned schema)
 def create_alerts_table():
-    conn = connect_db()
-    cursor = conn.cursor()
-
-    cursor.execute('''CREATE TABLE IF NOT EXISTS alerts (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        city TEXT NOT NULL,
-                        alert_description TEXT NOT NULL,
-                        username TEXT NOT NULL,
-                        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
-                      )''')
-
-    conn.commit()
-    conn.close()
+    return migrations.migrate()
 
-# Add a weather alert to the database
-def add_weather_alert(city, description, username):
+# Add a weather alert to the database and return its id. With commit=False the
+# insert joins the caller's transaction (e.g. a background job's).
+# If idempotency_key was already used, nothing is inserted and None is returned.
+def add_weather_alert(city, description, username, commit=True, idempotency_key=None):
     conn = connect_db()
     cursor = conn.cursor()
 
     cursor.execute('''
-        INSERT INTO alerts (city, alert_description, username)
-        VALUES (?, ?, ?)
-    ''', (city, description, username))
+        INSERT INTO alerts (city, alert_description, username, idempotency_key)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (idempotency_key) WHERE idempotency_key IS NOT NULL DO NOTHING
+    ''', (city, description, username, idempotency_key))
+    if cursor.rowcount:
+        data_versions.bump(data_versions.ALERTS, conn)
 
-    conn.commit()
-    conn.close()
+    if commit:
+        conn.commit()
+    return cursor.lastrowid if cursor.rowcount else None
 
 # Retrieve all weather alerts from the database
 def get_weather_alerts():
@@ -48,20 +44,122 @@ def get_weather_alerts():
         ORDER BY timestamp DESC
     ''')
     alerts = cursor.fetchall()
-    conn.close()
 
     return alerts
 
-# Retrieve unsent alerts (if needed for future functionality like real-time updates)
-def get_unsent_alerts():
+# Default and maximum number of alerts per page
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 1000
+
+
+# Encode the (timestamp, id) of the last row on a page as an opaque cursor
+def encode_cursor(timestamp, alert_id):
+    return f"{timestamp}|{alert_id}"
+
+
+# Decode a cursor from encode_cursor(); returns None for a missing or bad cursor
+def decode_cursor(cursor):
+    if not cursor:
+        return None
+    timestamp, _, alert_id = cursor.rpartition('|')
+    if not timestamp or not alert_id.isdigit():
+        return None
+    return timestamp, int(alert_id)
+
+
+# Iterate over alerts newest first, starting after `cursor`, without loading
+# the whole result set. Rows are (city, alert_description, username, timestamp, id).
+def iter_alerts(limit=PAGE_SIZE, cursor=None, city=None, username=None, since=None, until=None):
+    clauses = []
+    params = []
+    position = decode_cursor(cursor)
+    if position:
+        clauses.append('(timestamp, id) < (?, ?)')
+        params.extend(position)
+    if city:
+        clauses.append('city = ?')
+        params.append(city)
+    if username:
+        clauses.append('username = ?')
+        params.append(username)
+    if since:
+        clauses.append('timestamp >= ?')
+        params.append(since)
+    if until:
+        clauses.append('timestamp < ?')
+        params.append(until)
+
+    where = ('WHERE ' + ' AND '.join(clauses)) if clauses else ''
+    # One row over the maximum lets callers detect a following page
+    params.append(max(1, min(int(limit), MAX_PAGE_SIZE + 1)))
+
     conn = connect_db()
-    cursor = conn.cursor()
+    yield from conn.execute(f'''
+        SELECT city, alert_description, username, timestamp, id
+        FROM alerts
+        {where}
+        ORDER BY timestamp DESC, id DESC
+        LIMIT ?
+    ''', params)
 
-    cursor.execute('''
-        SELECT city, alert_description, username, timestamp 
+
+# Retrieve one page of alerts using keyset pagination on (timestamp, id).
+# Returns (alerts, next_cursor); next_cursor is None on the last page.
+def get_alerts_page(limit=PAGE_SIZE, cursor=None, city=None, username=None, since=None, until=None):
+    limit = max(1, min(int(limit), MAX_PAGE_SIZE))
+    # Fetch one extra row to find out whether another page follows
+    alerts = list(iter_alerts(limit + 1, cursor, city, username, since, until))
+    next_cursor = None
+    if len(alerts) > limit:
+        alerts = alerts[:limit]
+        next_cursor = encode_cursor(alerts[-1][3], alerts[-1][4])
+    return alerts, next_cursor
+
+# Retrieve up to `limit` alerts with an id above since_id, oldest first.
+# Rows are (id, city, alert_description, username, timestamp).
+def get_alerts_since(since_id=0, limit=500):
+    conn = connect_db()
+    return conn.execute('''
+        SELECT id, city, alert_description, username, timestamp
         FROM alerts
-    ''')
-    alerts = cursor.fetchall()
-    conn.close()
+        WHERE id > ?
+        ORDER BY id
+        LIMIT ?
+    ''', (since_id, limit)).fetchall()
 
-    return alerts
+# Retrieve the most recent alert as (city, alert_description, username, timestamp, id)
+def get_latest_alert():
+    conn = connect_db()
+    return conn.execute('''
+        SELECT city, alert_description, username, timestamp, id
+        FROM alerts
+        WHERE id = (SELECT max(id) FROM alerts)
+    ''').fetchone()
+
+# Last alert id delivered to a subscriber (0 if it has never connected)
+def get_alert_cursor(subscriber):
+    conn = connect_db()
+    row = conn.execute('SELECT last_id FROM alert_cursors WHERE subscriber = ?', (subscriber,)).fetchone()
+    return row[0] if row else 0
+
+# Record that a subscriber has seen every alert up to last_id; cursors never move back
+def set_alert_cursor(subscriber, last_id):
+    conn = connect_db()
+    conn.execute('''
+        INSERT INTO alert_cursors (subscriber, last_id) VALUES (?, ?)
+        ON CONFLICT (subscriber) DO UPDATE
+        SET last_id = max(last_id, excluded.last_id), updated_at = CURRENT_TIMESTAMP
+    ''', (subscriber, last_id))
+    conn.commit()
+
+# Retrieve up to `limit` alerts the subscriber hasn't seen yet, oldest first.
+# Rows are (city, alert_description, username, timestamp, id).
+def get_unsent_alerts(subscriber, limit=500):
+    conn = connect_db()
+    return conn.execute('''
+        SELECT city, alert_description, username, timestamp, id
+        FROM alerts
+        WHERE id > ?
+        ORDER BY id
+        LIMIT ?
+    ''', (get_alert_cursor(subscriber), limit)).fetchall()
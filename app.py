@@ -1,108 +1,243 @@
-from flask import Flask, render_template, request, redirect, url_for, session, flash
-from flask_socketio import SocketIO, emit
+from flask import Flask, Request, render_template, request, redirect, url_for, session, flash, jsonify, Response, stream_with_context, g
+from flask_socketio import SocketIO, emit, join_room, leave_room
 import user_db
+import auth
+import file_store
+import file_reconciler
+import downloads
 import alerts_db
+import migrations
+import alert_bus
+import broadcast
+import job_queue
+import timeseries
+import forecast_updates
+import offload
+import data_versions
+import page_cache
+import logs
+import metrics
+from city_index import city_index
+from presence import presence
+from forecast_cache import forecast_cache
+import datetime
 from datetime import timedelta
-from flask import send_from_directory
+from flask import abort
+from werkzeug.middleware.proxy_fix import ProxyFix
+from werkzeug.utils import safe_join
 import os
 import shutil
+import time
+import json
+import hashlib
+import functools
+import logging
+import threading
+import uuid
 
 
 
+logger = logging.getLogger(__name__)
+
+# Uploaded form files are parsed straight into a hashing temp file in the
+# store's partial folder, so /upload saves them without spooling and copying
+class UploadRequest(Request):
+    def _get_file_stream(self, total_content_length, content_type, filename=None, content_length=None):
+        return file_store.HashingSpool()
+
 app = Flask(__name__)
-socketio = SocketIO(app)  # Initialize SocketIO with Flask
+app.request_class = UploadRequest
+# Bound to the app by create_app(); with a Redis alert bus, emits fan out to every worker through it
+socketio = SocketIO()
 
-# Define the path for deleted files
+# Define the path for deleted files (create_app() creates the folder)
 DELETED_FILES_FOLDER = './deleted_files'
 app.config['DELETED_FILES_FOLDER'] = DELETED_FILES_FOLDER
 
-# Create the folder if it doesn't exist
-os.makedirs(DELETED_FILES_FOLDER, exist_ok=True)
-
 
 UPLOAD_FOLDER = './uploads'
 ALLOWED_EXTENSIONS = {'txt', 'pdf', 'png', 'jpg', 'jpeg', 'gif'}
 app.config['UPLOAD_FOLDER'] = UPLOAD_FOLDER
-os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+file_store.STORAGE_ROOT = UPLOAD_FOLDER
+
+# How downloads leave the worker: 'x-accel' or 'x-sendfile' (a proxy in front
+# sends the file), or '' (the worker sends it; zero-copy only under Gunicorn,
+# copied through the worker under serve.py). See downloads.py.
+app.config['DOWNLOAD_OFFLOAD'] = os.environ.get('WEATHER_DOWNLOAD_OFFLOAD', '')
+app.config['DOWNLOAD_ACCEL_PREFIX'] = os.environ.get('WEATHER_DOWNLOAD_ACCEL_PREFIX', '/protected/')
     
-# Server configuration
-MAIN_SERVER_HOST = '127.0.0.1'
-MAIN_SERVER_PORT = 5000
-ALERT_SERVER_HOST = '127.0.0.1'
-ALERT_SERVER_PORT = 5003
+# Server configuration (serve.py and the development server below read these)
+MAIN_SERVER_HOST = os.environ.get('WEATHER_HOST', '127.0.0.1')
+MAIN_SERVER_PORT = int(os.environ.get('WEATHER_PORT', '5000'))
+ALERT_SERVER_HOST = os.environ.get('WEATHER_ALERT_HOST', '127.0.0.1')
+ALERT_SERVER_PORT = int(os.environ.get('WEATHER_ALERT_PORT', '5003'))
+
+# Proxies in front of the app whose X-Forwarded-For/-Proto/-Host are trusted.
+# With 0 (direct exposure) request.remote_addr is the peer's own address; the
+# login throttle keys on it, so set this behind nginx or a load balancer.
+PROXY_HOPS = int(os.environ.get('WEATHER_PROXY_HOPS', '0'))
+if PROXY_HOPS:
+    app.wsgi_app = ProxyFix(app.wsgi_app, x_for=PROXY_HOPS, x_proto=PROXY_HOPS, x_host=PROXY_HOPS)
 
 # Flask secret key and session timeout
 app.secret_key = 'your_secret_key'  # Replace with a secure key
 app.config['PERMANENT_SESSION_LIFETIME'] = timedelta(minutes=30)
 
-# Global list to keep track of connected users
-connected_users = []
+# Users listed on the dashboard; /view_clients pages through the rest
+DASHBOARD_ONLINE_USERS = 20
 
 # Function to check if the file has a valid extension
 def allowed_file(filename):
     return '.' in filename and filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
 
-# Function to send alert to the alert server and broadcast via SocketIO
-def send_to_alert_server(alert_message):
-    try:
-        # Store the alert in the database
-        alerts_db.add_weather_alert('Global', alert_message, session['username'])
-
-        # Broadcast the alert to all connected clients using WebSocket (SocketIO)
-        socketio.emit('new_alert', {'message': alert_message}, room=None)  # This is for older versions of Flask-SocketIO
-        print(f"Sent alert to all connected users: {alert_message}")
-    except Exception as e:
-        print(f"Error sending alert: {e}")
-
-
-
-# Function to search weather data from the database based on the city name
+# socketio.emit (or `send`, e.g. flask_socketio.emit inside a handler),
+# counted and timed per event
+def emit_event(event, data, send=None, **kwargs):
+    send = send or socketio.emit
+    if not metrics.ENABLED:
+        return send(event, data, **kwargs)
+    with metrics.socketio_emit_duration.time(event):
+        send(event, data, **kwargs)
+    metrics.socketio_emits.inc(event)
+
+# Emit one micro-batch of coalesced alerts (see broadcast.batch_event)
+def emit_alert_batch(alerts):
+    if metrics.ENABLED:
+        metrics.broadcast_batch_size.observe(value=len(alerts))
+    emit_event('new_alert', broadcast.batch_event(alerts))
+
+# Alerts submitted within one window are sent together, grouped by city
+alert_scheduler = broadcast.BroadcastScheduler(emit_alert_batch, start_task=socketio.start_background_task)
+# Per-user token buckets for alert/file events sent by Socket.IO clients
+inbound_limiter = broadcast.RateLimiter()
+
+# Durable background jobs for side effects that requests shouldn't wait for
+jobs = job_queue.JobQueue(start_task=socketio.start_background_task)
+
+# Queue, broadcast and presence state, read when /metrics is scraped
+metrics.registry.register(metrics.Gauge(
+    'weather_jobs', 'Background jobs by state', ('state',),
+    collect=lambda: {(state,): value for state, value in jobs.stats().items()
+                     if state in ('pending', 'ready', 'failed_jobs')}))
+metrics.registry.register(metrics.Gauge(
+    'weather_broadcast_alerts_total', 'Alerts through the broadcast scheduler by stage', ('stage',),
+    collect=lambda: {(stage,): value for stage, value in alert_scheduler.stats().items() if stage != 'pending'},
+    kind='counter'))
+metrics.registry.register(metrics.Gauge(
+    'weather_online_users', 'Users currently online', collect=lambda: {(): presence.count()}))
+metrics.registry.register(metrics.Gauge(
+    'weather_forecast_cache_events_total', 'Forecast cache lookups and removals by kind', ('kind',),
+    collect=lambda: {(kind,): value for kind, value in forecast_cache.stats().items() if kind != 'entries'},
+    kind='counter'))
+metrics.registry.register(metrics.Gauge(
+    'weather_forecast_cache_entries', 'Cities in the forecast cache',
+    collect=lambda: {(): forecast_cache.stats()['entries']}))
+metrics.registry.register(metrics.Gauge(
+    'weather_page_cache_requests_total', 'Cached page lookups by outcome', ('outcome',),
+    collect=lambda: {(outcome,): value for outcome, value in page_cache.page_cache.stats().items()
+                     if outcome != 'entries'},
+    kind='counter'))
+
+# Data that cached pages depend on
+page_cache.register_source(data_versions.ALERTS, functools.partial(data_versions.get, data_versions.ALERTS))
+page_cache.register_source(data_versions.FILES, functools.partial(data_versions.get, data_versions.FILES))
+page_cache.register_source(data_versions.PRESENCE, presence.version)
+
+# Job: store an alert and, in the same transaction, queue its broadcast. Nothing
+# queues these any more; the handler drains jobs left by older versions.
+@jobs.handler('alert.persist')
+def persist_alert_job(payload):
+    alert_id = alerts_db.add_weather_alert(payload['city'], payload['message'], payload['username'], commit=False,
+                                           idempotency_key=payload.get('idempotency_key'))
+    if alert_id is None:
+        return  # Already stored under this idempotency key
+    jobs.enqueue('alert.publish', {'city': payload['city'], 'message': payload['message'], 'id': alert_id},
+                 commit=False)
+
+# Job: publish a stored alert to every web worker and TCP alert server through the alert bus
+@jobs.handler('alert.publish')
+def publish_alert_job(payload):
+    bus = alert_bus.get_bus()
+    alert_bus.publish_alert(payload['message'], payload['id'], payload['city'], bus=bus, emit_socketio=False)
+    if bus.socketio_message_queue:
+        # Socket.IO fans out through Redis, so this worker schedules the emit for everyone
+        alert_scheduler.submit(payload['city'], payload['message'], payload['id'])
+
+# Job: push a committed forecast change to the viewers of its city in every worker
+@jobs.handler('forecast.publish')
+def publish_forecast_job(payload):
+    forecast_updates.publish(payload, send=emit_event)
+
+# Job: soft-delete a file, moving legacy content to the deleted files folder
+@jobs.handler('file.soft_delete')
+def soft_delete_file_job(payload):
+    metadata = user_db.get_file(payload['file_id'])
+    if metadata and not metadata['deleted']:
+        file_store.soft_delete(metadata, metadata['filename'], payload['deleted_folder'])
+
+# Key for rate limiting an inbound Socket.IO event: the user, else the connection
+def socket_client_key():
+    return session.get('username') or request.sid
+
+# Re-emit alerts published on the bus (by any process) to this worker's Socket.IO clients
+def emit_bus_alert(event):
+    alert_scheduler.submit(event.get('city') or 'Global', event['message'], event.get('id'))
+
+# Push forecast changes published on the bus to this worker's viewers of the
+# city, and drop its cached forecast without waiting for the version check
+def emit_bus_forecast(event):
+    forecast_cache.invalidate(*event.get('cities', [event.get('city')]))
+    forecast_updates.emit(event, emit_event)
+
+# Subscribe this worker to the alert bus. Not needed when Socket.IO itself fans
+# out through the bus's Redis message queue.
+def subscribe_to_alert_bus():
+    bus = alert_bus.get_bus()
+    if not bus.socketio_message_queue:
+        bus.subscribe(alert_bus.ALERT_CHANNEL, emit_bus_alert)
+        bus.subscribe(forecast_updates.FORECAST_CHANNEL, emit_bus_forecast)
+
+# Function to search weather data based on the city name (served from the forecast
+# cache; misses query the database off the event loop)
 def search_weather_data(city):
-    conn = user_db.connect_db()
-    cursor = conn.cursor()
-
-    # Retrieve weather information for a specific city ordered by date
-    cursor.execute('''
-        SELECT date, temperature, condition 
-        FROM weather_data 
-        WHERE city = ?
-        ORDER BY date
-    ''', (city,))
-    
-    weather_info = cursor.fetchall()
-    conn.close()        
+    return forecast_cache.get(city, lambda city: offload.call(user_db.search_weather_data, city))
 
-    return weather_info
-
-# Function to update weather data
-def update_weather_data(city, date, temperature, condition, alert_description=None):
-    conn = user_db.connect_db()
-    cursor = conn.cursor()
+# Whether a URL segment is a date in the YYYY-MM-DD form the weather_data
+# table stores (and its CHECK constraint enforces)
+def valid_date(value):
+    try:
+        return datetime.date.fromisoformat(value).isoformat() == value
+    except ValueError:
+        return False
 
-    # First, try to update the weather data for the specific city on a specific date
-    cursor.execute('''
-        UPDATE weather_data
-        SET temperature = ?, condition = ?
-        WHERE city = ? AND date = ? AND condition = ?
-    ''', (temperature, condition, city, date, condition))
+# Idempotency key for an alert, from the client's Idempotency-Key header or
+# the idempotency_key form field (a nonce rendered into each update form), so
+# a retried request or double-submitted form stores the alert once. Keys are
+# scoped to the user. Without one, every submission stores its alert.
+def alert_idempotency_key(username):
+    key = request.headers.get('Idempotency-Key') or request.form.get('idempotency_key')
+    if not key:
+        return None
+    return hashlib.sha256(f'{username}\x1f{key}'.encode()).hexdigest()
 
-    # If no rows were updated (meaning the record didn't exist), insert a new one
-    if cursor.rowcount == 0:
-        cursor.execute('''
-            INSERT INTO weather_data (city, date, temperature, condition)
-            VALUES (?, ?, ?, ?)
-        ''', (city, date, temperature, condition))
+# Function to update weather data. The weather row and the alert (if any) are
+# written in one transaction, together with the jobs that broadcast the alert
+# and push the change to the city's viewers.
+def update_weather_data(city, date, temperature, condition, alert_description=None, idempotency_key=None):
+    username = session['username']  # Assuming username is available in the session
 
-    conn.commit()
+    # Queue the broadcast in the same transaction as the alert it announces
+    def queue_broadcast(alert_id):
+        jobs.enqueue('alert.publish', {'city': city, 'message': alert_description, 'id': alert_id},
+                     commit=False)
 
-    # If an alert description is provided, add the alert to the alerts database
-    if alert_description:
-        username = session['username']  # Assuming username is available in the session
-        alerts_db.add_weather_alert(city, alert_description, username)  # Store the alert in the database
-        # Optionally, broadcast the alert to clients (this can be done via SocketIO, for example)
-        send_to_alert_server(alert_description)  # This would call your function to broadcast
+    def queue_forecast_update(delta):
+        jobs.enqueue('forecast.publish', delta, commit=False)
 
-    conn.close()
+    alert_id = user_db.update_weather(city, date, temperature, condition, username, alert_description,
+                                      idempotency_key, on_alert=queue_broadcast, on_change=queue_forecast_update)
+    forecast_cache.invalidate(city)
+    return alert_id
 
 
 
@@ -132,10 +267,16 @@ def login():
         username = request.form['username']
         password = request.form['password']
 
-        if user_db.verify_login(username, password):
-            if username not in connected_users:
-                connected_users.append(username)
+        try:
+            valid, retry_after = auth.authenticate(username, password, request.remote_addr)
+        except auth.Overloaded:
+            return "Too many logins in progress, please try again", 503, {'Retry-After': '1'}
+        if retry_after:
+            return ("Too many failed login attempts, please try again later", 429,
+                    {'Retry-After': str(int(retry_after) + 1)})
 
+        if valid:
+            presence.seen(username)
             session['username'] = username
             session.permanent = True
             return redirect(url_for('dashboard'))
@@ -146,6 +287,7 @@ def login():
 
 # User dashboard
 @app.route('/dashboard')
+@page_cache.cached(data_versions.PRESENCE)
 def dashboard():
     if 'username' not in session:
         return redirect(url_for('login'))
@@ -159,7 +301,10 @@ def dashboard():
         {"name": "Exit", "link": "/logout"},
         {"name": "View All Connected Users", "link": "/view_clients"}
     ]
-    return render_template('dashboard.html', options=options, connected_users=connected_users, username=username)
+    online, next_cursor = presence.page(limit=DASHBOARD_ONLINE_USERS)
+    return render_template('dashboard.html', options=options, username=username,
+                           connected_users=[user['username'] for user in online],
+                           online_count=presence.count(), more_online=next_cursor is not None)
 
 @app.route('/select_city', methods=['GET', 'POST'])
 def select_city():
@@ -167,28 +312,73 @@ def select_city():
         return redirect(url_for('login'))
 
     if request.method == 'POST':
-        selected_city = request.form['city']
+        # Accept any spelling or alias the city registry knows
+        selected_city = city_index.resolve(request.form['city']) or request.form['city']
         weather_info = search_weather_data(selected_city)
 
         if weather_info:
-            seen = set()
-            unique_weather_info = []
-            for day in weather_info:
-                if (day[0], day[1], day[2]) not in seen:
-                    seen.add((day[0], day[1], day[2]))
-                    unique_weather_info.append(day)
-
+            # Rows are unique per (date, condition) in the database already
             return render_template('select_city.html',
                                    location=selected_city,
-                                   weather_info=unique_weather_info,
+                                   weather_info=weather_info,
                                    city=selected_city)
 
+        # Nothing found: offer the closest known cities instead
+        return render_template('select_city.html', suggestions=city_index.suggest(selected_city))
+
     return render_template('select_city.html')
 
+# Autocomplete for city names and aliases: /api/cities?prefix=mon&limit=10
+@app.route('/api/cities', methods=['GET'])
+def api_cities():
+    if 'username' not in session:
+        return jsonify({'error': 'login required'}), 401
+
+    limit = request.args.get('limit', 10, type=int)
+    return jsonify({'cities': city_index.search(request.args.get('prefix', ''), limit)})
+
+# Daily observations for a city between ?start= and ?end= (YYYY-MM-DD, inclusive)
+@app.route('/api/weather/<city>/series', methods=['GET'])
+def api_weather_series(city):
+    if 'username' not in session:
+        return jsonify({'error': 'login required'}), 401
+
+    try:
+        days = offload.call(timeseries.series, city, request.args.get('start'), request.args.get('end'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'city': city, 'days': [{'date': date, 'temperature': temperature, 'condition': condition}
+                                           for date, temperature, condition in days]})
+
+# Precomputed ?period=day|week|month rollups for a city between ?start= and ?end=
+@app.route('/api/weather/<city>/rollups', methods=['GET'])
+def api_weather_rollups(city):
+    if 'username' not in session:
+        return jsonify({'error': 'login required'}), 401
+
+    try:
+        rollups = offload.call(timeseries.rollups, city, request.args.get('period', 'month'),
+                               request.args.get('start'), request.args.get('end'))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    return jsonify({'city': city, 'rollups': rollups})
+
+# Forecast changes for clients that aren't on Socket.IO: ?since=<version> gives
+# a delta with the rows changed since then, or a snapshot (see forecast_updates.py)
+@app.route('/api/weather/<city>/changes', methods=['GET'])
+def api_weather_changes(city):
+    if 'username' not in session:
+        return jsonify({'error': 'login required'}), 401
+
+    kind, update = offload.call(forecast_updates.catch_up, city, request.args.get('since'))
+    return jsonify(dict(update, type='delta' if kind == 'forecast_delta' else 'snapshot'))
+
 @app.route('/update_weather/<city>/<date>', methods=['GET', 'POST'])
 def update_weather(city, date):
     if 'username' not in session:
         return redirect(url_for('login'))
+    if not valid_date(date):
+        return "Invalid date, expected YYYY-MM-DD", 400
 
     if request.method == 'POST':
         temperature = request.form['temperature']
@@ -196,12 +386,11 @@ def update_weather(city, date):
         alert = request.form.get('alert')  # Check if the alert checkbox is checked
         alert_description = request.form.get('alert_description', '')
 
-        # Update weather data
-        update_weather_data(city, date, temperature, condition)
-
-        if alert and alert_description:  # If alert is checked and description is provided
-            username = session['username']
-            send_to_alert_server(alert_description)  # Save the alert and broadcast to clients
+        # Update weather data, and save and broadcast the alert if it is checked and described
+        if not (alert and alert_description):
+            alert_description = None
+        key = alert_idempotency_key(session['username'])
+        update_weather_data(city, date, temperature, condition, alert_description, key)
 
         weather_info = search_weather_data(city)
 
@@ -213,7 +402,7 @@ def update_weather(city, date):
 
         if weather_for_date:
             return render_template('update_weather.html', city=city, date=date, weather=weather_for_date,
-                                   message="Weather data updated successfully!")
+                                   idempotency_key=uuid.uuid4().hex, message="Weather data updated successfully!")
 
     weather_info = search_weather_data(city)
     weather_for_date = None
@@ -223,54 +412,149 @@ def update_weather(city, date):
             break
 
     if weather_for_date:
-        return render_template('update_weather.html', city=city, date=date, weather=weather_for_date)
+        return render_template('update_weather.html', city=city, date=date, weather=weather_for_date,
+                               idempotency_key=uuid.uuid4().hex)
 
     return "Weather data for this date not found", 404
 
-# Route for viewing alerts
+# Read the alert filters shared by /alerts and /api/alerts from the query string
+def alert_filters():
+    return {
+        'cursor': request.args.get('cursor'),
+        'city': request.args.get('city'),
+        'username': request.args.get('user'),
+        'since': request.args.get('since'),
+        'until': request.args.get('until'),
+    }
+
+# Route for viewing alerts, one page at a time
 @app.route('/alerts', methods=['GET'])
+@page_cache.cached(data_versions.ALERTS)
 def alerts():
     if 'username' not in session:
         return redirect(url_for('login'))
 
     try:
-        # Retrieve all alerts from the alerts_db
-        alerts = alerts_db.get_weather_alerts()  # Make sure this function returns all alerts
-        return render_template('weather_alerts.html', alerts=alerts)
+        limit = request.args.get('limit', alerts_db.PAGE_SIZE, type=int)
+        alerts, next_cursor = offload.call(alerts_db.get_alerts_page, limit, **alert_filters())
+        return render_template('weather_alerts.html', alerts=alerts, next_cursor=next_cursor)
     except Exception as e:
         return f"Error loading alerts: {e}", 500
 
+# JSON API for alerts; rows are streamed out as they are read from the database
+@app.route('/api/alerts', methods=['GET'])
+def api_alerts():
+    if 'username' not in session:
+        return jsonify({'error': 'login required'}), 401
+
+    limit = request.args.get('limit', alerts_db.PAGE_SIZE, type=int)
+    limit = max(1, min(limit, alerts_db.MAX_PAGE_SIZE))
+    filters = alert_filters()
+
+    def generate():
+        yield '{"alerts": ['
+        last = None
+        count = 0
+        # One extra row tells us whether there is a next page
+        for row in alerts_db.iter_alerts(limit + 1, **filters):
+            if count == limit:
+                break
+            city, description, username, timestamp, alert_id = row
+            yield (',' if count else '') + json.dumps({
+                'id': alert_id, 'city': city, 'description': description,
+                'username': username, 'timestamp': timestamp,
+            })
+            last = row
+            count += 1
+        else:
+            last = None
+        next_cursor = alerts_db.encode_cursor(last[3], last[4]) if last else None
+        yield '], "next_cursor": ' + json.dumps(next_cursor) + '}'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
 
 
 @app.route('/view_clients')
+@page_cache.cached(data_versions.PRESENCE)
 def view_clients():
     if 'username' not in session:
         return redirect(url_for('login'))
 
-    print(f"Connected users at view_clients: {connected_users}")
-    return render_template('view_clients.html', connected_users=connected_users)
+    online, next_cursor = presence.page(request.args.get('after'),
+                                        request.args.get('limit', type=int))
+    return render_template('view_clients.html', connected_users=[user['username'] for user in online],
+                           online_count=presence.count(), next_cursor=next_cursor)
+
+# Online users as JSON, one page at a time: ?after=<next_cursor>&limit=N
+@app.route('/api/presence', methods=['GET'])
+def api_presence():
+    if 'username' not in session:
+        return jsonify({'error': 'login required'}), 401
+    online, next_cursor = presence.page(request.args.get('after'),
+                                        request.args.get('limit', type=int))
+    return jsonify({'count': presence.count(), 'users': online, 'next_cursor': next_cursor})
 
 # Route for logging out (Exit)
 @app.route('/logout')
 def logout():
     username = session.get('username')
-    if username and username in connected_users:
-        connected_users.remove(username)
+    if username:
+        presence.remove(username)
 
     session.pop('username', None)  # Clear the session
     return redirect(url_for('login'))
 
+# Presence: a logged-in client's connection keeps its user online, with a
+# heartbeat every presence.heartbeat_interval seconds
+@socketio.on('connect')
+def handle_connect():
+    if 'username' in session:
+        presence.seen(session['username'], request.sid)
+
+@socketio.on('disconnect')
+def handle_disconnect():
+    presence.disconnect(request.sid)
+
+@socketio.on('heartbeat')
+def handle_heartbeat(data=None):
+    if 'username' in session:
+        presence.seen(session['username'], request.sid)
+
+# Live forecast: a client viewing a city sends {'city', 'version'} to join the
+# city's room, and gets the changes since `version` (or a snapshot) followed by
+# every later change. Reconnecting clients resubscribe with the last version
+# they saw.
+@socketio.on('forecast_subscribe')
+def handle_forecast_subscribe(data):
+    if 'username' not in session or not isinstance(data, dict) or not data.get('city'):
+        return
+    city = city_index.resolve(data['city']) or data['city']
+    join_room(forecast_updates.room(city))
+    kind, update = offload.call(forecast_updates.catch_up, city, data.get('version'))
+    emit_event(kind, update, send=emit)
+
+@socketio.on('forecast_unsubscribe')
+def handle_forecast_unsubscribe(data):
+    if isinstance(data, dict) and data.get('city'):
+        city = city_index.resolve(data['city']) or data['city']
+        leave_room(forecast_updates.room(city))
+
 # Socket event for broadcasting alert message to all connected clients
 @socketio.on('new_alert')
 def handle_alert(alert_data):
+    if not inbound_limiter.allow(socket_client_key()):
+        return
     message = alert_data['message']
-    print(f"New alert received: {message}")
-    emit('new_alert', {'message': message}, broadcast=True)
+    logger.debug("New alert received", extra={'city': alert_data.get('city')})
+    alert_scheduler.submit(alert_data.get('city') or 'Global', message)
     
 @socketio.on('test_alert')
 def test_alert(data):
-    print("Received test alert: ", data)
-    socketio.emit('new_alert', {'message': 'This is a test alert'}, room=None)
+    if not inbound_limiter.allow(socket_client_key()):
+        return
+    logger.debug("Received test alert")
+    alert_scheduler.submit('Test', 'This is a test alert')
     
 @app.route('/upload', methods=['GET', 'POST'])
 def upload_file():
@@ -288,14 +572,12 @@ def upload_file():
             return redirect(request.url)
 
         if file and allowed_file(file.filename):
-            filepath = os.path.join(app.config['UPLOAD_FOLDER'], file.filename)
-            file.save(filepath)
-
-            # Save the file metadata in the database
-            user_db.save_file_metadata(file.filename, session['username'])
+            # Stream the file into content-addressed storage and save its metadata
+            metadata = file_store.save_upload(file.stream, file.filename, session['username'])
 
             # Notify all connected clients about the new file
-            socketio.emit('new_file_uploaded', {'filename': file.filename, 'uploader': session['username']}, to='all')
+            emit_event('new_file_uploaded', {'id': metadata['id'], 'filename': file.filename,
+                                             'uploader': session['username']}, to='all')
 
 
             flash('File uploaded successfully!', 'success')
@@ -305,107 +587,337 @@ def upload_file():
 
 
 
+# Catalog filters from the query string: ?cursor=&sort=time|name&uploader=&q=<name prefix>&since=&until=
+def file_filters():
+    return {
+        'cursor': request.args.get('cursor'),
+        'sort': request.args.get('sort', 'time'),
+        'uploader': request.args.get('uploader'),
+        'prefix': request.args.get('q'),
+        'since': request.args.get('since'),
+        'until': request.args.get('until'),
+    }
+
 @app.route('/files', methods=['GET'])
+@page_cache.cached(data_versions.FILES)
 def files():
     if 'username' not in session:
         return redirect(url_for('login'))
 
-    files = user_db.get_uploaded_files()
-    return render_template('files.html', files=files)
+    limit = request.args.get('limit', user_db.FILE_PAGE_SIZE, type=int)
+    files, next_cursor = offload.call(user_db.get_files_page, limit, **file_filters())
+    return render_template('files.html', files=files, next_cursor=next_cursor)
 
+# JSON API for the file catalog, one page at a time
+@app.route('/api/files', methods=['GET'])
+def api_files():
+    if 'username' not in session:
+        return jsonify({'error': 'login required'}), 401
+
+    limit = request.args.get('limit', user_db.FILE_PAGE_SIZE, type=int)
+    deleted = request.args.get('deleted') == '1'
+    files, next_cursor = offload.call(user_db.get_files_page, limit, deleted=deleted, **file_filters())
+    return jsonify({'files': files, 'next_cursor': next_cursor})
+
+# The file a download or delete refers to. Files are addressed by id, since
+# different users may upload files with the same name; the older by-name URLs
+# (kept for existing links and for files not yet in the catalog) get the
+# newest file stored under the name.
+def find_file(file_id=None, filename=None, deleted=False):
+    if file_id is None:
+        return user_db.get_file_metadata(filename, deleted=deleted)
+    metadata = user_db.get_file(file_id)
+    if metadata is None or bool(metadata['deleted']) != deleted:
+        return None
+    return metadata
+
+@app.route('/files/<int:file_id>/download')
 @app.route('/files/download/<filename>')
-def download_file(filename):
+def download_file(file_id=None, filename=None):
     if 'username' not in session:
         return redirect(url_for('login'))
 
-    return send_from_directory(app.config['UPLOAD_FOLDER'], filename, as_attachment=True)
+    metadata = find_file(file_id, filename)
+    if file_id is not None:
+        if metadata is None:
+            abort(404)
+        filename = metadata['filename']
+    if metadata and metadata['storage_key']:
+        path = file_store.object_path(metadata['storage_key'])
+        relative_path = metadata['storage_key']
+    else:
+        # Files uploaded before content addressing live directly in the upload folder
+        path = safe_join(app.config['UPLOAD_FOLDER'], filename)
+        relative_path = filename
+    if path is None or not os.path.isfile(path):
+        abort(404)
+    return downloads.send_stored_file(path, filename, metadata and metadata['sha256'], relative_path)
+
+# Start a resumable chunked upload: JSON body {"filename": ..., "size": <bytes>}
+@app.route('/api/uploads', methods=['POST'])
+def api_begin_upload():
+    if 'username' not in session:
+        return jsonify({'error': 'login required'}), 401
+
+    data = request.get_json(silent=True) or {}
+    filename = data.get('filename', '')
+    size = data.get('size')
+    if not allowed_file(filename) or not isinstance(size, int) or size < 0:
+        return jsonify({'error': 'filename with an allowed extension and integer size required'}), 400
+
+    upload_id = file_store.begin_upload(filename, session['username'], size)
+    return jsonify({'id': upload_id, 'received': 0}), 201
+
+# Upload status, so an interrupted client knows where to resume
+@app.route('/api/uploads/<upload_id>', methods=['GET'])
+def api_upload_status(upload_id):
+    if 'username' not in session:
+        return jsonify({'error': 'login required'}), 401
+
+    status = file_store.upload_status(upload_id)
+    if status is None:
+        return jsonify({'error': 'unknown upload'}), 404
+    return jsonify(status)
+
+# Append one chunk. The raw request body is the chunk and is streamed to disk;
+# the offset comes from 'Content-Range: bytes <start>-<end>/<total>' or ?offset=.
+@app.route('/api/uploads/<upload_id>', methods=['PUT'])
+def api_upload_chunk(upload_id):
+    if 'username' not in session:
+        return jsonify({'error': 'login required'}), 401
+
+    content_range = request.headers.get('Content-Range', '')
+    if content_range.startswith('bytes ') and '-' in content_range:
+        offset = int(content_range[6:].split('-', 1)[0])
+    else:
+        offset = request.args.get('offset', 0, type=int)
+
+    try:
+        received = file_store.append_chunk(upload_id, offset, request.stream)
+    except file_store.UploadError as e:
+        status = file_store.upload_status(upload_id)
+        return jsonify({'error': str(e), 'received': status['received'] if status else None}), 409
+    return jsonify({'id': upload_id, 'received': received})
+
+# Finish a chunked upload and store it
+@app.route('/api/uploads/<upload_id>/complete', methods=['POST'])
+def api_complete_upload(upload_id):
+    if 'username' not in session:
+        return jsonify({'error': 'login required'}), 401
+
+    try:
+        metadata = file_store.complete_upload(upload_id)
+    except file_store.UploadError as e:
+        return jsonify({'error': str(e)}), 409
+
+    emit_event('new_file_uploaded', {'id': metadata['id'], 'filename': metadata['filename'],
+                                     'uploader': metadata['uploader']}, to='all')
+    return jsonify(metadata), 201
 
 # Socket event to notify all clients when a new file is uploaded
 @socketio.on('new_file_uploaded')
 def handle_new_file(data):
-    print(f"New file uploaded: {data['filename']} by {data['uploader']}")
-    emit('new_file_uploaded', {'filename': data['filename'], 'uploader': data['uploader']}, broadcast=True)
+    if not inbound_limiter.allow(socket_client_key()):
+        return
+    logger.debug("New file uploaded", extra={'file_name': data['filename'], 'uploader': data['uploader']})
+    emit_event('new_file_uploaded', {'filename': data['filename'], 'uploader': data['uploader']}, send=emit,
+               broadcast=True)
     
 @app.route('/view_files', methods=['GET'])
+@page_cache.cached(data_versions.FILES)
 def view_files():
     if 'username' not in session:
         return redirect(url_for('login'))
 
-    # Fetch all uploaded files metadata from the database
-    files = user_db.get_uploaded_files()
-
-    # Debug: Print files to console
-    print("Files fetched: ", files)
+    # Fetch one page of the file catalog
+    limit = request.args.get('limit', user_db.FILE_PAGE_SIZE, type=int)
+    files, next_cursor = offload.call(user_db.get_files_page, limit, **file_filters())
 
-    return render_template('view_files.html', files=files)
+    return render_template('view_files.html', files=files, next_cursor=next_cursor)
 
 
 
+@app.route('/files/<int:file_id>/delete', methods=['POST'])
 @app.route('/files/delete/<filename>', methods=['POST'])
-def delete_file(filename):
+def delete_file(file_id=None, filename=None):
     if 'username' not in session:
         return redirect(url_for('login'))
 
-    # Construct the file path in the original folder
-    file_path = os.path.join(app.config['UPLOAD_FOLDER'], filename)
-    deleted_file_path = os.path.join(app.config['DELETED_FILES_FOLDER'], filename)
+    # Find where the file's content is stored
+    metadata = find_file(file_id, filename)
+    if metadata:
+        filename = metadata['filename']
+    elif filename is None:
+        flash(f"File {file_id} does not exist.", "error")
+        return redirect(url_for('view_files'))
+    file_path = file_store.path_for(metadata, filename)
 
     try:
-        # Check if the file exists before moving it
-        if os.path.exists(file_path):
-            # Move the file to the deleted files folder
-            shutil.move(file_path, deleted_file_path)
-
-            # Optionally, delete the file metadata from the database
-            user_db.delete_file_metadata(filename)
+        # Check if the file exists before deleting it
+        if metadata and os.path.exists(file_path):
+            # Soft-delete in the background: the row is flagged and legacy files
+            # move to the deleted files folder
+            jobs.enqueue('file.soft_delete', {'file_id': metadata['id'],
+                                              'deleted_folder': app.config['DELETED_FILES_FOLDER']})
 
             # Flash success message
-            flash(f"File '{filename}' moved to the deleted files folder.", "success")
+            flash(f"File '{filename}' will be moved to the deleted files folder.", "success")
         else:
             flash(f"File '{filename}' does not exist.", "error")
     except Exception as e:
-        print(f"Error deleting file: {e}")
+        logger.exception("Error deleting file")
         flash(f"Error deleting file '{filename}': {str(e)}", "error")
 
-    # Reload the updated list of files
-    files = user_db.get_uploaded_files()  # Assuming this function retrieves the updated list of files
-
     # Redirect back to the files page after deletion
-    return render_template('view_files.html', files=files)
+    return redirect(url_for('view_files'))
 
 
-import os
-
 # Route to view deleted files
 @app.route('/view_deleted_files')
 def view_deleted_files():
     if 'username' not in session:
         return redirect(url_for('login'))
 
-    # Get the list of deleted files from the deleted files folder
-    deleted_files = os.listdir(app.config['DELETED_FILES_FOLDER'])
+    # Get one page of deleted files from the catalog, most recently deleted first
+    limit = request.args.get('limit', user_db.FILE_PAGE_SIZE, type=int)
+    filters = file_filters()
+    filters['sort'] = request.args.get('sort', 'deleted')
+    files, next_cursor = offload.call(user_db.get_files_page, limit, deleted=True, **filters)
+    deleted_files = [file['filename'] for file in files]
 
-    return render_template('view_deleted_files.html', deleted_files=deleted_files)
+    return render_template('view_deleted_files.html', deleted_files=deleted_files,
+                           files=files, next_cursor=next_cursor)
 
 
+@app.route('/deleted_files/<int:file_id>/download')
 @app.route('/deleted_files/download/<filename>')
-def download_deleted_file(filename):
+def download_deleted_file(file_id=None, filename=None):
     if 'username' not in session:
         return redirect(url_for('login'))
 
-    file_path = os.path.join(DELETED_FILES_FOLDER, filename)
+    metadata = find_file(file_id, filename, deleted=True)
+    if metadata:
+        filename = metadata['filename']
+        file_path = file_store.deleted_path_for(metadata)
+    elif filename is not None:
+        # Not reconciled into the catalog yet
+        file_path = safe_join(DELETED_FILES_FOLDER, filename)
+    else:
+        file_path = None
+        filename = str(file_id)
 
-    if os.path.exists(file_path):
-        return send_from_directory(DELETED_FILES_FOLDER, filename, as_attachment=True)
+    if file_path and os.path.isfile(file_path):
+        return downloads.send_stored_file(file_path, filename, metadata and metadata['sha256'])
     else:
         flash(f"File '{filename}' not found in deleted files.", "error")
         return redirect(url_for('view_deleted_files'))
 
 
 
+# Background job queue depth and latency
+@app.route('/api/jobs', methods=['GET'])
+def api_jobs():
+    if 'username' not in session:
+        return jsonify({'error': 'login required'}), 401
+    return jsonify(jobs.stats())
 
+# Hit rates and sizes of this worker's forecast and page caches
+@app.route('/api/cache', methods=['GET'])
+def api_cache():
+    if 'username' not in session:
+        return jsonify({'error': 'login required'}), 401
+    return jsonify({'forecast': forecast_cache.stats(), 'pages': page_cache.page_cache.stats()})
+
+
+# Time every request for /metrics, labelled by route rather than by URL
+@app.before_request
+def start_request_timer():
+    if metrics.ENABLED:
+        g.request_started = time.perf_counter()
+
+@app.after_request
+def record_request_metrics(response):
+    started = g.pop('request_started', None)
+    if started is not None:
+        endpoint = request.url_rule.rule if request.url_rule else 'unmatched'
+        metrics.http_request_duration.observe(request.method, endpoint, str(response.status_code),
+                                              value=time.perf_counter() - started)
+    return response
+
+# Prometheus scrape endpoint
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    return Response(metrics.registry.render(), content_type=metrics.CONTENT_TYPE)
+
+# Page views keep a logged-in user online; recorded at most once per heartbeat interval
+@app.before_request
+def record_presence():
+    username = session.get('username')
+    if username and time.time() - session.get('presence_at', 0) >= presence.heartbeat_interval:
+        presence.seen(username)
+        session['presence_at'] = time.time()
+
+
+# Roll back a half-finished transaction left on the pooled connection by a failed request
+@app.teardown_appcontext
+def release_db_connection(exception=None):
+    if exception is not None:
+        user_db.connect_db().rollback()
+
+
+# Bring the database up to date (including the sample forecasts). Only the
+# first start after a deployment does any work; later ones find the schema
+# version current and return at once.
+def init_database():
+    migrations.migrate()
+
+# Application factory. Importing this module only defines the app and its
+# routes; create_app() does the rest, once per process: logging, the upload
+# folders, binding Socket.IO (which picks and imports the async backend) and
+# the database schema. serve.py and the development server call it before
+# serving; other WSGI servers can load app:create_app(), and otherwise it runs
+# on the first request.
+_created = False
+_create_lock = threading.Lock()
+
+def create_app():
+    global _created
+    with _create_lock:
+        if not _created:
+            logs.configure()
+            os.makedirs(DELETED_FILES_FOLDER, exist_ok=True)
+            os.makedirs(UPLOAD_FOLDER, exist_ok=True)
+            # WEATHER_ASYNC_MODE picks the server backend (serve.py sets it); unset, Flask-SocketIO picks one
+            socketio.init_app(app, message_queue=alert_bus.get_bus().socketio_message_queue,
+                              async_mode=os.environ.get('WEATHER_ASYNC_MODE') or None)
+            init_database()
+            _created = True
+    return app
+
+# WSGI entry that runs create_app() before the first request it sees
+class _CreateOnFirstRequest:
+    def __init__(self, wsgi_app):
+        self.wsgi_app = wsgi_app
+
+    def __call__(self, environ, start_response):
+        if not _created:
+            create_app()
+            # Go through the Socket.IO middleware that create_app() put in front of us
+            return app.wsgi_app(environ, start_response)
+        return self.wsgi_app(environ, start_response)
+
+app.wsgi_app = _CreateOnFirstRequest(app.wsgi_app)
+
+# Start this worker's background tasks. Only one worker per host needs the reconciler.
+def start_services(reconciler=True):
+    subscribe_to_alert_bus()
+    jobs.start()  # Pick up jobs left over from a previous run
+    if reconciler:
+        file_reconciler.start_reconciler(DELETED_FILES_FOLDER, start_task=socketio.start_background_task)
+
+
+# Development server with the reloader; see serve.py for production
 if __name__ == '__main__':
-    user_db.create_tables()
-    alerts_db.create_alerts_table()  # Create the alerts table
-    user_db.prepopulate_weather_data()
-    socketio.run(app, debug=True)  # Start the app with socketio support
\ No newline at end of file
+    create_app()
+    start_services()
+    socketio.run(app, host=MAIN_SERVER_HOST, port=MAIN_SERVER_PORT, debug=True)  # Start the app with socketio support
\ No newline at end of file
@@ -0,0 +1,148 @@
+import collections
+import concurrent.futures
+import os
+import threading
+import time
+import offload
+import user_db
+
+# Login fast path.
+#
+# Password verification is deliberately slow, so two things stand in front of
+# it:
+#   - LoginThrottle counts recent failures per key in memory; once a key has
+#     its free attempts, further attempts are rejected without touching the
+#     database or hashing anything, for a backoff that doubles with every
+#     failure. Failures count against the (username, client IP) pair with
+#     FREE_ATTEMPTS, and against the username and the IP alone with the far
+#     more lenient ACCOUNT_FREE_ATTEMPTS. Someone guessing from other
+#     addresses can then slow an account down but not lock its owner out
+#     after a handful of tries. The client IP is only as good as
+#     request.remote_addr: behind a proxy, set WEATHER_PROXY_HOPS (app.py).
+#   - Verification runs on a bounded pool of OS threads (PBKDF2 releases the
+#     GIL), so it never blocks the Socket.IO event loop, and at most
+#     MAX_PENDING logins wait for it; beyond that logins fail fast with
+#     Overloaded instead of queueing.
+# The hash cost itself is configured in user_db (WEATHER_PBKDF2_ROUNDS).
+
+HASH_WORKERS = int(os.environ.get('WEATHER_LOGIN_HASH_WORKERS', str(min(4, os.cpu_count() or 1))))
+MAX_PENDING = int(os.environ.get('WEATHER_LOGIN_MAX_PENDING', '64'))
+FREE_ATTEMPTS = int(os.environ.get('WEATHER_LOGIN_FREE_ATTEMPTS', '5'))
+ACCOUNT_FREE_ATTEMPTS = int(os.environ.get('WEATHER_LOGIN_ACCOUNT_FREE_ATTEMPTS', '50'))
+BACKOFF_BASE = float(os.environ.get('WEATHER_LOGIN_BACKOFF_BASE', '1'))
+MAX_BACKOFF = float(os.environ.get('WEATHER_LOGIN_MAX_BACKOFF', '900'))
+# Failures older than this are forgotten
+FAILURE_WINDOW = float(os.environ.get('WEATHER_LOGIN_FAILURE_WINDOW', '900'))
+
+
+class Overloaded(Exception):
+    pass
+
+
+class LoginThrottle:
+    def __init__(self, free_attempts=FREE_ATTEMPTS, backoff_base=BACKOFF_BASE, max_backoff=MAX_BACKOFF,
+                 window=FAILURE_WINDOW, max_keys=100000):
+        self.free_attempts = free_attempts
+        self.backoff_base = backoff_base
+        self.max_backoff = max_backoff
+        self.window = window
+        self.max_keys = max_keys
+        # key -> (failures, time of last failure), least recently failed first
+        self._failures = collections.OrderedDict()
+        self._lock = threading.Lock()
+        self.rejected = 0
+
+    def _backoff(self, failures):
+        if failures < self.free_attempts:
+            return 0.0
+        return min(self.max_backoff, self.backoff_base * 2 ** (failures - self.free_attempts))
+
+    # Seconds until any of the keys may try again (0 if none is locked out)
+    def retry_after(self, *keys):
+        now = time.monotonic()
+        wait = 0.0
+        with self._lock:
+            for key in keys:
+                entry = self._failures.get(key)
+                if entry is None:
+                    continue
+                failures, last = entry
+                if now - last > self.window:
+                    del self._failures[key]
+                    continue
+                wait = max(wait, last + self._backoff(failures) - now)
+            if wait > 0:
+                self.rejected += 1
+        return wait
+
+    def record_failure(self, *keys):
+        now = time.monotonic()
+        with self._lock:
+            for key in keys:
+                failures, last = self._failures.pop(key, (0, now))
+                if now - last > self.window:
+                    failures = 0
+                self._failures[key] = (failures + 1, now)
+            while len(self._failures) > self.max_keys:
+                self._failures.popitem(last=False)
+
+    def record_success(self, *keys):
+        with self._lock:
+            for key in keys:
+                self._failures.pop(key, None)
+
+    def stats(self):
+        with self._lock:
+            return {'tracked_keys': len(self._failures), 'rejected': self.rejected}
+
+
+class HashPool:
+    # Runs password checks on HASH_WORKERS OS threads; under eventlet/gevent
+    # they go through the green library's native thread pool (offload.call)
+    def __init__(self, workers=HASH_WORKERS, max_pending=MAX_PENDING):
+        self.workers = workers
+        self._executor = None
+        self._slots = threading.BoundedSemaphore(max_pending)
+        self._lock = threading.Lock()
+
+    def _get_executor(self):
+        with self._lock:
+            if self._executor is None:
+                self._executor = concurrent.futures.ThreadPoolExecutor(self.workers, thread_name_prefix='login-hash')
+            return self._executor
+
+    def run(self, function, *args):
+        if not self._slots.acquire(blocking=False):
+            raise Overloaded("Too many logins in progress")
+        try:
+            if offload.green_library():
+                return offload.call(function, *args)
+            return self._get_executor().submit(function, *args).result()
+        finally:
+            self._slots.release()
+
+
+# Per (username, IP) pair
+throttle = LoginThrottle()
+# Per username and per IP, across all pairs
+account_throttle = LoginThrottle(free_attempts=ACCOUNT_FREE_ATTEMPTS)
+hash_pool = HashPool()
+
+
+# Check a login attempt from `ip`. Returns (ok, retry_after): retry_after is
+# the number of seconds to wait when the attempt was refused without checking
+# the password. Raises Overloaded when too many checks are already queued.
+def authenticate(username, password, ip):
+    ip = ip or 'unknown'
+    pair = ('login', username, ip)
+    user, address = 'user:' + username, 'ip:' + ip
+    wait = max(throttle.retry_after(pair), account_throttle.retry_after(user, address))
+    if wait > 0:
+        return False, wait
+    if hash_pool.run(user_db.verify_login, username, password):
+        throttle.record_success(pair)
+        account_throttle.record_success(user)
+        return True, 0.0
+    throttle.record_failure(pair)
+    account_throttle.record_failure(user, address)
+    return False, 0.0
@@ -0,0 +1,82 @@
+# End-to-end latency of the alert bus: one publisher process and several
+# subscriber processes (stand-ins for web workers / alert servers) sharing a
+# bus. Every subscriber must see every alert.
+#
+#   python -m benchmarks.alert_bus_latency --subscribers 4 --alerts 200
+#   python -m benchmarks.alert_bus_latency --bus redis://localhost:6379/0
+import argparse
+import multiprocessing
+import os
+import tempfile
+import threading
+import time
+
+import alert_bus
+import db
+import migrations
+
+
+def subscriber_process(database, url, expected, ready, results):
+    db.set_database(database)
+    bus = alert_bus.create_bus(url)
+    latencies = []
+    finished = threading.Event()
+
+    def on_alert(event):
+        latencies.append(time.time() - event['sent_at'])
+        if len(latencies) == expected:
+            finished.set()
+
+    bus.subscribe(alert_bus.ALERT_CHANNEL, on_alert)
+    ready.release()
+    finished.wait(60)
+    results.put(latencies)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else float('nan')
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Cross-process alert bus latency')
+    parser.add_argument('--bus', default='sqlite', help="'sqlite' or a redis:// URL")
+    parser.add_argument('--subscribers', type=int, default=4)
+    parser.add_argument('--alerts', type=int, default=200)
+    parser.add_argument('--interval', type=float, default=0.01, help='seconds between alerts')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        database = os.path.join(tmp, 'bench.db')
+        db.set_database(database)
+        migrations.migrate()
+
+        ready = multiprocessing.Semaphore(0)
+        results = multiprocessing.Queue()
+        workers = [multiprocessing.Process(target=subscriber_process,
+                                           args=(database, args.bus, args.alerts, ready, results))
+                   for _ in range(args.subscribers)]
+        for worker in workers:
+            worker.start()
+        for _ in workers:
+            ready.acquire()
+
+        bus = alert_bus.create_bus(args.bus)
+        for seq in range(args.alerts):
+            alert_bus.publish_alert(f'Alert {seq}', seq, 'Bench', bus=bus)
+            time.sleep(args.interval)
+
+        latencies = []
+        for _ in workers:
+            latencies.extend(results.get(timeout=120))
+        for worker in workers:
+            worker.join()
+        db.close_all()
+
+    print(f"delivered: {len(latencies)}/{args.alerts * args.subscribers}")
+    print(f"p50: {percentile(latencies, 50) * 1000:8.2f} ms")
+    print(f"p99: {percentile(latencies, 99) * 1000:8.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,122 @@
+# Load generator for the event-driven alert server: connects many local TCP
+# clients, publishes timestamped alerts and reports broadcast latency.
+#
+#   python -m benchmarks.alert_fanout --clients 10000 --alerts 50
+import argparse
+import asyncio
+import json
+import multiprocessing
+import resource
+import time
+
+import alert
+import alert_bus
+
+
+# Allow one file descriptor per client plus some headroom
+def raise_fd_limit(needed):
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    if soft < needed:
+        resource.setrlimit(resource.RLIMIT_NOFILE, (min(hard, max(needed, soft)), hard))
+
+
+# Run the async alert server in a child process and report its port back
+def run_server(port_pipe, queue_size, policy, clients):
+    raise_fd_limit(clients + 1024)
+    server = alert.AsyncAlertServer('127.0.0.1', 0, queue_size=queue_size, policy=policy,
+                                    replay_history=False, bus=alert_bus.LocalBus())
+    loop = asyncio.SelectorEventLoop()
+    asyncio.set_event_loop(loop)
+    loop.run_until_complete(server.start())
+    port_pipe.send(server.port)
+    loop.run_until_complete(server.serve_forever())
+
+
+# Read concatenated JSON alerts and record each one's latency
+async def subscriber(reader, latencies, expected, done):
+    decoder = json.JSONDecoder()
+    buffer = ''
+    received = 0
+    while received < expected:
+        data = await reader.read(65536)
+        if not data:
+            break
+        now = time.time()
+        buffer += data.decode()
+        while buffer:
+            try:
+                message, end = decoder.raw_decode(buffer)
+            except ValueError:
+                break
+            buffer = buffer[end:]
+            latencies.append(now - json.loads(message['message'])['sent'])
+            received += 1
+    done.append(received)
+
+
+def percentile(values, pct):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+async def run_clients(port, clients, alerts, interval, connect_batch):
+    latencies = []
+    done = []
+    tasks = []
+    writers = []
+    for start in range(0, clients, connect_batch):
+        batch = await asyncio.gather(*(asyncio.open_connection('127.0.0.1', port)
+                                       for _ in range(min(connect_batch, clients - start))))
+        for reader, writer in batch:
+            writers.append(writer)
+            tasks.append(asyncio.create_task(subscriber(reader, latencies, alerts, done)))
+    print(f"Connected {len(writers)} clients")
+
+    _, publisher = await asyncio.open_connection('127.0.0.1', port)
+    await asyncio.sleep(0.5)
+    for seq in range(alerts):
+        message = json.dumps({'seq': seq, 'sent': time.time()})
+        publisher.write(json.dumps({'type': 'alert', 'message': message}).encode())
+        await publisher.drain()
+        await asyncio.sleep(interval)
+
+    await asyncio.wait(tasks, timeout=30)
+    for writer in writers + [publisher]:
+        writer.close()
+    return latencies, sum(done)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Broadcast latency of the async alert server')
+    parser.add_argument('--clients', type=int, default=10000)
+    parser.add_argument('--alerts', type=int, default=50)
+    parser.add_argument('--interval', type=float, default=0.05, help='seconds between alerts')
+    parser.add_argument('--queue-size', type=int, default=alert.CLIENT_QUEUE_SIZE)
+    parser.add_argument('--policy', default=alert.SLOW_CLIENT_POLICY, choices=alert.SLOW_CLIENT_POLICIES)
+    parser.add_argument('--connect-batch', type=int, default=500)
+    args = parser.parse_args()
+
+    raise_fd_limit(args.clients + 1024)
+    parent_pipe, child_pipe = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=run_server, daemon=True,
+                                     args=(child_pipe, args.queue_size, args.policy, args.clients))
+    server.start()
+    port = parent_pipe.recv()
+
+    loop = asyncio.SelectorEventLoop()
+    asyncio.set_event_loop(loop)
+    latencies, received = loop.run_until_complete(
+        run_clients(port, args.clients, args.alerts, args.interval, args.connect_batch))
+    server.terminate()
+
+    expected = args.clients * args.alerts
+    print(f"delivered: {received}/{expected}")
+    print(f"p50: {percentile(latencies, 50) * 1000:8.2f} ms")
+    print(f"p99: {percentile(latencies, 99) * 1000:8.2f} ms")
+    print(f"max: {max(latencies, default=float('nan')) * 1000:8.2f} ms")
+
+
+if __name__ == '__main__':
+    main()
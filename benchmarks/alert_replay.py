@@ -0,0 +1,94 @@
+# Replay-on-connect throughput: the old one-send-per-alert replay against the
+# framed, batched replay in each available encoding.
+#
+#   python -m benchmarks.alert_replay --alerts 100000
+import argparse
+import json
+import os
+import socket
+import tempfile
+import threading
+import time
+
+import alert
+import alert_protocol
+import alerts_db
+import db
+import migrations
+
+
+# The pre-framing replay: one json.dumps and one send() per alert
+def legacy_replay(client_socket):
+    for row in alerts_db.get_weather_alerts():
+        client_socket.send(json.dumps({"type": "alert", "message": row[1]}).encode())
+    client_socket.close()
+
+
+# Read concatenated bare JSON objects until the server closes the socket
+def read_legacy(sock):
+    decoder = json.JSONDecoder()
+    buffer = ''
+    count = 0
+    while True:
+        data = sock.recv(1 << 16)
+        if not data:
+            return count
+        buffer += data.decode()
+        while buffer:
+            try:
+                _, end = decoder.raw_decode(buffer)
+            except ValueError:
+                break
+            buffer = buffer[end:]
+            count += 1
+
+
+def read_framed(sock, encoding):
+    alert_protocol.recv_frame(sock)  # welcome
+    count = 0
+    while True:
+        frame = alert_protocol.recv_frame(sock, encoding)
+        if frame['type'] == 'replay_done':
+            return count
+        count += len(frame['alerts'])
+
+
+# Time one replay over a socketpair; returns (alerts received, seconds)
+def measure(serve, read):
+    server_side, client_side = socket.socketpair()
+    start = time.perf_counter()
+    thread = threading.Thread(target=serve, args=(server_side,), daemon=True)
+    thread.start()
+    count = read(client_side)
+    elapsed = time.perf_counter() - start
+    client_side.close()
+    return count, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Alert replay-on-connect throughput')
+    parser.add_argument('--alerts', type=int, default=100000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.set_database(os.path.join(tmp, 'bench.db'))
+        migrations.migrate()
+        conn = db.get_connection()
+        conn.executemany('INSERT INTO alerts (city, alert_description, username) VALUES (?, ?, ?)',
+                         ((f'City {i % 500}', f'Storm warning #{i}', 'bench') for i in range(args.alerts)))
+        conn.commit()
+
+        results = [('legacy, send per alert',) + measure(legacy_replay, read_legacy)]
+        for encoding in alert_protocol.ENCODINGS:
+            def connect(sock, encoding=encoding):
+                sock.sendall(alert_protocol.hello(encoding))
+                return read_framed(sock, encoding)
+            results.append((f'framed {encoding}',) + measure(alert.handle_alert_client, connect))
+        db.close_all()
+
+    for name, count, elapsed in results:
+        print(f"{name:24} {count:8d} alerts in {elapsed:6.3f}s  {count / elapsed:10.0f} alerts/s")
+
+
+if __name__ == '__main__':
+    main()
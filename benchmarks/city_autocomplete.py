@@ -0,0 +1,83 @@
+# City autocomplete over a large place registry: time to load the in-memory
+# index, and per-lookup latency of CityIndex.search() for random prefixes
+# compared with an indexed range query on cities.normalized.
+#
+#   python -m benchmarks.city_autocomplete --places 200000 --lookups 100000
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import city_index
+import db
+import migrations
+
+SYLLABLES = ('an', 'ber', 'ca', 'do', 'el', 'fa', 'gor', 'ha', 'is', 'ju', 'ka', 'lo', 'mon', 'no', 'or',
+             'pa', 'que', 'ri', 'san', 'to', 'ur', 'vil', 'wa', 'yo', 'zur', 'é', 'ville', 'burg', 'ton')
+
+
+def place_names(count, seed=0):
+    rng = random.Random(seed)
+    names = set()
+    while len(names) < count:
+        words = [''.join(rng.choice(SYLLABLES) for _ in range(rng.randint(2, 4))) for _ in range(rng.randint(1, 2))]
+        names.add(' '.join(word.capitalize() for word in words))
+    return sorted(names)
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+def report(label, latencies):
+    print(f"{label:34} p50 {percentile(latencies, 50) * 1e6:8.1f} us   p99 {percentile(latencies, 99) * 1e6:8.1f} us")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='City autocomplete latency')
+    parser.add_argument('--places', type=int, default=200000)
+    parser.add_argument('--lookups', type=int, default=100000)
+    args = parser.parse_args()
+
+    names = place_names(args.places)
+    rng = random.Random(1)
+    prefixes = [city_index.normalize(rng.choice(names))[:rng.randint(1, 6)] for _ in range(args.lookups)]
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.set_database(os.path.join(tmp, 'bench.db'))
+        migrations.migrate()
+        city_index.register_cities(names)
+
+        index = city_index.CityIndex(refresh_interval=3600)
+        start = time.perf_counter()
+        index.refresh()
+        print(f"loaded {len(index)} keys in {(time.perf_counter() - start) * 1000:.0f} ms")
+
+        latencies = []
+        for prefix in prefixes:
+            start = time.perf_counter()
+            index.search(prefix)
+            latencies.append(time.perf_counter() - start)
+        report('CityIndex.search (in memory)', latencies)
+
+        conn = db.get_connection()
+        latencies = []
+        for prefix in prefixes[:10000]:
+            start = time.perf_counter()
+            conn.execute('SELECT name FROM cities WHERE normalized >= ? AND normalized < ? ORDER BY normalized LIMIT 10',
+                         (prefix, prefix + '\U0010ffff')).fetchall()
+            latencies.append(time.perf_counter() - start)
+        report('SQL range on cities.normalized', latencies)
+
+        # Incremental refresh after a small ingest
+        city_index.register_cities([f'Newtown {i}' for i in range(100)])
+        start = time.perf_counter()
+        added = index.refresh()
+        print(f"incremental refresh of {added} cities in {(time.perf_counter() - start) * 1000:.1f} ms")
+        db.close_all()
+
+
+if __name__ == '__main__':
+    main()
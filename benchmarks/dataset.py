@@ -0,0 +1,94 @@
+# Synthetic, reproducible data for benchmarks: N cities x M days of
+# forecasts, K alerts, F catalogued files and U users with known passwords,
+# all derived from one seed. Writes to the database db.py points at.
+#
+#   python -m benchmarks.dataset --db /tmp/bench.db --cities 200 --days 30 --alerts 20000 --files 5000
+import argparse
+import datetime
+import random
+import time
+
+import db
+import ingest
+import migrations
+import user_db
+
+CONDITIONS = ('Sunny', 'Cloudy', 'Rainy', 'Snowy', 'Windy', 'Foggy', 'Partly Cloudy', 'Stormy')
+EXTENSIONS = ('txt', 'pdf', 'png', 'jpg')
+START_DATE = datetime.date(2024, 1, 1)
+PASSWORD = 'bench-password'
+
+
+def city_name(number):
+    return f'Benchville {number:05}'
+
+
+def user_name(number):
+    return f'bench{number:04}'
+
+
+# What generate() created, for scenarios to draw requests from
+class Dataset:
+    def __init__(self, cities, dates, users, password=PASSWORD):
+        self.cities = cities
+        self.dates = dates
+        self.users = users
+        self.password = password
+
+    def summary(self):
+        return {'cities': len(self.cities), 'days': len(self.dates), 'users': len(self.users)}
+
+
+def generate(cities=100, days=30, alerts=10000, files=1000, users=10, seed=0):
+    rng = random.Random(seed)
+    migrations.migrate()
+    names = [city_name(number) for number in range(cities)]
+    dates = [(START_DATE + datetime.timedelta(days=day)).isoformat() for day in range(days)]
+
+    ingest.ingest_rows((city, date, rng.randint(-20, 35), rng.choice(CONDITIONS))
+                       for city in names for date in dates)
+
+    usernames = [user_name(number) for number in range(users)]
+    for username in usernames:
+        user_db.register_user(username, PASSWORD)
+
+    conn = db.get_connection()
+    # Spread alerts and uploads over the forecast period, oldest first
+    span = days * 86400
+    start = time.mktime(START_DATE.timetuple())
+
+    def timestamp(position, total):
+        return time.strftime('%Y-%m-%d %H:%M:%S', time.gmtime(start + span * position / max(total, 1)))
+
+    with conn:
+        conn.executemany('''
+            INSERT INTO alerts (city, alert_description, username, timestamp) VALUES (?, ?, ?, ?)
+        ''', ((rng.choice(names), f'{rng.choice(CONDITIONS)} warning {number}', rng.choice(usernames),
+               timestamp(number, alerts)) for number in range(alerts)))
+        conn.executemany('''
+            INSERT INTO files (filename, uploader, upload_time, sha256, size) VALUES (?, ?, ?, ?, ?)
+        ''', ((f'report-{number:06}.{rng.choice(EXTENSIONS)}', rng.choice(usernames), timestamp(number, files),
+               '%064x' % rng.getrandbits(256), rng.randint(1, 10 ** 7)) for number in range(files)))
+    return Dataset(names, dates, usernames)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic benchmark database')
+    parser.add_argument('--db', required=True, help='SQLite file to create or extend')
+    parser.add_argument('--cities', type=int, default=100)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--alerts', type=int, default=10000)
+    parser.add_argument('--files', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    db.set_database(args.db)
+    started = time.perf_counter()
+    dataset = generate(args.cities, args.days, args.alerts, args.files, args.users, args.seed)
+    print(f"Generated {dataset.summary()} plus {args.alerts} alerts and {args.files} files "
+          f"in {time.perf_counter() - started:.1f}s (password '{PASSWORD}')")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,126 @@
+# Download throughput and worker CPU per GB.
+#
+# Part 1 compares how a worker can push a file into a socket: os.sendfile
+# (what Gunicorn does with the wsgi.file_wrapper response from downloads.py)
+# against a read()/sendall() copy loop (what a plain iterable body costs).
+# Part 2 drives /files/<id>/download through the Flask test client for a full
+# download, conditional GETs (If-None-Match and If-Modified-Since) answered
+# with 304 and a ranged request, checking each response.
+#
+#   python -m benchmarks.download_throughput --size-mb 512
+import argparse
+import os
+import socket
+import tempfile
+import threading
+import time
+
+BLOCK = 1024 * 1024
+
+
+def drain(sock):
+    while sock.recv(1 << 20):
+        pass
+
+
+# Push the file through a socketpair with `send` and return (seconds, sender CPU seconds)
+def push(path, send):
+    sender, receiver = socket.socketpair()
+    reader = threading.Thread(target=drain, args=(receiver,))
+    reader.start()
+    with open(path, 'rb') as f:
+        start, cpu = time.perf_counter(), time.thread_time()
+        send(sender, f, os.path.getsize(path))
+        elapsed, cpu = time.perf_counter() - start, time.thread_time() - cpu
+    sender.close()
+    reader.join()
+    receiver.close()
+    return elapsed, cpu
+
+
+def send_copy(sock, f, size):
+    for block in iter(lambda: f.read(BLOCK), b''):
+        sock.sendall(block)
+
+
+def send_zero_copy(sock, f, size):
+    offset = 0
+    while offset < size:
+        offset += os.sendfile(sock.fileno(), f.fileno(), offset, size - offset)
+
+
+def report(label, size, elapsed, cpu):
+    gb = size / 1e9
+    print(f"{label:28} {size / elapsed / 1e6:9.1f} MB/s  {cpu / gb:7.3f} CPU s/GB")
+
+
+def flask_client_bench(path, size, rounds):
+    import app as web
+    import file_store
+    import user_db
+
+    with open(path, 'rb') as f:
+        metadata = file_store.save_upload(f, 'bench.bin', 'bench')
+    url = f"/files/{metadata['id']}/download"
+    client = web.app.test_client()
+    with client.session_transaction() as flask_session:
+        flask_session['username'] = 'bench'
+
+    start, cpu = time.perf_counter(), time.process_time()
+    for _ in range(rounds):
+        response = client.get(url)
+        assert response.status_code == 200, response.status_code
+        received = sum(len(block) for block in response.response)
+        assert received == size, (received, size)
+        response.close()
+    report('flask full download', size * rounds, time.perf_counter() - start, time.process_time() - cpu)
+
+    etag = f'"{metadata["sha256"]}"'
+    start = time.perf_counter()
+    for _ in range(1000):
+        response = client.get(url, headers={'If-None-Match': etag})
+        assert response.status_code == 304, response.status_code
+    print(f"{'flask conditional GET (304)':28} {1000 / (time.perf_counter() - start):9.0f} req/s")
+    last_modified = client.get(url, headers={'Range': 'bytes=0-0'}).headers['Last-Modified']
+    response = client.get(url, headers={'If-Modified-Since': last_modified})
+    assert response.status_code == 304, response.status_code
+
+    half = size // 2
+    response = client.get(url, headers={'Range': f'bytes={half}-'})
+    received = sum(len(block) for block in response.response)
+    assert response.status_code == 206 and received == size - half, (response.status_code, received)
+    assert response.headers['Content-Range'] == f'bytes {half}-{size - 1}/{size}'
+    print(f"{'flask range request':28} status {response.status_code}, {received} of {size - half} bytes")
+    user_db.purge_file_metadata(metadata['id'])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Download throughput and CPU per GB')
+    parser.add_argument('--size-mb', type=int, default=512)
+    parser.add_argument('--rounds', type=int, default=3)
+    parser.add_argument('--skip-flask', action='store_true')
+    args = parser.parse_args()
+    size = args.size_mb * 1024 * 1024
+
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'payload.bin')
+        with open(path, 'wb') as f:
+            block = os.urandom(BLOCK)
+            for _ in range(args.size_mb):
+                f.write(block)
+
+        report('read()/sendall() copy', size, *push(path, send_copy))
+        report('os.sendfile zero-copy', size, *push(path, send_zero_copy))
+
+        if not args.skip_flask:
+            import db
+            import migrations
+            os.chdir(tmp)
+            db.set_database(os.path.join(tmp, 'bench.db'))
+            migrations.migrate()
+            flask_client_bench(path, size, args.rounds)
+            db.close_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,62 @@
+# Cost of query instrumentation: the same point lookups and range scans with
+# metrics recording off (WEATHER_METRICS=0), on, and on with iterated rows
+# counted (WEATHER_METRICS_ITERATED_ROWS=1), plus the time to render
+# /metrics once the registry holds a realistic number of series.
+#
+#   python -m benchmarks.instrumentation_overhead --queries 50000
+import argparse
+import os
+import tempfile
+import time
+
+import db
+import metrics
+import migrations
+
+
+def run(conn, queries):
+    start = time.perf_counter()
+    for number in range(queries):
+        conn.execute('SELECT id, city FROM weather_data WHERE city = ? AND date = ? AND condition = ?',
+                     (f'City {number % 100}', '2024-01-01', 'Sunny')).fetchone()
+        for _ in conn.execute('SELECT date, temperature FROM weather_data WHERE city = ? ORDER BY date LIMIT 10',
+                              (f'City {number % 100}',)):
+            pass
+    return (time.perf_counter() - start) / queries / 2
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Query instrumentation overhead')
+    parser.add_argument('--queries', type=int, default=50000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.set_database(os.path.join(tmp, 'bench.db'))
+        migrations.migrate()
+        conn = db.get_connection()
+        conn.executemany('INSERT INTO weather_data (city, date, temperature, condition) VALUES (?, ?, ?, ?)',
+                         [(f'City {city}', f'2024-01-{day:02d}', 20.0, 'Sunny')
+                          for city in range(100) for day in range(1, 29)])
+        conn.commit()
+
+        modes = {'metrics off': (False, False), 'metrics on': (True, False),
+                 'metrics on, iterated rows': (True, True)}
+        results = {}
+        for _ in range(2):
+            for label, (enabled, iterated) in modes.items():
+                metrics.ENABLED, metrics.COUNT_ITERATED_ROWS = enabled, iterated
+                results[label] = run(conn, args.queries)
+        for label, elapsed in results.items():
+            print(f"{label:26} {elapsed * 1e6:6.2f} us per query "
+                  f"(+{(elapsed - results['metrics off']) * 1e6:.2f} us)")
+
+        for number in range(200):
+            metrics.http_request_duration.observe('GET', f'/route/{number}', '200', value=0.001)
+        start = time.perf_counter()
+        text = metrics.registry.render()
+        print(f"render /metrics: {len(text.splitlines())} lines in {(time.perf_counter() - start) * 1000:.1f} ms")
+        db.close_all()
+
+
+if __name__ == '__main__':
+    main()
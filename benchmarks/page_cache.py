@@ -0,0 +1,97 @@
+# CPU per request for the cached pages (/dashboard, /files, /view_files,
+# /alerts, /view_clients) rendered every time, served from the page cache, and
+# answered with a 304 to a conditional GET, plus the bytes sent per response.
+# Runs the app in-process through Flask's test client on a temporary database.
+#
+# The repository doesn't ship the Jinja templates, so the pages are rendered
+# from stand-ins that loop over their rows the way a listing page would.
+#
+#   python -m benchmarks.page_cache --rows 50 --requests 2000
+import argparse
+import os
+import tempfile
+import time
+
+import jinja2
+
+LISTING = '''<!doctype html><html><head><title>{{ title }}</title></head><body>
+<h1>{{ title }}</h1><table>
+{% for row in rows %}<tr>{% for value in row %}<td>{{ value }}</td>{% endfor %}</tr>
+{% endfor %}</table>
+{% if next_cursor %}<a href="?cursor={{ next_cursor|urlencode }}">Next</a>{% endif %}
+</body></html>'''
+
+TEMPLATES = {
+    'dashboard.html': '{% set title = "Dashboard for " ~ username %}{% set rows = connected_users|map("list") %}'
+                      '{% for option in options %}<a href="{{ option.link }}">{{ option.name }}</a>{% endfor %}'
+                      '<p>{{ online_count }} online</p>' + LISTING,
+    'view_clients.html': '{% set title = "Online users" %}{% set rows = connected_users|map("list") %}' + LISTING,
+    'weather_alerts.html': '{% set title = "Alerts" %}{% set rows = alerts %}' + LISTING,
+    'files.html': '{% set title = "Files" %}{% set rows = files|map("dictsort")|map("list") %}' + LISTING,
+    'view_files.html': '{% set title = "Files" %}{% set rows = files|map("dictsort")|map("list") %}' + LISTING,
+}
+
+PAGES = ('/dashboard', '/view_clients', '/alerts', '/files', '/view_files')
+
+
+def seed(weather_app, rows):
+    import alerts_db
+    import user_db
+    from presence import presence
+    for number in range(rows):
+        alerts_db.add_weather_alert(f'City {number % 10}', f'Storm warning number {number}', f'user{number % 7}')
+        user_db.save_file_metadata(f'report-{number}.pdf', f'user{number % 7}', '0' * 64, 1000 + number)
+        presence.seen(f'user{number:04}')
+
+
+# CPU seconds and response bytes per request for `count` GETs of `path`
+def measure(client, path, count, headers):
+    sizes = 0
+    start = time.process_time()
+    for _ in range(count):
+        response = client.get(path, headers=headers)
+        assert response.status_code in (200, 304), (path, response.status_code)
+        sizes += len(response.data)
+    return (time.process_time() - start) / count, sizes / count
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Page cache CPU savings')
+    parser.add_argument('--rows', type=int, default=50, help='alerts, files and online users on each page')
+    parser.add_argument('--requests', type=int, default=2000)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        os.environ['WEATHER_DB_PATH'] = os.path.join(tmp, 'bench.db')
+        os.environ.setdefault('WEATHER_METRICS', '0')
+        os.environ.setdefault('WEATHER_LOG_LEVEL', 'WARNING')
+        import app as weather_app
+        import page_cache
+        weather_app.create_app()
+        weather_app.app.jinja_loader = jinja2.DictLoader(TEMPLATES)
+        seed(weather_app, args.rows)
+
+        client = weather_app.app.test_client()
+        with client.session_transaction() as session:
+            session['username'] = 'user0000'
+            session['presence_at'] = time.time() + 3600  # keep page views from touching presence
+        accept = {'Accept-Encoding': 'gzip, br'}
+
+        print(f"{'page':14} {'render':>16} {'cached':>16} {'304':>16} {'saved/request':>14}")
+        for path in PAGES:
+            page_cache.ENABLED = False
+            render_cpu, render_bytes = measure(client, path, args.requests, accept)
+            page_cache.ENABLED = True
+            page_cache.page_cache.clear()
+            first = client.get(path, headers=accept)
+            cached_cpu, cached_bytes = measure(client, path, args.requests, accept)
+            conditional = dict(accept, **{'If-None-Match': first.headers['ETag']})
+            not_modified_cpu, _ = measure(client, path, args.requests, conditional)
+            print(f"{path:14} {render_cpu * 1e6:7.0f} us {render_bytes:5.0f} B "
+                  f"{cached_cpu * 1e6:7.0f} us {cached_bytes:5.0f} B "
+                  f"{not_modified_cpu * 1e6:7.0f} us     0 B {(render_cpu - cached_cpu) * 1e6:9.0f} us")
+        print(page_cache.page_cache.stats())
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,84 @@
+# Presence with many users online: connect/heartbeat/disconnect cost and the
+# time to count and render one /view_clients page, for the in-memory and the
+# shared SQLite backend, next to the old connected_users list.
+#
+#   python -m benchmarks.presence_scale --users 100000
+import argparse
+import os
+import random
+import tempfile
+import time
+
+import db
+import migrations
+import presence
+
+
+def timed(label, count, function):
+    start = time.perf_counter()
+    function()
+    elapsed = time.perf_counter() - start
+    print(f"  {label:30} {elapsed * 1000:9.1f} ms total  {elapsed / count * 1e6:8.1f} us each")
+
+
+def run_backend(label, backend, users, operations):
+    print(label)
+    tracker = presence.Presence(backend)
+    rng = random.Random(0)
+    timed('connect', len(users), lambda: [tracker.seen(user, 'sid-' + user) for user in users])
+    sample = [rng.choice(users) for _ in range(operations)]
+    timed('heartbeat', operations, lambda: [tracker.seen(user, 'sid-' + user) for user in sample])
+    timed('count', 100, lambda: [tracker.count() for _ in range(100)])
+    cursors = [rng.choice(users) for _ in range(1000)]
+    timed('page of 50', len(cursors), lambda: [tracker.page(cursor, 50) for cursor in cursors])
+    leaving = sample[:operations // 10]
+    timed('disconnect', len(leaving), lambda: [tracker.disconnect('sid-' + user) for user in leaving])
+
+    # Everyone still listed is online and every page follows on from the last
+    online, after, pages = 0, None, 0
+    while True:
+        page, after = tracker.page(after, 500)
+        online += len(page)
+        pages += 1
+        if after is None:
+            break
+    assert online == tracker.count() == len(users) - len(set(leaving)), (online, tracker.count())
+    print(f"  {online} online across {pages} pages of 500")
+
+
+def run_list(users, operations):
+    print('connected_users list (before)')
+    connected_users = []
+    rng = random.Random(0)
+    # Logins are quadratic overall, so time a slice and extrapolate the per-login cost
+    subset = users[:min(len(users), 20000)]
+    timed(f'login ({len(subset)} users)', len(subset),
+          lambda: [connected_users.append(user) for user in subset if user not in connected_users])
+    connected_users = list(users)
+    sample = [rng.choice(users) for _ in range(min(operations, 2000))]
+    timed('login (already online)', len(sample), lambda: [user in connected_users for user in sample])
+    timed('logout', len(sample) // 10,
+          lambda: [connected_users.remove(user) for user in set(sample[:len(sample) // 10])])
+    timed('render every user', 10, lambda: ['\n'.join(f'<li>{user}</li>' for user in connected_users)
+                                            for _ in range(10)])
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Presence at scale')
+    parser.add_argument('--users', type=int, default=100000)
+    parser.add_argument('--operations', type=int, default=20000)
+    args = parser.parse_args()
+    users = [f'user{number:07d}' for number in range(args.users)]
+    random.Random(2).shuffle(users)
+
+    run_list(users, args.operations)
+    run_backend('presence (memory backend)', presence.MemoryBackend(), users, args.operations)
+    with tempfile.TemporaryDirectory() as tmp:
+        db.set_database(os.path.join(tmp, 'bench.db'))
+        migrations.migrate()
+        run_backend('presence (sqlite backend)', presence.SQLiteBackend(), users, args.operations)
+        db.close_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,71 @@
+# Benchmark the /select_city lookup with a fresh connection per call (the old
+# behaviour) against the pooled connection from db.py.
+#
+#   python -m benchmarks.select_city_pool --requests 20000 --threads 4
+import argparse
+import os
+import sqlite3
+import tempfile
+import threading
+import time
+
+import db
+import user_db
+
+
+# The pre-pool implementation: open, query, close on every request
+def legacy_search_weather_data(city):
+    conn = sqlite3.connect(db.DATABASE)
+    cursor = conn.cursor()
+    cursor.execute('''
+        SELECT date, temperature, condition
+        FROM weather_data
+        WHERE city = ?
+        ORDER BY date
+    ''', (city,))
+    weather_info = cursor.fetchall()
+    conn.close()
+    return weather_info
+
+
+# Run `search` `total` times spread over `threads` threads and return requests/sec
+def run(search, total, threads):
+    cities = ['Montreal', 'Toronto', 'Vancouver']
+    per_thread = total // threads
+
+    def worker():
+        for i in range(per_thread):
+            search(cities[i % len(cities)])
+        db.close_connection()
+
+    workers = [threading.Thread(target=worker) for _ in range(threads)]
+    start = time.perf_counter()
+    for t in workers:
+        t.start()
+    for t in workers:
+        t.join()
+    elapsed = time.perf_counter() - start
+    return per_thread * threads / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Pooled vs per-call connections on /select_city')
+    parser.add_argument('--requests', type=int, default=20000)
+    parser.add_argument('--threads', type=int, default=4)
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.set_database(os.path.join(tmp, 'bench.db'))
+        user_db.create_tables()  # includes the sample forecasts
+
+        before = run(legacy_search_weather_data, args.requests, args.threads)
+        after = run(user_db.search_weather_data, args.requests, args.threads)
+        db.close_all()
+
+    print(f"select_city  before: {before:10.0f} req/s")
+    print(f"select_city  after:  {after:10.0f} req/s")
+    print(f"speedup:             {after / before:10.2f}x")
+
+
+if __name__ == '__main__':
+    main()
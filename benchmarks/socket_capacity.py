@@ -0,0 +1,209 @@
+# Concurrent-socket capacity of the production server (serve.py): opens many
+# Socket.IO websocket clients and raw TCP alert-server clients at once, then
+# sends alerts through the alert server and measures how many clients of each
+# kind receive them and how long delivery takes. Socket.IO latency includes
+# the broadcast coalescing window (WEATHER_BROADCAST_WINDOW).
+#
+# By default it starts serve.py itself on a temporary database; pass --host to
+# test a server that is already running. Needs the `websockets` package.
+#
+#   python -m benchmarks.socket_capacity --sockets 2000 --alert-clients 2000
+import argparse
+import asyncio
+import json
+import os
+import resource
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+try:
+    import websockets
+except ImportError:  # only this benchmark needs it
+    websockets = None
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else float('nan')
+
+
+class Clients:
+    def __init__(self):
+        self.connected = {'socketio': 0, 'alert': 0}
+        self.failed = {'socketio': 0, 'alert': 0}
+        # alert message -> {kind: [receive times]}
+        self.received = {}
+
+    def record(self, kind, message):
+        self.received.setdefault(message, {}).setdefault(kind, []).append(time.perf_counter())
+
+
+# Minimal Engine.IO 4 / Socket.IO 5 client over a websocket
+async def socketio_client(url, clients, ready, stop):
+    try:
+        async with websockets.connect(url, open_timeout=60, ping_interval=None, max_queue=None) as ws:
+            await ws.recv()  # '0{...}' Engine.IO open
+            await ws.send('40')
+            while not (await ws.recv()).startswith('40'):
+                pass
+            clients.connected['socketio'] += 1
+            ready.release()
+            while not stop.is_set():
+                packet = await ws.recv()
+                if packet == '2':
+                    await ws.send('3')
+                elif packet.startswith('42'):
+                    event, data = json.loads(packet[2:])[:2]
+                    if event == 'new_alert':
+                        for alert in data.get('alerts') or [{'message': data['message']}]:
+                            clients.record('socketio', alert['message'])
+    except (websockets.ConnectionClosed, OSError, asyncio.TimeoutError):
+        if not stop.is_set():
+            clients.failed['socketio'] += 1
+            ready.release()
+
+
+# Unframed TCP alert client: connects and reads JSON alert objects
+async def alert_client(host, port, clients, ready, stop):
+    try:
+        reader, writer = await asyncio.wait_for(asyncio.open_connection(host, port), 60)
+    except (OSError, asyncio.TimeoutError):
+        clients.failed['alert'] += 1
+        ready.release()
+        return
+    clients.connected['alert'] += 1
+    ready.release()
+    decoder = json.JSONDecoder()
+    buffer = ''
+    try:
+        while not stop.is_set():
+            data = await reader.read(65536)
+            if not data:
+                break
+            buffer += data.decode()
+            while buffer:
+                try:
+                    alert, end = decoder.raw_decode(buffer)
+                except ValueError:
+                    break
+                buffer = buffer[end:]
+                clients.record('alert', alert.get('message'))
+    except (OSError, ConnectionError):
+        pass
+    finally:
+        writer.close()
+
+
+# Publish an alert as a legacy alert client; returns when it was written
+async def publish(host, port, message):
+    reader, writer = await asyncio.open_connection(host, port)
+    await asyncio.sleep(0.3)  # past the server's wait for a protocol hello
+    sent_at = time.perf_counter()
+    writer.write(json.dumps({'type': 'alert', 'message': message}).encode())
+    await writer.drain()
+    await asyncio.sleep(0.1)
+    writer.close()
+    return sent_at
+
+
+async def run(args):
+    clients = Clients()
+    stop = asyncio.Event()
+    ready = asyncio.Semaphore(0)
+    url = f'ws://{args.host}:{args.port}/socket.io/?EIO=4&transport=websocket'
+    tasks = []
+    started = time.perf_counter()
+    # Ramp up in waves so the listen backlog isn't the thing being measured
+    for offset in range(0, max(args.sockets, args.alert_clients), args.ramp):
+        wave = []
+        for _ in range(offset, min(args.sockets, offset + args.ramp)):
+            wave.append(asyncio.create_task(socketio_client(url, clients, ready, stop)))
+        for _ in range(offset, min(args.alert_clients, offset + args.ramp)):
+            wave.append(asyncio.create_task(alert_client(args.host, args.alert_port, clients, ready, stop)))
+        tasks.extend(wave)
+        for _ in wave:
+            await ready.acquire()
+    print(f"connected {clients.connected['socketio']} Socket.IO and {clients.connected['alert']} alert clients "
+          f"in {time.perf_counter() - started:.1f}s (failed: {clients.failed})")
+
+    await asyncio.sleep(1)  # let legacy replays finish
+    sent = {}
+    for number in range(args.alerts):
+        message = f'capacity-test-{number}-{time.time()}'
+        sent[message] = await publish(args.host, args.alert_port, message)
+        await asyncio.sleep(args.interval)
+    await asyncio.sleep(args.settle)
+
+    for kind, connected in clients.connected.items():
+        latencies = []
+        deliveries = 0
+        for message, sent_at in sent.items():
+            times = clients.received.get(message, {}).get(kind, [])
+            deliveries += len(times)
+            latencies.extend(received - sent_at for received in times)
+        expected = connected * len(sent)
+        print(f"{kind:9} delivered {deliveries}/{expected}   "
+              f"p50 {percentile(latencies, 50) * 1000:.0f} ms  p99 {percentile(latencies, 99) * 1000:.0f} ms")
+
+    stop.set()
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, return_exceptions=True)
+
+
+def start_server(args, tmp):
+    env = dict(os.environ, WEATHER_DB_PATH=os.path.join(tmp, 'bench.db'), WEATHER_HOST=args.host,
+               WEATHER_PORT=str(args.port), WEATHER_ALERT_PORT=str(args.alert_port),
+               WEATHER_ASYNC_MODE=args.async_mode, WEATHER_WORKERS='1', WEATHER_LOG_LEVEL='WARNING',
+               PYTHONPATH=ROOT)
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, 'serve.py')], cwd=tmp, env=env)
+    deadline = time.time() + 30
+    while time.time() < deadline:
+        try:
+            socket.create_connection((args.host, args.alert_port), 1).close()
+            socket.create_connection((args.host, args.port), 1).close()
+            return server
+        except OSError:
+            time.sleep(0.2)
+    server.kill()
+    raise SystemExit("serve.py did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Concurrent socket capacity')
+    parser.add_argument('--host', default=None, help='test a running server instead of starting one')
+    parser.add_argument('--port', type=int, default=5050)
+    parser.add_argument('--alert-port', type=int, default=5053)
+    parser.add_argument('--async-mode', default='eventlet')
+    parser.add_argument('--sockets', type=int, default=2000)
+    parser.add_argument('--alert-clients', type=int, default=2000)
+    parser.add_argument('--ramp', type=int, default=250, help='clients connecting at once')
+    parser.add_argument('--alerts', type=int, default=5)
+    parser.add_argument('--interval', type=float, default=1.0)
+    parser.add_argument('--settle', type=float, default=5.0)
+    args = parser.parse_args()
+    if websockets is None:
+        raise SystemExit("This benchmark needs the websockets package")
+
+    soft, hard = resource.getrlimit(resource.RLIMIT_NOFILE)
+    resource.setrlimit(resource.RLIMIT_NOFILE, (hard, hard))
+    with tempfile.TemporaryDirectory() as tmp:
+        server = None
+        if args.host is None:
+            args.host = '127.0.0.1'
+            server = start_server(args, tmp)
+        try:
+            asyncio.run(run(args))
+        finally:
+            if server is not None:
+                server.terminate()
+                server.wait()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,118 @@
+# Startup cost of both entry points, each measured in fresh interpreters:
+# the time to import app.py and alert.py (and which heavy modules that pulls
+# in), the web app's create_app() and first request on a new database (schema
+# and sample data created) and on an existing one (schema already current),
+# and how long `python alert.py --async` takes to accept its first client.
+#
+#   python -m benchmarks.startup --runs 5
+import argparse
+import json
+import os
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+HEAVY_MODULES = ('flask', 'flask_socketio', 'jinja2', 'passlib', 'eventlet', 'gevent', 'numpy', 'redis')
+
+IMPORT_SCRIPT = '''
+import json, sys, time
+start = time.perf_counter()
+import {module}
+print(json.dumps({{'import': time.perf_counter() - start,
+                   'heavy': [name for name in {heavy!r} if name in sys.modules]}}))
+'''
+
+APP_SCRIPT = '''
+import json, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+app.create_app()
+created = time.perf_counter()
+client = app.app.test_client()
+with client.session_transaction() as session:
+    session['username'] = 'bench'
+response = client.get('/api/cities?prefix=mon')
+assert response.status_code == 200, response.status_code
+done = time.perf_counter()
+print(json.dumps({'import': imported - start, 'create_app': created - imported,
+                  'first_request': done - created, 'total': done - start}))
+'''
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def child_env(database, **extra):
+    return dict(os.environ, PYTHONPATH=ROOT, WEATHER_DB_PATH=database, WEATHER_LOG_LEVEL='WARNING',
+                WEATHER_ASYNC_MODE='threading', WEATHER_ALERT_BUS='local', **extra)
+
+
+# Run a script in a fresh interpreter and return the JSON it prints
+def run_script(script, cwd, database):
+    output = subprocess.run([sys.executable, '-c', script], cwd=cwd, env=child_env(database),
+                            check=True, capture_output=True, text=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+# Seconds from spawning the async alert server until it accepts a connection
+def alert_server_ready(cwd, database, timeout=30.0):
+    port = free_port()
+    env = child_env(database, WEATHER_ALERT_HOST='127.0.0.1', WEATHER_ALERT_PORT=str(port))
+    start = time.perf_counter()
+    server = subprocess.Popen([sys.executable, os.path.join(ROOT, 'alert.py'), '--async'], cwd=cwd, env=env,
+                              stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    try:
+        while time.perf_counter() - start < timeout:
+            if server.poll() is not None:
+                raise RuntimeError(f'alert server exited with {server.returncode}')
+            try:
+                socket.create_connection(('127.0.0.1', port), timeout=1).close()
+                return time.perf_counter() - start
+            except OSError:
+                time.sleep(0.002)
+        raise RuntimeError('alert server did not start')
+    finally:
+        server.terminate()
+        server.wait()
+
+
+def median(results, key):
+    return statistics.median(result[key] for result in results)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Import and first-request latency of the web app and alert server')
+    parser.add_argument('--runs', type=int, default=5, help='fresh interpreters per measurement')
+    args = parser.parse_args()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        existing = os.path.join(tmp, 'existing.db')
+        run_script(APP_SCRIPT, tmp, existing)  # create it once
+        print(f"{'import':16} {'median':>9}  heavy modules loaded")
+        for module in ('app', 'alert'):
+            script = IMPORT_SCRIPT.format(module=module, heavy=HEAVY_MODULES)
+            results = [run_script(script, tmp, existing) for _ in range(args.runs)]
+            print(f"{module:16} {median(results, 'import') * 1000:6.0f} ms  {', '.join(results[-1]['heavy']) or '-'}")
+
+        print(f"\n{'web app':16} {'import':>9} {'create_app':>11} {'1st request':>12} {'total':>9}")
+        cold = [run_script(APP_SCRIPT, tmp, os.path.join(tmp, f'new-{run}.db')) for run in range(args.runs)]
+        warm = [run_script(APP_SCRIPT, tmp, existing) for _ in range(args.runs)]
+        for label, results in (('new database', cold), ('existing db', warm)):
+            print(f"{label:16} " + ' '.join(f'{median(results, key) * 1000:{width}.0f} ms' for key, width in
+                                           (('import', 6), ('create_app', 8), ('first_request', 9), ('total', 6))))
+
+        ready = [alert_server_ready(tmp, existing) for _ in range(args.runs)]
+        print(f"\nalert server accepting clients after {statistics.median(ready) * 1000:.0f} ms (median, "
+              f"from spawning the process)")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,325 @@
+# Load-test suite for the main routes and the TCP alert server.
+#
+# Generates a synthetic database (benchmarks/dataset.py), then drives /login,
+# /select_city, /update_weather/<city>/<date>, /alerts and /upload through
+# Flask's test client from concurrent threads, and the event-driven alert
+# server from alert.py with real TCP clients. Reports p50/p95/p99 latency and
+# throughput per scenario as JSON. Given --baseline, it compares the run with
+# a stored report and exits with status 1 if any scenario regressed by more
+# than --tolerance.
+#
+# Everything runs locally, in a temporary directory, with a fixed seed. The
+# Jinja templates aren't in the repository, so pages without one render a
+# small stand-in.
+#
+#   python -m benchmarks.suite --concurrency 8 --requests 1000 --output report.json
+#   python -m benchmarks.suite --save-baseline baseline.json
+#   python -m benchmarks.suite --baseline baseline.json --tolerance 0.25
+import argparse
+import asyncio
+import contextlib
+import io
+import itertools
+import json
+import multiprocessing
+import os
+import platform
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from urllib.parse import quote
+
+import jinja2
+
+HTTP_SCENARIOS = ('login', 'select_city', 'update_weather', 'alerts', 'upload')
+SCENARIOS = HTTP_SCENARIOS + ('alert_server',)
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+STAND_IN = '<!doctype html><html><body><h1>{{ request.path }}</h1></body></html>'
+
+
+def percentile(values, pct):
+    if not values:
+        return float('nan')
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+
+# Latency and throughput of one scenario, from per-operation latencies in seconds
+def summarize(latencies, errors, seconds):
+    def ms(value):
+        return round(value * 1000, 3)
+    return {
+        'requests': len(latencies),
+        'errors': errors,
+        'seconds': round(seconds, 3),
+        'throughput': round(len(latencies) / seconds, 1) if seconds else 0.0,
+        'p50_ms': ms(percentile(latencies, 50)),
+        'p95_ms': ms(percentile(latencies, 95)),
+        'p99_ms': ms(percentile(latencies, 99)),
+        'max_ms': ms(max(latencies, default=float('nan'))),
+    }
+
+
+# HTTP scenarios: send one request and return (response, expected statuses)
+
+def login(client, rng, data, args, number):
+    form = {'username': rng.choice(data.users), 'password': data.password}
+    return client.post('/login', data=form), (302,)
+
+
+def select_city(client, rng, data, args, number):
+    return client.post('/select_city', data={'city': rng.choice(data.cities)}), (200,)
+
+
+def update_weather(client, rng, data, args, number):
+    from benchmarks.dataset import CONDITIONS
+    url = f'/update_weather/{quote(rng.choice(data.cities))}/{rng.choice(data.dates)}'
+    form = {'temperature': rng.randint(-20, 35), 'condition': rng.choice(CONDITIONS)}
+    return client.post(url, data=form), (200,)
+
+
+def alerts(client, rng, data, args, number):
+    query = {'city': rng.choice(data.cities)} if rng.random() < 0.5 else {}
+    return client.get('/alerts', query_string=query), (200,)
+
+
+# Upload a new file and follow the redirect to /files, as a browser would
+def upload(client, rng, data, args, number):
+    content = rng.randbytes(args.upload_kb * 1024)
+    form = {'file': (io.BytesIO(content), f'bench-{number:07}.txt')}
+    return client.post('/upload', data=form, content_type='multipart/form-data', follow_redirects=True), (200,)
+
+
+# A test client logged in as one of the generated users
+def logged_in_client(weather_app, username):
+    client = weather_app.app.test_client()
+    with client.session_transaction() as session:
+        session['username'] = username
+    return client
+
+
+# Send requests numbered from `numbers` until one reaches `limit`; returns
+# (latencies, failures)
+def drive(client, scenario, rng, data, args, numbers, limit):
+    latencies = []
+    failures = 0
+    for number in numbers:
+        if number >= limit:
+            break
+        started = time.perf_counter()
+        response, expected = scenario(client, rng, data, args, number)
+        latencies.append(time.perf_counter() - started)
+        if response.status_code not in expected:
+            failures += 1
+        response.close()
+    return latencies, failures
+
+
+def run_http(weather_app, scenario, data, args):
+    # Warm up caches and code paths first, numbering requests past the timed ones
+    warmup_numbers = itertools.count(args.requests)
+    drive(logged_in_client(weather_app, data.users[0]), scenario, random.Random(-1), data, args,
+          warmup_numbers, args.requests + args.warmup)
+
+    numbers = itertools.count()
+    results = []
+
+    def worker(index):
+        client = logged_in_client(weather_app, data.users[index % len(data.users)])
+        results.append(drive(client, scenario, random.Random(args.seed * 1000 + index), data, args,
+                             numbers, args.requests))
+
+    threads = [threading.Thread(target=worker, args=(index,)) for index in range(args.concurrency)]
+    started = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - started
+    return summarize([latency for latencies, _ in results for latency in latencies],
+                     sum(failures for _, failures in results), seconds)
+
+
+# The async alert server in a child process with --alert-clients subscribers;
+# each delivered alert counts as one operation, timed from publish to receipt
+def run_alert_server(args):
+    import alert
+    from benchmarks import alert_fanout
+
+    parent_pipe, child_pipe = multiprocessing.Pipe()
+    server = multiprocessing.Process(target=alert_fanout.run_server, daemon=True,
+                                     args=(child_pipe, alert.CLIENT_QUEUE_SIZE, alert.SLOW_CLIENT_POLICY,
+                                           args.alert_clients))
+    server.start()
+    port = parent_pipe.recv()
+    alert_fanout.raise_fd_limit(args.alert_clients + 1024)
+    loop = asyncio.new_event_loop()
+    try:
+        started = time.perf_counter()
+        # run_clients reports progress on stdout, which may carry the JSON report
+        with contextlib.redirect_stdout(sys.stderr):
+            latencies, received = loop.run_until_complete(
+                alert_fanout.run_clients(port, args.alert_clients, args.alerts, args.alert_interval, 500))
+        seconds = time.perf_counter() - started
+    finally:
+        loop.close()
+        server.terminate()
+    return summarize(latencies, args.alert_clients * args.alerts - received, seconds)
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', 'HEAD'], cwd=ROOT, capture_output=True, text=True,
+                              timeout=10).stdout.strip() or None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+# Settings that must match for two reports to be comparable
+def run_config(args):
+    return {key: getattr(args, key) for key in ('cities', 'days', 'alerts_count', 'files', 'users', 'requests',
+                                                  'concurrency', 'upload_kb', 'alert_clients', 'alerts',
+                                                  'alert_interval', 'seed')}
+
+
+def run(args):
+    with tempfile.TemporaryDirectory() as tmp:
+        cwd = os.getcwd()
+        # The app creates its upload folders relative to the working directory
+        os.chdir(tmp)
+        os.environ['WEATHER_DB_PATH'] = os.path.join(tmp, 'bench.db')
+        os.environ.setdefault('WEATHER_ASYNC_MODE', 'threading')
+        os.environ.setdefault('WEATHER_ALERT_BUS', 'local')
+        os.environ.setdefault('WEATHER_LOG_LEVEL', 'WARNING')
+        try:
+            import app as weather_app
+            from benchmarks import dataset
+            weather_app.create_app()
+            data = dataset.generate(args.cities, args.days, args.alerts_count, args.files, args.users, args.seed)
+            weather_app.app.jinja_loader = jinja2.ChoiceLoader([
+                weather_app.app.jinja_loader or jinja2.FileSystemLoader(os.path.join(ROOT, 'templates')),
+                jinja2.FunctionLoader(lambda name: STAND_IN),
+            ])
+
+            results = {}
+            for name in args.scenarios:
+                print(f"running {name}...", file=sys.stderr)
+                if name == 'alert_server':
+                    results[name] = run_alert_server(args)
+                else:
+                    results[name] = run_http(weather_app, globals()[name], data, args)
+        finally:
+            os.chdir(cwd)
+
+    return {
+        'meta': {
+            'created_at': time.strftime('%Y-%m-%dT%H:%M:%SZ', time.gmtime()),
+            'commit': git_commit(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+        },
+        'config': run_config(args),
+        'scenarios': results,
+    }
+
+
+# Compare a report with a baseline report. A scenario regresses when its p95
+# latency rises, or its throughput falls, by more than `tolerance`, or when
+# its error rate goes up.
+def compare(report, baseline, tolerance):
+    comparison = {}
+    regressions = []
+    for name, current in report['scenarios'].items():
+        base = baseline.get('scenarios', {}).get(name)
+        if not base:
+            continue
+        entry = {}
+        for metric in ('p50_ms', 'p95_ms', 'p99_ms', 'throughput'):
+            change = current[metric] / base[metric] - 1 if base[metric] else 0.0
+            entry[metric] = {'baseline': base[metric], 'current': current[metric], 'change': round(change, 3)}
+        reasons = []
+        if entry['p95_ms']['change'] > tolerance:
+            reasons.append('p95 latency')
+        if entry['throughput']['change'] < -tolerance:
+            reasons.append('throughput')
+        if (current['errors'] / max(current['requests'], 1)) > (base['errors'] / max(base['requests'], 1)):
+            reasons.append('errors')
+        entry['regressed'] = reasons
+        if reasons:
+            regressions.append(name)
+        comparison[name] = entry
+    return {'baseline_commit': baseline.get('meta', {}).get('commit'), 'tolerance': tolerance,
+            'scenarios': comparison, 'regressions': regressions}
+
+
+def print_summary(report):
+    print(f"{'scenario':15} {'requests':>9} {'errors':>7} {'req/s':>9} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9}",
+          file=sys.stderr)
+    for name, result in report['scenarios'].items():
+        flag = ''
+        comparison = report.get('comparison', {}).get('scenarios', {}).get(name)
+        if comparison:
+            flag = f"  p95 {comparison['p95_ms']['change']:+.0%} req/s {comparison['throughput']['change']:+.0%}"
+            if comparison['regressed']:
+                flag += '  REGRESSED: ' + ', '.join(comparison['regressed'])
+        print(f"{name:15} {result['requests']:9} {result['errors']:7} {result['throughput']:9.1f} "
+              f"{result['p50_ms']:9.2f} {result['p95_ms']:9.2f} {result['p99_ms']:9.2f}{flag}", file=sys.stderr)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load-test suite with JSON reports and baseline comparison')
+    parser.add_argument('--scenarios', default=','.join(SCENARIOS),
+                        help=f"comma-separated, from {', '.join(SCENARIOS)}")
+    parser.add_argument('--requests', type=int, default=500, help='timed requests per HTTP scenario')
+    parser.add_argument('--warmup', type=int, default=20, help='untimed requests before each HTTP scenario')
+    parser.add_argument('--concurrency', type=int, default=4, help='client threads per HTTP scenario')
+    parser.add_argument('--upload-kb', type=int, default=64)
+    parser.add_argument('--alert-clients', type=int, default=500, help='TCP subscribers of the alert server')
+    parser.add_argument('--alerts', type=int, default=50, help='alerts published to the alert server')
+    parser.add_argument('--alert-interval', type=float, default=0.02, help='seconds between published alerts')
+    parser.add_argument('--cities', type=int, default=100)
+    parser.add_argument('--days', type=int, default=30)
+    parser.add_argument('--alerts-count', type=int, default=10000, help='alerts in the generated database')
+    parser.add_argument('--files', type=int, default=1000)
+    parser.add_argument('--users', type=int, default=10)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write the JSON report here instead of stdout')
+    parser.add_argument('--baseline', help='report to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='allowed relative slowdown')
+    parser.add_argument('--save-baseline', help='also write the report here, as the new baseline')
+    args = parser.parse_args()
+    args.scenarios = [name.strip() for name in args.scenarios.split(',') if name.strip()]
+    unknown = set(args.scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"unknown scenarios: {', '.join(sorted(unknown))}")
+
+    report = run(args)
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        if baseline.get('config') != report['config']:
+            print("warning: baseline was recorded with different settings", file=sys.stderr)
+        report['comparison'] = compare(report, baseline, args.tolerance)
+
+    print_summary(report)
+    text = json.dumps(report, indent=2)
+    if args.output:
+        with open(args.output, 'w') as f:
+            f.write(text + '\n')
+    else:
+        print(text)
+    if args.save_baseline:
+        with open(args.save_baseline, 'w') as f:
+            f.write(text + '\n')
+
+    if report.get('comparison', {}).get('regressions'):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,89 @@
+# Range queries over a multi-year, multi-city forecast history: monthly and
+# yearly statistics for every city over the whole range, computed by a plain
+# GROUP BY over weather_data and by timeseries.aggregate() over the
+# precomputed rollups, plus single-city rollup lookups.
+#
+#   python -m benchmarks.timeseries_range --cities 5000 --years 10
+import argparse
+import datetime
+import math
+import os
+import random
+import tempfile
+import time
+
+import db
+import ingest
+import migrations
+import timeseries
+
+CONDITIONS = ('Sunny', 'Cloudy', 'Rainy', 'Snowy', 'Windy', 'Foggy')
+
+
+# One row per city and day: a seasonal temperature curve plus noise
+def generate_rows(cities, start, days, seed=0):
+    rng = random.Random(seed)
+    for city in range(cities):
+        offset = rng.uniform(-10, 10)
+        for day in range(days):
+            date = start + datetime.timedelta(days=day)
+            season = 15 * math.sin(2 * math.pi * (date.timetuple().tm_yday - 100) / 365)
+            yield (f'City{city:05d}', date.isoformat(), round(offset + season + rng.gauss(0, 4)),
+                   rng.choice(CONDITIONS))
+
+
+def timed(label, run, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = run()
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f"{label:44} {elapsed * 1000:10.1f} ms")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Time-series range query benchmark')
+    parser.add_argument('--cities', type=int, default=5000)
+    parser.add_argument('--years', type=int, default=10)
+    args = parser.parse_args()
+
+    start = datetime.date(2015, 1, 1)
+    end = start.replace(year=start.year + args.years) - datetime.timedelta(days=1)
+    days = (end - start).days + 1
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.set_database(os.path.join(tmp, 'bench.db'))
+        migrations.migrate()
+
+        stats = ingest.ingest_rows(generate_rows(args.cities, start, days))
+        print(f"ingested {stats['rows']} rows in {stats['seconds']:.1f}s "
+              f"({stats['rows_per_second']:.0f} rows/s)")
+        timed('build rollups (refresh)', timeseries.refresh)
+        print(f"NumPy: {'yes' if timeseries.load_numpy() is not None else 'no (pure Python)'}")
+
+        conn = db.get_connection()
+        first, last = start.isoformat(), end.isoformat()
+        timed('monthly stats, GROUP BY weather_data', lambda: conn.execute('''
+            SELECT city, strftime('%Y-%m', date), count(*), min(temperature), avg(temperature), max(temperature)
+            FROM weather_data
+            WHERE date BETWEEN ? AND ?
+            GROUP BY city, 2
+        ''', (first, last)).fetchall())
+        monthly = timed('monthly stats, aggregate() on rollups', lambda: timeseries.aggregate(None, first, last))
+        timed('yearly stats, aggregate() on rollups',
+              lambda: timeseries.aggregate(None, first, last, 'year'))
+        timed('whole-range stats, aggregate() on rollups',
+              lambda: timeseries.aggregate(None, first, last, 'all'))
+        # A range that doesn't line up with months reads its partial months from daily rollups
+        timed('monthly stats, unaligned range',
+              lambda: timeseries.aggregate(None, (start + datetime.timedelta(days=3)).isoformat(), last))
+
+        sample = [f'City{city:05d}' for city in random.Random(1).sample(range(args.cities), min(100, args.cities))]
+        timed('one city, monthly rollups over the range',
+              lambda: [timeseries.rollups(city, 'month', first, last) for city in sample], repeat=1)
+        print(f"{len(monthly)} (city, month) groups")
+        db.close_all()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,83 @@
+# Upload throughput and peak memory of the streaming, content-addressed store,
+# both for a single streamed upload and for a resumable chunked upload.
+#
+#   python -m benchmarks.upload_throughput --size-mb 1024
+import argparse
+import io
+import os
+import resource
+import tempfile
+import time
+import tracemalloc
+
+import db
+import file_store
+import migrations
+
+
+# Readable stream of `size` bytes generated on the fly (never held in memory)
+class GeneratedStream(io.RawIOBase):
+    def __init__(self, size, seed=0):
+        self.remaining = size
+        self.block = bytes((seed + i) % 251 for i in range(1024 * 1024))
+
+    def readable(self):
+        return True
+
+    def read(self, n=-1):
+        if self.remaining <= 0:
+            return b''
+        n = min(n if n and n > 0 else len(self.block), self.remaining)
+        self.remaining -= n
+        if n <= len(self.block):
+            return self.block[:n]
+        return (self.block * (n // len(self.block) + 1))[:n]
+
+
+def measure(label, size, run):
+    tracemalloc.start()
+    start = time.perf_counter()
+    result = run()
+    elapsed = time.perf_counter() - start
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    print(f"{label:22} {size / elapsed / 1e6:8.1f} MB/s  peak Python heap {peak / 1e6:6.1f} MB")
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Streaming upload throughput and peak memory')
+    parser.add_argument('--size-mb', type=int, default=1024)
+    parser.add_argument('--chunk-mb', type=int, default=8, help='chunk size for the resumable upload')
+    args = parser.parse_args()
+    size = args.size_mb * 1024 * 1024
+    chunk = args.chunk_mb * 1024 * 1024
+
+    with tempfile.TemporaryDirectory() as tmp:
+        db.set_database(os.path.join(tmp, 'bench.db'))
+        migrations.migrate()
+        file_store.STORAGE_ROOT = os.path.join(tmp, 'uploads')
+
+        measure('streamed upload', size,
+                lambda: file_store.save_upload(GeneratedStream(size, 1), 'bench.bin', 'bench'))
+
+        # Same content again: hashed and then deduplicated
+        measure('duplicate upload', size,
+                lambda: file_store.save_upload(GeneratedStream(size, 1), 'copy.bin', 'bench'))
+
+        def chunked():
+            upload_id = file_store.begin_upload('chunked.bin', 'bench', size)
+            stream = GeneratedStream(size, 2)
+            for offset in range(0, size, chunk):
+                part = io.BytesIO(stream.read(min(chunk, size - offset)))
+                file_store.append_chunk(upload_id, offset, part)
+            return file_store.complete_upload(upload_id)
+
+        measure('chunked resumable', size, chunked)
+        db.close_all()
+
+    print(f"process max RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.1f} MB")
+
+
+if __name__ == '__main__':
+    main()
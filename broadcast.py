@@ -0,0 +1,145 @@
+import logging
+import os
+import threading
+import time
+
+logger = logging.getLogger(__name__)
+
+# Coalescing broadcast scheduler and inbound rate limiting for Socket.IO alerts.
+#
+# Alerts submitted within one window are sent together as one micro-batch,
+# grouped by city, so a burst of N alerts costs one emit instead of N. Every
+# distinct alert is kept; only repeats of an alert already pending (the same
+# id, or the same message when there is no id) are merged into it. Inbound socket events
+# are rate-limited per user with a token bucket before they can trigger any
+# broadcast at all.
+
+COALESCE_WINDOW = float(os.environ.get('WEATHER_BROADCAST_WINDOW', '0.25'))
+MAX_BATCH = int(os.environ.get('WEATHER_BROADCAST_MAX_BATCH', '100'))
+INBOUND_RATE = float(os.environ.get('WEATHER_INBOUND_RATE', '1'))  # events per second per user
+INBOUND_BURST = float(os.environ.get('WEATHER_INBOUND_BURST', '5'))
+
+
+def _start_thread(target):
+    thread = threading.Thread(target=target, name='broadcast-scheduler', daemon=True)
+    thread.start()
+    return thread
+
+
+class BroadcastScheduler:
+    # emit_batch(alerts) receives a list of {'city', 'message', 'id', 'merged'}
+    # dicts, 'merged' counting the repeats folded into each. start_task runs the flush loop (socketio.start_background_task
+    # under eventlet/gevent; a thread otherwise).
+    def __init__(self, emit_batch, window=COALESCE_WINDOW, max_batch=MAX_BATCH, start_task=_start_thread):
+        self.emit_batch = emit_batch
+        self.window = window
+        self.max_batch = max_batch
+        self.start_task = start_task
+        self._pending = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._started = False
+        self.submitted = 0
+        self.merged = 0
+        self.batches = 0
+        self.sent = 0
+
+    # Queue an alert for the next batch, unless it repeats one already pending
+    def submit(self, city, message, alert_id=None):
+        with self._lock:
+            self.submitted += 1
+            # Re-inserting keeps the dict ordered by most recent activity
+            alerts = self._pending.pop(city, [])
+            self._pending[city] = alerts
+            for alert in alerts:
+                if (alert['id'] == alert_id) if alert_id is not None else (alert['message'] == message):
+                    alert['merged'] += 1
+                    self.merged += 1
+                    break
+            else:
+                alerts.append({'city': city, 'message': message, 'id': alert_id, 'merged': 0})
+            if not self._started:
+                self._started = True
+                self.start_task(self._run)
+        self._wakeup.set()
+
+    # Send everything pending now, in batches of at most max_batch alerts
+    def flush(self):
+        with self._lock:
+            pending = [alert for alerts in self._pending.values() for alert in alerts]
+            self._pending.clear()
+        for start in range(0, len(pending), self.max_batch):
+            batch = pending[start:start + self.max_batch]
+            try:
+                self.emit_batch(batch)
+            except Exception as e:
+                logger.exception("Error broadcasting alert batch")
+                continue
+            with self._lock:
+                self.batches += 1
+                self.sent += len(batch)
+
+    def _run(self):
+        while True:
+            self._wakeup.wait()
+            self._wakeup.clear()
+            # Let the window fill up before sending
+            time.sleep(self.window)
+            self.flush()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'submitted': self.submitted,
+                'merged': self.merged,
+                'batches': self.batches,
+                'sent': self.sent,
+                'pending': sum(len(alerts) for alerts in self._pending.values()),
+            }
+
+
+class RateLimiter:
+    # Per-key token buckets: each key earns `rate` tokens per second up to `burst`
+    def __init__(self, rate=INBOUND_RATE, burst=INBOUND_BURST, max_keys=100000):
+        self.rate = rate
+        self.burst = burst
+        self.max_keys = max_keys
+        self._buckets = {}
+        self._lock = threading.Lock()
+        self.allowed = 0
+        self.suppressed = 0
+
+    # Take one token for key; returns False if the event should be dropped
+    def allow(self, key):
+        now = time.monotonic()
+        with self._lock:
+            tokens, last = self._buckets.get(key, (self.burst, now))
+            tokens = min(self.burst, tokens + (now - last) * self.rate)
+            if tokens < 1:
+                self._buckets[key] = (tokens, now)
+                self.suppressed += 1
+                return False
+            if key not in self._buckets and len(self._buckets) >= self.max_keys:
+                # Forget the bucket that was touched longest ago
+                self._buckets.pop(next(iter(self._buckets)))
+            self._buckets.pop(key, None)
+            self._buckets[key] = (tokens - 1, now)
+            self.allowed += 1
+            return True
+
+    def stats(self):
+        with self._lock:
+            return {'allowed': self.allowed, 'suppressed': self.suppressed, 'keys': len(self._buckets)}
+
+
+# One alert for a batch as a single line, for clients that only read 'message'
+def batch_message(alerts):
+    if len(alerts) == 1:
+        return alerts[0]['message']
+    return '; '.join(f"{alert['city']}: {alert['message']}" for alert in alerts)
+
+
+# The 'new_alert' Socket.IO payload for a batch. 'message' summarises the batch
+# for clients that only read that field; 'alerts' carries each alert.
+def batch_event(alerts):
+    return {'message': batch_message(alerts), 'alerts': alerts}
@@ -0,0 +1,197 @@
+import bisect
+import csv
+import itertools
+import re
+import sys
+import threading
+import time
+import unicodedata
+import db
+
+# In-memory index of the city registry (the cities and city_aliases tables)
+# for autocomplete and for resolving free-text city input.
+#
+# Names and aliases are normalized (accents, case and punctuation removed) and
+# kept in one sorted list of (normalized, city id) pairs, so a prefix lookup is
+# a binary search followed by a short forward scan. The index loads on first
+# use and then picks up rows added since (by ingest in this process, or by any
+# other process) at most every REFRESH_INTERVAL seconds.
+
+REFRESH_INTERVAL = 5.0
+DEFAULT_LIMIT = 10
+MAX_LIMIT = 100
+
+_NON_ALNUM = re.compile(r'[^0-9a-z]+')
+
+
+# Lower-case, strip accents and collapse punctuation/whitespace to single spaces:
+# 'Montréal' -> 'montreal', "St. John's" -> 'st john s'
+def normalize(name):
+    decomposed = unicodedata.normalize('NFKD', name)
+    stripped = ''.join(ch for ch in decomposed if not unicodedata.combining(ch))
+    return _NON_ALNUM.sub(' ', stripped.casefold()).strip()
+
+
+# --- Registry (database) ---------------------------------------------------
+
+# Register city names that aren't known yet (e.g. from an ingest batch). With
+# commit=False the inserts join the caller's transaction.
+def register_cities(names, commit=True):
+    conn = db.get_connection()
+    conn.executemany('INSERT OR IGNORE INTO cities (name, normalized) VALUES (?, ?)',
+                     [(name, normalize(name)) for name in set(names)])
+    if commit:
+        conn.commit()
+
+
+# Add or update a city with its country/region and aliases; returns its id
+def add_city(name, country=None, region=None, aliases=(), commit=True):
+    conn = db.get_connection()
+    conn.execute('''
+        INSERT INTO cities (name, normalized, country, region)
+        VALUES (?, ?, ?, ?)
+        ON CONFLICT (name) DO UPDATE SET country = excluded.country, region = excluded.region
+    ''', (name, normalize(name), country, region))
+    city_id = conn.execute('SELECT id FROM cities WHERE name = ?', (name,)).fetchone()[0]
+    conn.executemany('INSERT OR IGNORE INTO city_aliases (city_id, alias, normalized) VALUES (?, ?, ?)',
+                     [(city_id, alias, normalize(alias)) for alias in aliases if normalize(alias)])
+    if commit:
+        conn.commit()
+    return city_id
+
+
+# Load places from a CSV with name,country,region,aliases columns (aliases
+# separated by '|'); returns the number of rows read
+def import_csv(path, batch_size=5000):
+    count = 0
+    conn = db.get_connection()
+    with open(path, newline='', encoding='utf-8') as f:
+        for record in csv.DictReader(f):
+            aliases = [alias for alias in (record.get('aliases') or '').split('|') if alias]
+            add_city(record['name'], record.get('country') or None, record.get('region') or None,
+                     aliases, commit=False)
+            count += 1
+            if count % batch_size == 0:
+                conn.commit()
+    conn.commit()
+    return count
+
+
+# --- In-memory index -------------------------------------------------------
+
+class CityIndex:
+    def __init__(self, refresh_interval=REFRESH_INTERVAL):
+        self.refresh_interval = refresh_interval
+        # Sorted (normalized name or alias, city id) pairs
+        self._keys = []
+        # city id -> {'name', 'country', 'region'}, shared by every result
+        self._cities = {}
+        self._last_city_id = 0
+        self._last_alias_id = 0
+        self._checked_at = None
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    @property
+    def loaded(self):
+        return self._checked_at is not None
+
+    # Pick up registry rows added since the last load; the first call loads
+    # everything. Edits to existing rows (e.g. a new country) show up after a restart.
+    def refresh(self):
+        conn = db.get_connection()
+        with self._lock:
+            cities = conn.execute('SELECT id, name, normalized, country, region FROM cities WHERE id > ? ORDER BY id',
+                                  (self._last_city_id,)).fetchall()
+            last_city_id = cities[-1][0] if cities else self._last_city_id
+            # Aliases of cities committed after the query above wait for the next refresh
+            aliases = conn.execute('SELECT id, city_id, normalized FROM city_aliases WHERE id > ? ORDER BY id',
+                                   (self._last_alias_id,)).fetchall()
+            aliases = list(itertools.takewhile(lambda alias: alias[1] <= last_city_id, aliases))
+            added = [(normalized, city_id) for city_id, _, normalized, _, _ in cities]
+            added += [(normalized, city_id) for _, city_id, normalized in aliases]
+            for city_id, name, _, country, region in cities:
+                self._cities[city_id] = {'name': name, 'country': country, 'region': region}
+            if len(added) > len(self._keys) // 16:
+                # Bulk load: one sort is cheaper than many insertions
+                self._keys = sorted(self._keys + added)
+            else:
+                keys = list(self._keys)
+                for key in added:
+                    bisect.insort(keys, key)
+                self._keys = keys
+            self._last_city_id = last_city_id
+            if aliases:
+                self._last_alias_id = aliases[-1][0]
+            self._checked_at = time.monotonic()
+        return len(added)
+
+    def _maybe_refresh(self):
+        checked_at = self._checked_at
+        if checked_at is None or time.monotonic() - checked_at >= self.refresh_interval:
+            self.refresh()
+
+    # Cities whose name or an alias starts with `prefix`, alphabetically by the
+    # matching key (so an exact match comes first)
+    def search(self, prefix, limit=DEFAULT_LIMIT):
+        self._maybe_refresh()
+        prefix = normalize(prefix)
+        if not prefix:
+            return []
+        limit = max(1, min(int(limit), MAX_LIMIT))
+        # Readers use the list as it is; refresh() replaces it rather than mutating it
+        keys = self._keys
+        results = []
+        seen = set()
+        for position in range(bisect.bisect_left(keys, (prefix,)), len(keys)):
+            key, city_id = keys[position]
+            if not key.startswith(prefix):
+                break
+            if city_id in seen:
+                continue
+            seen.add(city_id)
+            results.append(self._cities[city_id])
+            if len(results) == limit:
+                break
+        return results
+
+    # Suggestions for input that matched nothing: cities starting with the
+    # longest prefix of it (at least min_length characters) that has matches
+    def suggest(self, text, limit=DEFAULT_LIMIT, min_length=3):
+        key = normalize(text)
+        for length in range(len(key), min_length - 1, -1):
+            results = self.search(key[:length], limit)
+            if results:
+                return results
+        return []
+
+    # The registered name for free-text input matching a name or alias exactly
+    # after normalization (None if unknown or ambiguous)
+    def resolve(self, text):
+        self._maybe_refresh()
+        key = normalize(text)
+        keys = self._keys
+        position = bisect.bisect_left(keys, (key,))
+        matches = set()
+        while position < len(keys) and keys[position][0] == key:
+            matches.add(keys[position][1])
+            position += 1
+        if len(matches) != 1:
+            return None
+        return self._cities[matches.pop()]['name']
+
+
+city_index = CityIndex()
+
+
+# python city_index.py import places.csv
+if __name__ == '__main__':
+    import migrations
+    migrations.migrate()
+    if len(sys.argv) == 3 and sys.argv[1] == 'import':
+        print(f"Imported {import_csv(sys.argv[2])} places")
+    else:
+        print("usage: python city_index.py import <places.csv>")
+        sys.exit(2)
@@ -0,0 +1,25 @@
+import db
+
+# Version counters for the data that cached pages are rendered from (see
+# page_cache.py).
+#
+# Writers call bump() inside the transaction that changes the data, so the
+# new version becomes visible exactly when the change commits, in every
+# worker and process sharing weather_net.db. Reading a version is one
+# primary-key lookup.
+
+ALERTS = 'alerts'
+FILES = 'files'
+PRESENCE = 'presence'
+
+
+# Count a change to `name`; takes effect when the caller commits
+def bump(name, conn=None):
+    conn = conn or db.get_connection()
+    conn.execute('UPDATE data_versions SET version = version + 1 WHERE name = ?', (name,))
+
+
+# Current version of `name` (0 before the first change)
+def get(name):
+    row = db.get_connection().execute('SELECT version FROM data_versions WHERE name = ?', (name,)).fetchone()
+    return row[0] if row else 0
@@ -0,0 +1,196 @@
+import os
+import sqlite3
+import threading
+import time
+import weakref
+import metrics
+import offload
+
+try:
+    from greenlet import getcurrent as _current_greenlet
+except ImportError:  # greenlet is only present under eventlet/gevent
+    _current_greenlet = None
+
+# Path to SQLite database file shared by user_db and alerts_db
+DATABASE = os.environ.get('WEATHER_DB_PATH', 'weather_net.db')
+
+# Connection tuning (overridable from the environment)
+BUSY_TIMEOUT_MS = int(os.environ.get('WEATHER_DB_BUSY_TIMEOUT_MS', '5000'))
+SYNCHRONOUS = os.environ.get('WEATHER_DB_SYNCHRONOUS', 'NORMAL')
+JOURNAL_MODE = os.environ.get('WEATHER_DB_JOURNAL_MODE', 'WAL')
+CACHED_STATEMENTS = int(os.environ.get('WEATHER_DB_CACHED_STATEMENTS', '256'))
+
+# Per-thread storage; each thread keeps one connection per greenlet
+_local = threading.local()
+# Every connection opened so far, so they can all be closed on shutdown
+_all_connections = weakref.WeakSet()
+_all_lock = offload.native_lock()
+# Bumped by close_all() so other threads drop their closed connections
+_generation = 0
+
+
+# Cursor that records each statement's execution time and row count in
+# metrics, by statement fingerprint. Rows changed and rows read with fetch*()
+# are counted; rows read by iterating over the cursor only with
+# RowCountingCursor, since a Python-level __next__ costs about as much as the
+# query itself.
+class InstrumentedCursor(sqlite3.Cursor):
+    _statement = None
+    _rows = 0
+
+    def _flush(self):
+        if self._statement is not None:
+            metrics.db_query_rows.inc(self._statement, amount=self._rows)
+            self._statement = None
+            self._rows = 0
+
+    def _timed(self, method, sql, parameters):
+        self._flush()
+        start = time.perf_counter()
+        try:
+            return method(sql, parameters)
+        finally:
+            statement = metrics.fingerprint(sql)
+            metrics.db_query_duration.observe(statement, value=time.perf_counter() - start)
+            if self.description is None:
+                metrics.db_query_rows.inc(statement, amount=max(self.rowcount, 0))
+            else:
+                self._statement = statement
+
+    def execute(self, sql, parameters=()):
+        return self._timed(super().execute, sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        return self._timed(super().executemany, sql, seq_of_parameters)
+
+    def fetchone(self):
+        row = super().fetchone()
+        if row is None:
+            self._flush()
+        else:
+            self._rows += 1
+        return row
+
+    def fetchmany(self, size=None):
+        rows = super().fetchmany(self.arraysize if size is None else size)
+        self._rows += len(rows)
+        return rows
+
+    def fetchall(self):
+        rows = super().fetchall()
+        self._rows += len(rows)
+        self._flush()
+        return rows
+
+    def close(self):
+        self._flush()
+        super().close()
+
+
+# InstrumentedCursor that also counts rows read by iteration, flushed when the
+# cursor is exhausted, re-executed or closed (metrics.COUNT_ITERATED_ROWS)
+class RowCountingCursor(InstrumentedCursor):
+    def __next__(self):
+        try:
+            row = super().__next__()
+        except StopIteration:
+            self._flush()
+            raise
+        self._rows += 1
+        return row
+
+
+# sqlite3.Connection itself can't be weakly referenced; a subclass can.
+# While metrics are enabled its cursors time every statement.
+class PooledConnection(sqlite3.Connection):
+    def cursor(self, factory=None):
+        if factory is None:
+            if not metrics.ENABLED:
+                factory = sqlite3.Cursor
+            elif metrics.COUNT_ITERATED_ROWS:
+                factory = RowCountingCursor
+            else:
+                factory = InstrumentedCursor
+        return super().cursor(factory)
+
+    # Connection.execute* don't go through cursor(), so route them explicitly
+    def execute(self, sql, parameters=()):
+        if not metrics.ENABLED:
+            return super().execute(sql, parameters)
+        return self.cursor().execute(sql, parameters)
+
+    def executemany(self, sql, seq_of_parameters):
+        if not metrics.ENABLED:
+            return super().executemany(sql, seq_of_parameters)
+        return self.cursor().executemany(sql, seq_of_parameters)
+
+
+# Open a new connection and apply the pragmas
+def _open_connection():
+    conn = sqlite3.connect(DATABASE,
+                           timeout=BUSY_TIMEOUT_MS / 1000.0,
+                           cached_statements=CACHED_STATEMENTS,
+                           check_same_thread=False,
+                           factory=PooledConnection)
+    conn.execute(f'PRAGMA journal_mode={JOURNAL_MODE}')
+    conn.execute(f'PRAGMA busy_timeout={BUSY_TIMEOUT_MS}')
+    conn.execute(f'PRAGMA synchronous={SYNCHRONOUS}')
+    conn.execute('PRAGMA foreign_keys=ON')
+    with _all_lock:
+        _all_connections.add(conn)
+    return conn
+
+
+# Return the connection slots for the calling thread, keyed by greenlet
+def _slots():
+    slots = getattr(_local, 'slots', None)
+    if slots is None or getattr(_local, 'generation', None) != _generation:
+        # Dead greenlets drop out of the mapping together with their connection
+        slots = weakref.WeakKeyDictionary() if _current_greenlet else {}
+        _local.slots = slots
+        _local.generation = _generation
+    return slots
+
+
+def _slot_key():
+    return _current_greenlet() if _current_greenlet else None
+
+
+# Get the reusable connection for the current thread/greenlet.
+# Callers must not close it; use close_connection() or close_all() instead.
+def get_connection():
+    slots = _slots()
+    key = _slot_key()
+    conn = slots.get(key)
+    if conn is None:
+        conn = _open_connection()
+        slots[key] = conn
+    return conn
+
+
+# Close the connection owned by the current thread/greenlet, if any
+def close_connection():
+    conn = _slots().pop(_slot_key(), None)
+    if conn is not None:
+        conn.close()
+
+
+# Close every pooled connection (e.g. on shutdown or after changing DATABASE)
+def close_all():
+    global _generation
+    with _all_lock:
+        _generation += 1
+        conns = list(_all_connections)
+        _all_connections.clear()
+    for conn in conns:
+        try:
+            conn.close()
+        except sqlite3.ProgrammingError:
+            pass
+
+
+# Point the pool at a different database file
+def set_database(path):
+    global DATABASE
+    close_all()
+    DATABASE = path
@@ -0,0 +1,124 @@
+import os
+import unicodedata
+from datetime import datetime, timezone
+from urllib.parse import quote
+from flask import Response, current_app, request
+from werkzeug.datastructures import Headers
+from werkzeug.http import http_date, is_resource_modified, parse_etags, quote_etag
+
+# File downloads with strong ETags, conditional GET, HTTP Range support and
+# zero-copy delivery.
+#
+# How the bytes leave the worker is picked by app.config['DOWNLOAD_OFFLOAD']:
+#   ''            the worker returns the file itself. Only Gunicorn turns
+#                 that into os.sendfile (its wsgi.file_wrapper, including for
+#                 ranges: the file is positioned at the range start and
+#                 Content-Length limits the copy). Under serve.py (eventlet
+#                 or gevent) and the development server the bytes are read
+#                 and written through the worker, BLOCK_SIZE at a time.
+#   'x-accel'     nginx serves it: X-Accel-Redirect to
+#                 DOWNLOAD_ACCEL_PREFIX + the path relative to the upload root
+#   'x-sendfile'  Apache/lighttpd serve it: X-Sendfile with the absolute path
+# The proxy handles Range itself in the last two modes. 'x-accel' behind nginx
+# is the recommended setting for serve.py deployments.
+
+BLOCK_SIZE = 1024 * 1024
+
+# Servers whose wsgi.file_wrapper stops at Content-Length and uses sendfile
+_SENDFILE_SERVERS = ('gunicorn',)
+
+
+# Read `length` bytes from f in blocks, for servers without a usable file_wrapper
+def _iter_range(f, length):
+    try:
+        while length > 0:
+            data = f.read(min(BLOCK_SIZE, length))
+            if not data:
+                break
+            length -= len(data)
+            yield data
+    finally:
+        f.close()
+
+
+# Content-Disposition for a user-supplied name, built the way Werkzeug's
+# send_file does: the name is quoted as needed, and non-ASCII names get an
+# ASCII fallback plus an RFC 5987 filename*
+def content_disposition(download_name):
+    try:
+        download_name.encode('ascii')
+    except UnicodeEncodeError:
+        simple = unicodedata.normalize('NFKD', download_name).encode('ascii', 'ignore').decode('ascii')
+        names = {'filename': simple, 'filename*': "UTF-8''" + quote(download_name, safe="!#$&+-.^_`|~")}
+    else:
+        names = {'filename': download_name}
+    headers = Headers()
+    headers.set('Content-Disposition', 'attachment', **names)
+    return headers['Content-Disposition']
+
+
+def _body(f, length, whole_file):
+    environ = request.environ
+    file_wrapper = environ.get('wsgi.file_wrapper')
+    server = environ.get('SERVER_SOFTWARE', '')
+    if file_wrapper and (whole_file or server.startswith(_SENDFILE_SERVERS)):
+        return file_wrapper(f, BLOCK_SIZE)
+    return _iter_range(f, length)
+
+
+# Build the download response for a file on disk.
+#   sha256         content hash from the metadata; used as a strong ETag
+#   relative_path  path under the upload root, for X-Accel-Redirect
+def send_stored_file(path, download_name, sha256=None, relative_path=None):
+    stat = os.stat(path)
+    size = stat.st_size
+    if sha256:
+        etag, weak = sha256, False
+    else:
+        # No content hash (e.g. deleted files): derive a weak one from the inode
+        etag, weak = f"{stat.st_mtime_ns:x}-{size:x}", True
+    # Whole seconds, as HTTP dates carry them, so If-Modified-Since compares equal
+    last_modified = datetime.fromtimestamp(int(stat.st_mtime), timezone.utc)
+
+    headers = {
+        'ETag': quote_etag(etag, weak),
+        'Last-Modified': http_date(last_modified),
+        'Accept-Ranges': 'bytes',
+        'Cache-Control': 'private, no-cache',
+        'Content-Disposition': content_disposition(download_name),
+    }
+
+    if not is_resource_modified(request.environ, etag=etag, last_modified=last_modified):
+        return Response(status=304, headers=headers)
+
+    offload = current_app.config.get('DOWNLOAD_OFFLOAD', '')
+    if offload == 'x-accel' and relative_path:
+        prefix = current_app.config.get('DOWNLOAD_ACCEL_PREFIX', '/protected/')
+        headers['X-Accel-Redirect'] = prefix.rstrip('/') + '/' + relative_path.replace(os.sep, '/')
+        return Response(headers=headers, mimetype='application/octet-stream')
+    if offload == 'x-sendfile':
+        headers['X-Sendfile'] = os.path.abspath(path)
+        return Response(headers=headers, mimetype='application/octet-stream')
+
+    start, stop, status = 0, size, 200
+    byte_range = request.range
+    # If-Range: only honour the range if the client's copy is still current
+    if_range = request.headers.get('If-Range')
+    if byte_range and (not if_range or (not weak and etag in parse_etags(if_range))):
+        span = byte_range.range_for_length(size)
+        if span is None:
+            if len(byte_range.ranges) == 1:
+                headers['Content-Range'] = f'bytes */{size}'
+                return Response(status=416, headers=headers)
+            # Multipart ranges aren't supported; fall back to the whole file
+        else:
+            start, stop = span
+            status = 206
+            headers['Content-Range'] = f'bytes {start}-{stop - 1}/{size}'
+
+    f = open(path, 'rb')
+    f.seek(start)
+    length = stop - start
+    headers['Content-Length'] = str(length)
+    return Response(_body(f, length, status == 200), status=status, headers=headers,
+                    mimetype='application/octet-stream', direct_passthrough=True)
@@ -0,0 +1,163 @@
+import logging
+import os
+import sys
+import threading
+import time
+import file_store
+import user_db
+
+logger = logging.getLogger(__name__)
+
+# Keeps the file catalog in the database and the files on disk consistent.
+#
+# One pass:
+#   - drops rows (live or deleted) whose content no longer exists on disk
+#   - adds rows for files in the deleted-files folder that no row tracks
+#     (files deleted before deletions were recorded in the database)
+#   - removes stored objects that no row refers to any more
+#   - removes temp files left behind by interrupted uploads
+# Objects and temp files younger than ORPHAN_GRACE are left alone, since an
+# upload in progress writes its object before its row.
+#
+#   python file_reconciler.py [--once]
+
+RECONCILE_INTERVAL = float(os.environ.get('WEATHER_RECONCILE_INTERVAL', '300'))
+ORPHAN_GRACE = float(os.environ.get('WEATHER_ORPHAN_GRACE', '3600'))
+BATCH_SIZE = 1000
+DELETED_FILES_FOLDER = './deleted_files'
+
+
+def _start_thread(target):
+    thread = threading.Thread(target=target, name='file-reconciler', daemon=True)
+    thread.start()
+    return thread
+
+
+# Path a row's content should be at
+def _content_path(row):
+    if row['deleted']:
+        return file_store.deleted_path_for(row)
+    return file_store.path_for(row, row['filename'])
+
+
+# Drop rows whose content is missing, walking the table in id order
+def purge_missing_rows(batch_size=BATCH_SIZE):
+    purged = 0
+    after_id = 0
+    while True:
+        rows = user_db.get_files_after(after_id, batch_size)
+        if not rows:
+            return purged
+        for row in rows:
+            path = _content_path(row)
+            if not path or not os.path.isfile(path):
+                logger.info("Dropping file row, content missing",
+                            extra={'file_id': row['id'], 'file_name': row['filename']})
+                user_db.purge_file_metadata(row['id'])
+                purged += 1
+        after_id = rows[-1]['id']
+
+
+# Record untracked files in the deleted-files folder as deleted rows
+def import_deleted_files(deleted_folder):
+    imported = 0
+    if not os.path.isdir(deleted_folder):
+        return imported
+    with os.scandir(deleted_folder) as entries:
+        for entry in entries:
+            if not entry.is_file():
+                continue
+            path = os.path.join(deleted_folder, entry.name)
+            if user_db.is_deleted_path_tracked(path):
+                continue
+            file_id = user_db.save_file_metadata(entry.name, 'unknown', size=entry.stat().st_size)
+            user_db.soft_delete_file(file_id, path)
+            imported += 1
+    return imported
+
+
+def _older_than(entry, cutoff):
+    try:
+        return entry.stat().st_mtime < cutoff
+    except FileNotFoundError:
+        return False
+
+
+# Remove stored objects that no row refers to
+def remove_orphan_objects(grace=ORPHAN_GRACE):
+    removed = 0
+    cutoff = time.time() - grace
+    root = os.path.join(file_store.STORAGE_ROOT, 'objects')
+    for directory, _, filenames in os.walk(root):
+        for name in filenames:
+            path = os.path.join(directory, name)
+            try:
+                if os.path.getmtime(path) >= cutoff:
+                    continue
+            except FileNotFoundError:
+                continue
+            if not user_db.is_content_referenced(name):
+                os.unlink(path)
+                removed += 1
+    return removed
+
+
+# Remove temp files from interrupted streamed uploads and abandoned sessions
+def remove_stale_partials(grace=ORPHAN_GRACE):
+    removed = 0
+    cutoff = time.time() - grace
+    partial = os.path.join(file_store.STORAGE_ROOT, 'partial')
+    if not os.path.isdir(partial):
+        return removed
+    with os.scandir(partial) as entries:
+        for entry in entries:
+            if not entry.is_file() or not _older_than(entry, cutoff):
+                continue
+            if entry.name.startswith('session-'):
+                # Resumable uploads stay as long as their session does
+                if user_db.get_upload_session(entry.name[len('session-'):]) is not None:
+                    continue
+            os.unlink(entry.path)
+            removed += 1
+    return removed
+
+
+# Run one reconciliation pass; returns counts of what was fixed
+def reconcile(deleted_folder=DELETED_FILES_FOLDER, grace=ORPHAN_GRACE):
+    # A missing upload folder means a wrong working directory or an unmounted
+    # volume, not that every file is gone
+    if not os.path.isdir(file_store.STORAGE_ROOT):
+        logger.warning("Upload folder %s not found, skipping reconciliation", file_store.STORAGE_ROOT)
+        return None
+    return {
+        'imported': import_deleted_files(deleted_folder),
+        'purged': purge_missing_rows(),
+        'orphans': remove_orphan_objects(grace),
+        'partials': remove_stale_partials(grace),
+    }
+
+
+# Reconcile every `interval` seconds in the background. start_task runs the
+# loop (socketio.start_background_task under eventlet/gevent; a thread otherwise).
+def start_reconciler(deleted_folder=DELETED_FILES_FOLDER, interval=RECONCILE_INTERVAL,
+                     start_task=_start_thread):
+    def run():
+        while True:
+            try:
+                stats = reconcile(deleted_folder)
+                if stats and any(stats.values()):
+                    logger.info("Reconciled files", extra=stats)
+            except Exception as e:
+                logger.exception("Error reconciling files")
+            time.sleep(interval)
+
+    return start_task(run)
+
+
+if __name__ == '__main__':
+    import migrations
+    migrations.migrate()
+    if '--once' in sys.argv:
+        print(reconcile())
+    else:
+        start_reconciler(interval=RECONCILE_INTERVAL).join()
@@ -0,0 +1,225 @@
+import hashlib
+import os
+import shutil
+import tempfile
+import uuid
+import user_db
+
+# Content-addressed storage for uploaded files.
+#
+# Uploads are streamed to a temporary file in fixed-size chunks while their
+# SHA-256 is computed, then moved to objects/<aa>/<bb>/<sha256> under the
+# upload folder. Identical content is stored once, and two users uploading
+# 'report.pdf' get separate metadata rows instead of overwriting each other.
+# Large files can also be sent as resumable chunked uploads (see the
+# /api/uploads routes in app.py).
+
+STORAGE_ROOT = './uploads'
+CHUNK_SIZE = 1024 * 1024
+
+
+def _partial_dir():
+    path = os.path.join(STORAGE_ROOT, 'partial')
+    os.makedirs(path, exist_ok=True)
+    return path
+
+
+# Storage key (path relative to STORAGE_ROOT) for a content hash
+def storage_key_for(sha256):
+    return os.path.join('objects', sha256[:2], sha256[2:4], sha256)
+
+
+# Filesystem path of a stored object
+def object_path(storage_key):
+    return os.path.join(STORAGE_ROOT, storage_key)
+
+
+# Where the content for a file's metadata lives: its stored object, or for
+# files uploaded before content addressing, <STORAGE_ROOT>/<filename>
+def path_for(metadata, filename):
+    if metadata and metadata.get('storage_key'):
+        return object_path(metadata['storage_key'])
+    return os.path.join(STORAGE_ROOT, filename)
+
+
+# Where the content of a soft-deleted file lives: its stored object (objects
+# stay in place, since other uploads may share them), or the copy moved to
+# the deleted-files folder for files uploaded before content addressing
+def deleted_path_for(metadata):
+    if metadata.get('storage_key'):
+        return object_path(metadata['storage_key'])
+    return metadata.get('deleted_path')
+
+
+# Soft-delete a file: flag its row as deleted, moving legacy content out of the
+# upload folder first. Returns the path the deleted content can be read from.
+def soft_delete(metadata, filename, deleted_folder):
+    deleted_path = None
+    if not metadata.get('storage_key'):
+        deleted_path = os.path.join(deleted_folder, filename)
+        source = path_for(metadata, filename)
+        # A retried delete may find the file already moved
+        if os.path.exists(source) or not os.path.exists(deleted_path):
+            shutil.move(source, deleted_path)
+    user_db.soft_delete_file(metadata['id'], deleted_path)
+    return deleted_path or object_path(metadata['storage_key'])
+
+
+# Move a fully written temp file into the store; returns the storage key.
+# If the content is already stored, the temp file is simply discarded.
+def _commit_object(temp_path, sha256):
+    key = storage_key_for(sha256)
+    target = object_path(key)
+    if os.path.exists(target):
+        os.unlink(temp_path)
+        # Touch it so the reconciler's grace period covers the row about to be written
+        os.utime(target)
+        return key
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    os.replace(temp_path, target)
+    return key
+
+
+# Copy a readable stream into the store chunk by chunk.
+# Returns (sha256, size, storage_key); memory use is one chunk.
+def store_stream(stream, chunk_size=CHUNK_SIZE):
+    digest = hashlib.sha256()
+    size = 0
+    fd, temp_path = tempfile.mkstemp(dir=_partial_dir(), prefix='stream-')
+    try:
+        with os.fdopen(fd, 'wb') as out:
+            while True:
+                chunk = stream.read(chunk_size)
+                if not chunk:
+                    break
+                digest.update(chunk)
+                out.write(chunk)
+                size += len(chunk)
+        sha256 = digest.hexdigest()
+        return sha256, size, _commit_object(temp_path, sha256)
+    except BaseException:
+        if os.path.exists(temp_path):
+            os.unlink(temp_path)
+        raise
+
+
+# Temp file in the partial folder that the multipart form parser writes an
+# uploaded file straight into (see UploadRequest in app.py), hashing it as it
+# arrives, so save_upload() only has to move it into the store. Removed on
+# close unless it was stored.
+class HashingSpool:
+    def __init__(self):
+        fd, self.path = tempfile.mkstemp(dir=_partial_dir(), prefix='form-')
+        self._file = os.fdopen(fd, 'w+b')
+        self._digest = hashlib.sha256()
+        self.size = 0
+        self.stored = False
+
+    def write(self, data):
+        self._digest.update(data)
+        self.size += len(data)
+        return self._file.write(data)
+
+    def sha256(self):
+        return self._digest.hexdigest()
+
+    # Reading, seeking and the rest go to the temp file
+    def __getattr__(self, name):
+        return getattr(self._file, name)
+
+    def close(self):
+        self._file.close()
+        if not self.stored and os.path.exists(self.path):
+            os.unlink(self.path)
+
+
+# Store an uploaded stream and record its metadata; returns the metadata dict
+def save_upload(stream, filename, uploader):
+    if isinstance(stream, HashingSpool):
+        # Already on disk and hashed by the form parser
+        stream.flush()
+        sha256, size = stream.sha256(), stream.size
+        key = _commit_object(stream.path, sha256)
+        stream.stored = True
+    else:
+        sha256, size, key = store_stream(stream)
+    file_id = user_db.save_file_metadata(filename, uploader, sha256, size, key)
+    return {'id': file_id, 'filename': filename, 'uploader': uploader,
+            'sha256': sha256, 'size': size, 'storage_key': key}
+
+
+# --- Resumable chunked uploads -------------------------------------------
+
+class UploadError(Exception):
+    pass
+
+
+def _session_path(upload_id):
+    return os.path.join(_partial_dir(), f'session-{upload_id}')
+
+
+# Start a chunked upload of total_size bytes; returns the upload id
+def begin_upload(filename, uploader, total_size):
+    upload_id = uuid.uuid4().hex
+    open(_session_path(upload_id), 'wb').close()
+    user_db.create_upload_session(upload_id, filename, uploader, total_size)
+    return upload_id
+
+
+# Append the chunk starting at `offset` read from stream. The offset must be
+# where the previous chunk ended, so a client resumes by asking for the current
+# size and sending from there. Returns the number of bytes received so far.
+def append_chunk(upload_id, offset, stream, chunk_size=CHUNK_SIZE):
+    session = user_db.get_upload_session(upload_id)
+    if session is None:
+        raise UploadError("Unknown upload")
+    path = _session_path(upload_id)
+    received = os.path.getsize(path)
+    if offset != received:
+        raise UploadError(f"Expected offset {received}, got {offset}")
+
+    with open(path, 'ab') as out:
+        while True:
+            chunk = stream.read(chunk_size)
+            if not chunk:
+                break
+            if received + len(chunk) > session['total_size']:
+                raise UploadError("Upload is larger than announced")
+            out.write(chunk)
+            received += len(chunk)
+
+    user_db.update_upload_session(upload_id, received)
+    return received
+
+
+# Finish a chunked upload: hash it, move it into the store and record metadata
+def complete_upload(upload_id, chunk_size=CHUNK_SIZE):
+    session = user_db.get_upload_session(upload_id)
+    if session is None:
+        raise UploadError("Unknown upload")
+    path = _session_path(upload_id)
+    size = os.path.getsize(path)
+    if size != session['total_size']:
+        raise UploadError(f"Upload incomplete: {size} of {session['total_size']} bytes")
+
+    # The upload may have arrived through several workers, so the hash is
+    # computed here in one sequential pass rather than carried between chunks
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(chunk_size), b''):
+            digest.update(chunk)
+    sha256 = digest.hexdigest()
+    key = _commit_object(path, sha256)
+    file_id = user_db.save_file_metadata(session['filename'], session['uploader'], sha256, size, key)
+    user_db.delete_upload_session(upload_id)
+    return {'id': file_id, 'filename': session['filename'], 'uploader': session['uploader'],
+            'sha256': sha256, 'size': size, 'storage_key': key}
+
+
+# Bytes received so far for an upload (None if unknown)
+def upload_status(upload_id):
+    session = user_db.get_upload_session(upload_id)
+    if session is None:
+        return None
+    return {'id': upload_id, 'filename': session['filename'],
+            'total_size': session['total_size'], 'received': os.path.getsize(_session_path(upload_id))}
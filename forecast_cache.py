@@ -0,0 +1,213 @@
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+import forecast_updates
+
+# Read-through cache of per-city forecasts for /select_city.
+#
+# Entries are bounded by size (LRU) and age (TTL) and are invalidated by
+# update_weather_data, bulk ingest and forecast changes published on the
+# alert bus. Each entry also carries the city's forecast version (see
+# forecast_updates.py) read before it was loaded. At most once per
+# CHECK_INTERVAL a hit re-reads that version (one primary-key lookup) and
+# reloads the entry if it has moved on, so a change that reached this process
+# by no other route (another worker with a Redis bus, the ingest CLI) is
+# served at most CHECK_INTERVAL late. By default the cache lives in this
+# process; set WEATHER_FORECAST_CACHE_PATH to share one on-disk store between
+# all workers on the host, so a city loaded by one worker is a hit in the
+# others.
+
+MAX_ENTRIES = int(os.environ.get('WEATHER_FORECAST_CACHE_SIZE', '1024'))
+TTL_SECONDS = float(os.environ.get('WEATHER_FORECAST_CACHE_TTL', '300'))
+SHARED_PATH = os.environ.get('WEATHER_FORECAST_CACHE_PATH')
+# Seconds a hit is served without re-checking the city's version (0: every hit)
+CHECK_INTERVAL = float(os.environ.get('WEATHER_FORECAST_CACHE_CHECK_INTERVAL', '1'))
+
+
+# In-process LRU with per-entry expiry
+class MemoryBackend:
+    def __init__(self, max_entries=MAX_ENTRIES):
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+
+    # Return (found, value, evicted) for key
+    def get(self, key, now):
+        entry = self._entries.get(key)
+        if entry is None:
+            return False, None, 0
+        expires_at, value = entry
+        if expires_at <= now:
+            del self._entries[key]
+            return False, None, 1
+        self._entries.move_to_end(key)
+        return True, value, 0
+
+    # Store value and return how many entries were evicted to make room
+    def set(self, key, value, expires_at):
+        self._entries[key] = (expires_at, value)
+        self._entries.move_to_end(key)
+        evicted = 0
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            evicted += 1
+        return evicted
+
+    def delete(self, key):
+        self._entries.pop(key, None)
+
+    def clear(self):
+        self._entries.clear()
+
+    def __len__(self):
+        return len(self._entries)
+
+
+# Host-wide store shared by every worker, kept in its own SQLite file so it
+# never contends with weather_net.db. Eviction is by least recent write.
+class SharedBackend:
+    def __init__(self, path, max_entries=MAX_ENTRIES):
+        self.path = path
+        self.max_entries = max_entries
+        self._local = threading.local()
+        conn = self._conn()
+        conn.execute('''CREATE TABLE IF NOT EXISTS forecast_cache (
+                            key TEXT PRIMARY KEY,
+                            value TEXT NOT NULL,
+                            expires_at REAL NOT NULL,
+                            written_at REAL NOT NULL
+                          )''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_forecast_cache_written ON forecast_cache (written_at)')
+        conn.commit()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=5, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=OFF')
+            self._local.conn = conn
+        return conn
+
+    def get(self, key, now):
+        row = self._conn().execute('SELECT value, expires_at FROM forecast_cache WHERE key = ?',
+                                   (key,)).fetchone()
+        if row is None:
+            return False, None, 0
+        stored = json.loads(row[0])
+        if row[1] <= now or not isinstance(stored, dict):
+            # Expired, or written by a version without forecast versions
+            self.delete(key)
+            return False, None, 1
+        return True, (stored['version'], [tuple(r) for r in stored['rows']]), 0
+
+    # value is (version, rows)
+    def set(self, key, value, expires_at):
+        version, rows = value
+        conn = self._conn()
+        with conn:
+            conn.execute('INSERT OR REPLACE INTO forecast_cache VALUES (?, ?, ?, ?)',
+                         (key, json.dumps({'version': version, 'rows': rows}), expires_at, time.time()))
+            excess = conn.execute('SELECT COUNT(*) FROM forecast_cache').fetchone()[0] - self.max_entries
+            if excess > 0:
+                conn.execute('''DELETE FROM forecast_cache WHERE key IN (
+                                    SELECT key FROM forecast_cache ORDER BY written_at LIMIT ?)''',
+                             (excess,))
+        return max(excess, 0)
+
+    def delete(self, key):
+        conn = self._conn()
+        with conn:
+            conn.execute('DELETE FROM forecast_cache WHERE key = ?', (key,))
+
+    def clear(self):
+        conn = self._conn()
+        with conn:
+            conn.execute('DELETE FROM forecast_cache')
+
+    def __len__(self):
+        return self._conn().execute('SELECT COUNT(*) FROM forecast_cache').fetchone()[0]
+
+
+# version(city) returns the city's current forecast version; entries loaded at
+# an older one are reloaded
+class ForecastCache:
+    def __init__(self, backend=None, ttl=TTL_SECONDS, version=forecast_updates.version,
+                 check_interval=CHECK_INTERVAL):
+        self.backend = backend if backend is not None else MemoryBackend()
+        self.ttl = ttl
+        self.version = version
+        self.check_interval = check_interval
+        # city -> when this process last found its entry current
+        self._checked_at = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+        self.stale = 0
+        self._generation = 0
+        self._lock = threading.Lock()
+
+    # Return the cached forecast for city, calling loader(city) on a miss
+    def get(self, city, loader):
+        now = time.monotonic() if isinstance(self.backend, MemoryBackend) else time.time()
+        checked = time.monotonic()
+        with self._lock:
+            found, entry, expired = self.backend.get(city, now)
+            self.evictions += expired
+            if found and checked - self._checked_at.get(city, float('-inf')) < self.check_interval:
+                self.hits += 1
+                return entry[1]
+            generation = self._generation
+
+        # Read before loading, so a change that lands in between makes the
+        # entry stale rather than hiding it
+        current = self.version(city)
+        with self._lock:
+            if found and entry[0] == current:
+                self._checked_at[city] = checked
+                self.hits += 1
+                return entry[1]
+            if found:
+                self.stale += 1
+            self.misses += 1
+
+        value = loader(city)
+        with self._lock:
+            # Don't cache a result that an invalidation raced with
+            if generation == self._generation:
+                self.evictions += self.backend.set(city, (current, value), now + self.ttl)
+                self._checked_at[city] = checked
+        return value
+
+    # Drop the given cities (e.g. after an update or ingest)
+    def invalidate(self, *cities):
+        with self._lock:
+            self._generation += 1
+            for city in cities:
+                self.backend.delete(city)
+                self._checked_at.pop(city, None)
+                self.invalidations += 1
+
+    def clear(self):
+        with self._lock:
+            self._generation += 1
+            self.backend.clear()
+            self._checked_at.clear()
+
+    def stats(self):
+        with self._lock:
+            return {
+                'entries': len(self.backend),
+                'hits': self.hits,
+                'misses': self.misses,
+                'evictions': self.evictions,
+                'invalidations': self.invalidations,
+                'stale': self.stale,
+            }
+
+
+# Process-wide cache used by app.py and ingest.py
+forecast_cache = ForecastCache(SharedBackend(SHARED_PATH) if SHARED_PATH else None)
@@ -0,0 +1,133 @@
+import os
+import time
+import alert_bus
+import db
+
+# Live forecast updates for clients viewing a city.
+#
+# Each city has a version that goes up by one with every change to its
+# forecast. update_weather records the changed row under the new version in
+# the same transaction, and the change is then pushed as a compact delta to
+# the city's Socket.IO room only. A client joining the room (or reconnecting)
+# sends the version it already has and gets just the changes since then, or a
+# full snapshot when it has none, is too far behind, or the log has a gap.
+# Bulk ingest bumps versions without logging rows, so clients catching up
+# across an ingest always resync from a snapshot; live viewers get a reset
+# event telling them to do so.
+#
+# Messages (rows are [date, temperature, condition]; a delta row replaces the
+# row for its date):
+#   forecast_delta     {'city', 'version', 'rows'}
+#   forecast_snapshot  {'city', 'version', 'days'}
+#   forecast_reset     {'city'}
+#
+# Clients apply a message only if its version is newer than the one they
+# have, hold deltas that arrive before the reply to their subscribe and apply
+# the newer ones after it, and resubscribe with their version when a delta
+# skips one or a reset arrives.
+
+FORECAST_CHANNEL = 'forecast'
+# How long changed rows stay in the log for catch-up
+RETENTION_SECONDS = float(os.environ.get('WEATHER_FORECAST_CHANGES_RETENTION', '86400'))
+# Clients further behind than this get a snapshot instead
+MAX_CATCH_UP = 500
+PRUNE_INTERVAL = 60.0
+
+_pruned_at = 0.0
+
+
+# Socket.IO room of a city's viewers
+def room(city):
+    return 'forecast:' + city
+
+
+# Record a changed forecast row inside the caller's transaction and return
+# the delta to publish once it commits
+def record(city, date, temperature, condition, conn=None):
+    global _pruned_at
+    conn = conn or db.get_connection()
+    now = time.time()
+    version = conn.execute('''
+        INSERT INTO forecast_versions (city, version) VALUES (?, 1)
+        ON CONFLICT (city) DO UPDATE SET version = version + 1
+        RETURNING version
+    ''', (city,)).fetchone()[0]
+    # The row as stored, after column affinity (form values arrive as strings)
+    row = conn.execute('''
+        INSERT INTO forecast_changes (city, version, date, temperature, condition, changed_at)
+        VALUES (?, ?, ?, ?, ?, ?)
+        RETURNING date, temperature, condition
+    ''', (city, version, date, temperature, condition, now)).fetchone()
+    if now - _pruned_at >= PRUNE_INTERVAL:
+        _pruned_at = now
+        conn.execute('DELETE FROM forecast_changes WHERE changed_at < ?', (now - RETENTION_SECONDS,))
+    return {'city': city, 'version': version, 'rows': [list(row)]}
+
+
+# Bump the version of cities rewritten in bulk, inside the caller's transaction
+def bump(cities, conn=None):
+    conn = conn or db.get_connection()
+    conn.executemany('''
+        INSERT INTO forecast_versions (city, version) VALUES (?, 1)
+        ON CONFLICT (city) DO UPDATE SET version = version + 1
+    ''', [(city,) for city in cities])
+
+
+def version(city):
+    row = db.get_connection().execute('SELECT version FROM forecast_versions WHERE city = ?', (city,)).fetchone()
+    return row[0] if row else 0
+
+
+# The city's forecast at (at least) its current version. The version is read
+# first, so a change committed in between is in the rows and is sent again as
+# a delta, which replaces the row with itself.
+def snapshot(city):
+    current = version(city)
+    days = db.get_connection().execute('''
+        SELECT date, temperature, condition FROM weather_data WHERE city = ? ORDER BY date
+    ''', (city,)).fetchall()
+    return {'city': city, 'version': current, 'days': [list(day) for day in days]}
+
+
+# What a client at version `since` needs: ('forecast_delta', delta) with the
+# latest row for each date changed since then, or ('forecast_snapshot', snapshot)
+def catch_up(city, since=None):
+    current = version(city)
+    try:
+        since = int(since)
+    except (TypeError, ValueError):
+        since = None
+    if since is None or since > current or current - since > MAX_CATCH_UP:
+        return 'forecast_snapshot', snapshot(city)
+    changes = db.get_connection().execute('''
+        SELECT version, date, temperature, condition FROM forecast_changes
+        WHERE city = ? AND version > ? AND version <= ?
+        ORDER BY version
+    ''', (city, since, current)).fetchall()
+    if len(changes) != current - since:
+        # Pruned, or skipped by a bulk ingest
+        return 'forecast_snapshot', snapshot(city)
+    rows = {}
+    for _, date, temperature, condition in changes:
+        rows[date] = [date, temperature, condition]
+    return 'forecast_delta', {'city': city, 'version': current, 'rows': [rows[date] for date in sorted(rows)]}
+
+
+# Send a published event to the viewers' rooms with send(event, data, to=room)
+def emit(event, send):
+    if 'cities' in event:
+        for city in event['cities']:
+            send('forecast_reset', {'city': city}, to=room(city))
+    else:
+        send('forecast_delta', event, to=room(event['city']))
+
+
+# Publish a delta from record(), or {'cities': [...]} after a bulk ingest, to
+# every web worker. When Socket.IO fans out through the bus's Redis instance
+# it is emitted straight to the rooms instead, with `send` if given.
+def publish(event, bus=None, send=None):
+    bus = bus or alert_bus.get_bus()
+    if bus.socketio_message_queue:
+        emit(event, send or alert_bus.external_socketio(bus).emit)
+    else:
+        bus.publish(FORECAST_CHANNEL, event)
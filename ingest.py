@@ -0,0 +1,206 @@
+import argparse
+import csv
+import datetime
+import itertools
+import json
+import logging
+import sys
+import time
+import city_index
+import db
+from forecast_cache import forecast_cache
+import forecast_updates
+import migrations
+import timeseries
+
+logger = logging.getLogger(__name__)
+
+# Streaming bulk ingestion of forecast rows (city, date, temperature, condition).
+#
+# Rows are upserted with executemany in batched transactions, so a feed of
+# millions of rows costs one statement execution per row and one commit per
+# batch instead of a SELECT COUNT(*) round trip plus an INSERT per row.
+# Every row is checked first; rows that don't fit the table are skipped and
+# reported with where they came from instead of failing their whole batch.
+
+DEFAULT_BATCH_SIZE = 5000
+# Rejected rows kept for the report (all of them are counted)
+MAX_REPORTED_REJECTS = 1000
+
+UPSERT_SQL = '''
+    INSERT INTO weather_data (city, date, temperature, condition)
+    VALUES (?, ?, ?, ?)
+    ON CONFLICT (city, date, condition) DO UPDATE SET temperature = excluded.temperature
+'''
+
+FIELDS = ('city', 'date', 'temperature', 'condition')
+
+
+# Split an iterable into lists of at most `size` items
+def _batches(rows, size):
+    it = iter(rows)
+    while True:
+        batch = list(itertools.islice(it, size))
+        if not batch:
+            return
+        yield batch
+
+
+# Check a (city, date, temperature, condition) row and return it as stored:
+# non-empty city and condition, a YYYY-MM-DD date and a whole-number
+# temperature. Raises ValueError saying what is wrong.
+def clean_row(row):
+    if not isinstance(row, (tuple, list)) or len(row) != len(FIELDS):
+        raise ValueError("not a city, date, temperature, condition record")
+    city, date, temperature, condition = row
+    for field, value in (('city', city), ('condition', condition)):
+        if not isinstance(value, str) or not value.strip():
+            raise ValueError(f"missing {field}")
+    try:
+        valid_date = isinstance(date, str) and datetime.date.fromisoformat(date).isoformat() == date
+    except ValueError:
+        valid_date = False
+    if not valid_date:
+        raise ValueError(f"date {date!r} is not YYYY-MM-DD")
+    if isinstance(temperature, bool) or not isinstance(temperature, (int, str)):
+        raise ValueError(f"temperature {temperature!r} is not a whole number")
+    try:
+        temperature = int(temperature)
+    except ValueError:
+        raise ValueError(f"temperature {temperature!r} is not a whole number") from None
+    return city, date, temperature, condition
+
+
+# Yield the rows of (location, row) pairs that pass clean_row(), adding the
+# others to stats['rejected'] as (location, reason)
+def _valid_rows(records, stats):
+    for location, row in records:
+        try:
+            yield clean_row(row)
+        except ValueError as e:
+            stats['rejected_count'] += 1
+            if len(stats['rejected']) < MAX_REPORTED_REJECTS:
+                stats['rejected'].append((location, str(e)))
+            logger.debug("Rejected row", extra={'location': location, 'reason': str(e)})
+
+
+# Upsert an iterable of (city, date, temperature, condition) rows; see
+# ingest_records()
+def ingest_rows(rows, batch_size=DEFAULT_BATCH_SIZE):
+    return ingest_records(((f'row {number}', row) for number, row in enumerate(rows, 1)), batch_size)
+
+
+# Upsert (location, row) pairs, where location says where the row came from
+# (e.g. 'feed.csv:12'). Viewers of the touched cities are told to reload
+# their forecast after each batch. Returns a dict with the row count, elapsed
+# seconds, rows per second, the set of cities that were touched and the
+# rejected rows (rejected_count, and up to MAX_REPORTED_REJECTS
+# (location, reason) pairs in rejected).
+def ingest_records(records, batch_size=DEFAULT_BATCH_SIZE):
+    conn = db.get_connection()
+    count = 0
+    cities = set()
+    stats = {'rejected': [], 'rejected_count': 0}
+    start = time.perf_counter()
+
+    for batch in _batches(_valid_rows(records, stats), batch_size):
+        try:
+            conn.executemany(UPSERT_SQL, batch)
+            timeseries.mark_dirty_rows(batch, commit=False)
+            batch_cities = {row[0] for row in batch}
+            city_index.register_cities(batch_cities, commit=False)
+            forecast_updates.bump(batch_cities, conn)
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        count += len(batch)
+        forecast_cache.invalidate(*batch_cities)
+        cities.update(batch_cities)
+        try:
+            forecast_updates.publish({'cities': sorted(batch_cities)})
+        except Exception as e:
+            # Viewers still catch up from a snapshot when they next subscribe
+            logger.warning("Could not publish forecast reset: %s", e)
+
+    # New cities become searchable in this process right away (others pick them up on their next refresh)
+    if city_index.city_index.loaded:
+        city_index.city_index.refresh()
+
+    elapsed = time.perf_counter() - start
+    if stats['rejected_count']:
+        logger.warning("Skipped %d invalid rows", stats['rejected_count'])
+    return dict(stats, **{
+        'rows': count,
+        'seconds': elapsed,
+        'rows_per_second': count / elapsed if elapsed else 0.0,
+        'cities': cities,
+    })
+
+
+# Stream (path:line, row) pairs out of a CSV file with a
+# city,date,temperature,condition header. Values are checked by clean_row().
+def read_csv(path):
+    with open(path, newline='', encoding='utf-8') as f:
+        reader = csv.DictReader(f)
+        for record in reader:
+            yield f'{path}:{reader.line_num}', tuple(record.get(field) for field in FIELDS)
+
+
+# Stream (path:line, row) pairs out of a newline-delimited JSON file, one
+# object per line
+def read_ndjson(path):
+    with open(path, encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            line = line.strip()
+            if not line:
+                continue
+            try:
+                record = json.loads(line)
+            except ValueError:
+                record = None
+            # Anything but an object is rejected by clean_row()
+            row = tuple(record.get(field) for field in FIELDS) if isinstance(record, dict) else None
+            yield f'{path}:{number}', row
+
+
+# Pick a reader from the file extension
+def read_file(path):
+    if path.endswith(('.ndjson', '.jsonl')):
+        return read_ndjson(path)
+    return read_csv(path)
+
+
+# Ingest one or more CSV/NDJSON files
+def ingest_files(paths, batch_size=DEFAULT_BATCH_SIZE):
+    records = itertools.chain.from_iterable(read_file(path) for path in paths)
+    return ingest_records(records, batch_size=batch_size)
+
+
+# python ingest.py forecasts.csv more.ndjson --batch-size 10000
+# Exits with status 1 if any rows were rejected (the valid ones are loaded).
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Bulk-load forecast rows into weather_data')
+    parser.add_argument('files', nargs='+', help='CSV (city,date,temperature,condition) or NDJSON files')
+    parser.add_argument('--batch-size', type=int, default=DEFAULT_BATCH_SIZE)
+    args = parser.parse_args(argv)
+
+    migrations.migrate()
+
+    stats = ingest_files(args.files, batch_size=args.batch_size)
+    print(f"Ingested {stats['rows']} rows for {len(stats['cities'])} cities "
+          f"in {stats['seconds']:.2f}s ({stats['rows_per_second']:.0f} rows/s)")
+    for location, reason in stats['rejected']:
+        print(f"Rejected {location}: {reason}", file=sys.stderr)
+    if stats['rejected_count'] > len(stats['rejected']):
+        print(f"... and {stats['rejected_count'] - len(stats['rejected'])} more rejected rows", file=sys.stderr)
+
+    # Build the rollups now rather than on the first read after a bulk load
+    started = time.perf_counter()
+    refreshed = timeseries.refresh()
+    print(f"Refreshed rollups for {refreshed} cities in {time.perf_counter() - started:.2f}s")
+    return 1 if stats['rejected_count'] else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
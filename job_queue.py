@@ -0,0 +1,224 @@
+import collections
+import json
+import logging
+import os
+import random
+import threading
+import time
+import db
+import offload
+
+logger = logging.getLogger(__name__)
+
+# Durable background jobs stored in the jobs table, run by an in-process pool
+# of workers.
+#
+# Request handlers enqueue slow side effects and return immediately. A worker
+# claims a job by pushing its available_at forward by the visibility timeout,
+# so if the worker dies the job becomes claimable again once that passes.
+# Failed jobs are retried with exponential backoff and jitter until
+# max_attempts, after which they stay in the table as 'failed'.
+#
+# A handler runs on the worker's pooled connection. Writes it makes without
+# committing are committed together with the job's acknowledgement, so a
+# handler that only touches the database takes effect exactly once; anything
+# else it does (files, broadcasts) may be repeated by a retry.
+
+WORKERS = int(os.environ.get('WEATHER_JOB_WORKERS', '4'))
+VISIBILITY_TIMEOUT = float(os.environ.get('WEATHER_JOB_VISIBILITY_TIMEOUT', '60'))
+MAX_ATTEMPTS = int(os.environ.get('WEATHER_JOB_MAX_ATTEMPTS', '5'))
+BACKOFF_BASE = 1.0
+MAX_BACKOFF = 300.0
+POLL_INTERVAL = 1.0
+LATENCY_SAMPLES = 1000
+
+
+def _start_thread(target):
+    thread = threading.Thread(target=target, name='job-worker', daemon=True)
+    thread.start()
+    return thread
+
+
+def _percentile(values, pct):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * pct / 100))] if values else None
+
+
+class JobQueue:
+    # start_task runs each worker loop (socketio.start_background_task under
+    # eventlet/gevent; a thread otherwise). Workers start on the first
+    # enqueue, or explicitly with start().
+    def __init__(self, workers=WORKERS, visibility_timeout=VISIBILITY_TIMEOUT,
+                 max_attempts=MAX_ATTEMPTS, poll_interval=POLL_INTERVAL, start_task=_start_thread):
+        self.workers = workers
+        self.visibility_timeout = visibility_timeout
+        self.max_attempts = max_attempts
+        self.poll_interval = poll_interval
+        self.start_task = start_task
+        self.handlers = {}
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+        self._started = False
+        self.completed = 0
+        self.retried = 0
+        self.failed = 0
+        # Enqueue-to-finish and run times of recent jobs, in seconds
+        self._latencies = collections.deque(maxlen=LATENCY_SAMPLES)
+        self._run_times = collections.deque(maxlen=LATENCY_SAMPLES)
+
+    # Decorator registering the handler for a kind of job: handler(payload)
+    def handler(self, kind):
+        def register(function):
+            self.handlers[kind] = function
+            return function
+        return register
+
+    # Add a job; returns its id. With commit=False the insert joins the
+    # caller's transaction, so the job exists only if that transaction commits.
+    def enqueue(self, kind, payload, delay=0, max_attempts=None, commit=True):
+        now = time.time()
+        conn = db.get_connection()
+        cursor = conn.execute('''
+            INSERT INTO jobs (kind, payload, max_attempts, available_at, created_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (kind, json.dumps(payload), max_attempts or self.max_attempts, now + delay, now))
+        if commit:
+            conn.commit()
+        self.start()
+        self._wakeup.set()
+        return cursor.lastrowid
+
+    # Start the worker pool (once)
+    def start(self):
+        with self._lock:
+            if self._started:
+                return
+            self._started = True
+        for _ in range(self.workers):
+            self.start_task(self._run)
+
+    # Claim the next due job, or return None. An idle poll is one indexed read;
+    # the write lock is only taken when a job is due.
+    def _claim(self):
+        now = time.time()
+        conn = db.get_connection()
+        due = conn.execute('''
+            SELECT 1 FROM jobs WHERE status = 'pending' AND available_at <= ? LIMIT 1
+        ''', (now,)).fetchone()
+        if due is None:
+            return None
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            row = conn.execute('''
+                SELECT id, kind, payload, attempts, max_attempts, created_at
+                FROM jobs
+                WHERE status = 'pending' AND available_at <= ?
+                ORDER BY available_at
+                LIMIT 1
+            ''', (now,)).fetchone()
+            if row is not None:
+                conn.execute('UPDATE jobs SET attempts = attempts + 1, available_at = ? WHERE id = ?',
+                             (now + self.visibility_timeout, row[0]))
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+        if row is None:
+            return None
+        job_id, kind, payload, attempts, max_attempts, created_at = row
+        return {'id': job_id, 'kind': kind, 'payload': json.loads(payload),
+                'attempt': attempts + 1, 'max_attempts': max_attempts, 'created_at': created_at}
+
+    # Delay before retrying after the given attempt number
+    def backoff(self, attempt):
+        delay = min(MAX_BACKOFF, BACKOFF_BASE * 2 ** (attempt - 1))
+        return delay * random.uniform(0.5, 1.0)
+
+    def _succeed(self, job):
+        conn = db.get_connection()
+        # If the job was reclaimed after its visibility timeout, the other
+        # worker owns it now; undo this attempt's writes
+        deleted = conn.execute('DELETE FROM jobs WHERE id = ? AND attempts = ?',
+                               (job['id'], job['attempt'])).rowcount
+        if deleted:
+            conn.commit()
+        else:
+            conn.rollback()
+        return deleted
+
+    def _fail(self, job, error):
+        conn = db.get_connection()
+        conn.rollback()
+        if job['attempt'] >= job['max_attempts']:
+            conn.execute("UPDATE jobs SET status = 'failed', last_error = ? WHERE id = ? AND attempts = ?",
+                         (error, job['id'], job['attempt']))
+            conn.commit()
+            with self._lock:
+                self.failed += 1
+            logger.error("Job failed permanently: %s", error,
+                         extra={'job_id': job['id'], 'kind': job['kind'], 'attempt': job['attempt']})
+            return
+        conn.execute('UPDATE jobs SET available_at = ?, last_error = ? WHERE id = ? AND attempts = ?',
+                     (time.time() + self.backoff(job['attempt']), error, job['id'], job['attempt']))
+        conn.commit()
+        with self._lock:
+            self.retried += 1
+        logger.warning("Job attempt failed, will retry: %s", error,
+                       extra={'job_id': job['id'], 'kind': job['kind'], 'attempt': job['attempt']})
+
+    # Claim and run one job; returns False if none was due. The claim (which
+    # may wait for the write lock) runs off the event loop; the handler and
+    # its acknowledgement run on this worker's connection.
+    def run_once(self):
+        job = offload.call(self._claim)
+        if job is None:
+            return False
+        start = time.time()
+        try:
+            handler = self.handlers.get(job['kind'])
+            if handler is None:
+                raise LookupError(f"No handler for job kind '{job['kind']}'")
+            handler(job['payload'])
+        except Exception as e:
+            self._fail(job, f"{type(e).__name__}: {e}")
+            return True
+        if self._succeed(job):
+            finished = time.time()
+            with self._lock:
+                self.completed += 1
+                self._run_times.append(finished - start)
+                self._latencies.append(finished - job['created_at'])
+        return True
+
+    def _run(self):
+        while True:
+            try:
+                if self.run_once():
+                    continue
+            except Exception as e:
+                logger.exception("Error running background job")
+            # Nothing due: wait for a local enqueue, or poll for jobs from other processes
+            self._wakeup.wait(self.poll_interval)
+            self._wakeup.clear()
+
+    # Queue depth by state, counters and latency percentiles (seconds)
+    def stats(self):
+        conn = db.get_connection()
+        depth = dict(conn.execute('SELECT status, count(*) FROM jobs GROUP BY status').fetchall())
+        ready = conn.execute("SELECT count(*) FROM jobs WHERE status = 'pending' AND available_at <= ?",
+                             (time.time(),)).fetchone()[0]
+        with self._lock:
+            latencies = list(self._latencies)
+            run_times = list(self._run_times)
+            return {
+                'pending': depth.get('pending', 0),
+                'ready': ready,
+                'failed_jobs': depth.get('failed', 0),
+                'completed': self.completed,
+                'retried': self.retried,
+                'failed': self.failed,
+                'latency_p50': _percentile(latencies, 50),
+                'latency_p99': _percentile(latencies, 99),
+                'run_time_p50': _percentile(run_times, 50),
+                'run_time_p99': _percentile(run_times, 99),
+            }
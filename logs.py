@@ -0,0 +1,61 @@
+import json
+import logging
+import os
+import sys
+import time
+
+# Logging setup shared by the web app and the alert server.
+#
+# Modules log through logging.getLogger(__name__) with extra={...} fields.
+# WEATHER_LOG_LEVEL sets the level (default INFO; per-event messages on the
+# request and broadcast paths are DEBUG, so they cost one level check unless
+# enabled) and WEATHER_LOG_FORMAT picks 'json' (one object per line) or 'text'.
+
+LEVEL = os.environ.get('WEATHER_LOG_LEVEL', 'INFO').upper()
+FORMAT = os.environ.get('WEATHER_LOG_FORMAT', 'text')
+
+# Attributes every LogRecord has; anything else came from extra=
+_STANDARD_ATTRIBUTES = set(vars(logging.LogRecord('', 0, '', 0, '', (), None))) | {'message', 'asctime'}
+
+
+def _fields(record):
+    return {key: value for key, value in vars(record).items() if key not in _STANDARD_ATTRIBUTES}
+
+
+class JsonFormatter(logging.Formatter):
+    def format(self, record):
+        entry = {
+            'ts': round(record.created, 3),
+            'level': record.levelname.lower(),
+            'logger': record.name,
+            'msg': record.getMessage(),
+        }
+        entry.update(_fields(record))
+        if record.exc_info:
+            entry['exc'] = self.formatException(record.exc_info)
+        return json.dumps(entry, default=str)
+
+
+class TextFormatter(logging.Formatter):
+    def __init__(self):
+        super().__init__('%(asctime)s %(levelname)s %(name)s: %(message)s')
+        self.converter = time.gmtime
+
+    def format(self, record):
+        line = super().format(record)
+        fields = _fields(record)
+        if fields:
+            line += ' ' + ' '.join(f'{key}={value}' for key, value in fields.items())
+        return line
+
+
+# Configure the root logger once (later calls leave an existing setup alone)
+def configure(level=LEVEL, format=FORMAT, stream=None):
+    root = logging.getLogger()
+    if getattr(root, '_weather_configured', False):
+        return
+    handler = logging.StreamHandler(stream or sys.stderr)
+    handler.setFormatter(JsonFormatter() if format == 'json' else TextFormatter())
+    root.addHandler(handler)
+    root.setLevel(level)
+    root._weather_configured = True
@@ -0,0 +1,206 @@
+import bisect
+import functools
+import os
+import re
+import time
+import offload
+
+# In-process metrics in the Prometheus text format, served by /metrics.
+#
+# Counters and histograms are keyed by label values and guarded by one lock
+# each; recording is a dict lookup and a few additions. Set WEATHER_METRICS=0
+# to turn recording off (the HTTP hooks, query timing and emit timing all
+# check ENABLED first). Each process has its own registry, so under several
+# workers scrape each one, or sum them in Prometheus.
+
+ENABLED = os.environ.get('WEATHER_METRICS', '1') != '0'
+# Also count rows that callers read by iterating over a cursor (see db.py)
+COUNT_ITERATED_ROWS = os.environ.get('WEATHER_METRICS_ITERATED_ROWS', '0') == '1'
+
+# Seconds; tuned for requests and queries that should take a few ms
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+SIZE_BUCKETS = (1, 2, 5, 10, 25, 50, 100, 250, 500, 1000)
+# Distinct label sets per metric; beyond this new ones are folded into 'other'
+MAX_SERIES = 1000
+
+
+def _escape(value):
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+def _format_number(value):
+    if value == float('inf'):
+        return '+Inf'
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+class Counter:
+    kind = 'counter'
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = tuple(labels)
+        self._values = {}
+        # Recorded from green threads and offloaded calls alike
+        self._lock = offload.native_lock()
+
+    def _key(self, values):
+        if values in self._values or len(self._values) < MAX_SERIES:
+            return values
+        return ('other',) * len(self.labels)
+
+    def inc(self, *values, amount=1):
+        with self._lock:
+            key = self._key(values)
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def value(self, *values):
+        return self._values.get(values, 0)
+
+    def samples(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return [f'{self.name}{_format_labels(self.labels, key)} {_format_number(value)}' for key, value in items]
+
+
+# A value set directly or read from a callback at scrape time, e.g. stats kept
+# elsewhere: collect() returns {label values tuple: value}. Totals read this
+# way are exposed with kind='counter'.
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def __init__(self, name, help, labels=(), collect=None, kind=None):
+        super().__init__(name, help, labels)
+        self.collect = collect
+        if kind:
+            self.kind = kind
+
+    def set(self, *values, value):
+        with self._lock:
+            self._values[self._key(values)] = value
+
+    def samples(self):
+        if self.collect is not None:
+            try:
+                collected = self.collect()
+            except Exception:
+                collected = {}
+            with self._lock:
+                self._values = dict(collected)
+        return super().samples()
+
+
+class Histogram(Counter):
+    kind = 'histogram'
+
+    def __init__(self, name, help, labels=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = tuple(buckets)
+
+    def observe(self, *values, value):
+        position = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            key = self._key(values)
+            entry = self._values.get(key)
+            if entry is None:
+                # Per-bucket (not cumulative) counts, then sum and count
+                entry = self._values[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][position] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def count(self, *values):
+        entry = self._values.get(values)
+        return entry[2] if entry else 0
+
+    def samples(self):
+        with self._lock:
+            items = sorted((key, ([*entry[0]], entry[1], entry[2])) for key, entry in self._values.items())
+        lines = []
+        for key, (counts, total, count) in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = f'le="{_format_number(float(bound))}"'
+                lines.append(f'{self.name}_bucket{_format_labels(self.labels, key, le)} {cumulative}')
+            lines.append(f'{self.name}_sum{_format_labels(self.labels, key)} {_format_number(total)}')
+            lines.append(f'{self.name}_count{_format_labels(self.labels, key)} {count}')
+        return lines
+
+    # Context manager observing the time spent in the block
+    def time(self, *values):
+        return _Timer(self, values)
+
+
+class _Timer:
+    def __init__(self, histogram, values):
+        self.histogram = histogram
+        self.values = values
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        if ENABLED:
+            self.histogram.observe(*self.values, value=time.perf_counter() - self.start)
+
+
+class Registry:
+    def __init__(self):
+        self.metrics = []
+
+    def register(self, metric):
+        self.metrics.append(metric)
+        return metric
+
+    # The whole registry in the Prometheus text exposition format
+    def render(self):
+        lines = []
+        for metric in self.metrics:
+            lines.append(f'# HELP {metric.name} {metric.help}')
+            lines.append(f'# TYPE {metric.name} {metric.kind}')
+            lines.extend(metric.samples())
+        return '\n'.join(lines) + '\n'
+
+
+registry = Registry()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+http_request_duration = registry.register(Histogram(
+    'weather_http_request_duration_seconds', 'Time to handle an HTTP request',
+    ('method', 'endpoint', 'status')))
+db_query_duration = registry.register(Histogram(
+    'weather_db_query_duration_seconds', 'Time to execute a SQL statement (SELECTs until their first row)',
+    ('statement',)))
+db_query_rows = registry.register(Counter(
+    'weather_db_query_rows_total', 'Rows changed or fetched by SQL statements', ('statement',)))
+socketio_emits = registry.register(Counter(
+    'weather_socketio_emits_total', 'Socket.IO events emitted', ('event',)))
+socketio_emit_duration = registry.register(Histogram(
+    'weather_socketio_emit_duration_seconds', 'Time spent in socketio.emit', ('event',)))
+broadcast_batch_size = registry.register(Histogram(
+    'weather_broadcast_batch_alerts', 'Alerts per coalesced broadcast batch', (), buckets=SIZE_BUCKETS))
+
+
+_LITERALS = re.compile(r"'(?:[^']|'')*'|\b\d+(?:\.\d+)?\b")
+_IN_LISTS = re.compile(r'\(\s*\?(?:\s*,\s*\?)+\s*\)')
+_WHITESPACE = re.compile(r'\s+')
+
+
+# Statement fingerprint: whitespace collapsed, literals and IN lists replaced
+# by placeholders, so the same query with different values is one series
+@functools.lru_cache(maxsize=1024)
+def fingerprint(sql):
+    sql = _WHITESPACE.sub(' ', sql).strip()
+    sql = _LITERALS.sub('?', sql)
+    return _IN_LISTS.sub('(?...)', sql)
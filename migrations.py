@@ -0,0 +1,447 @@
+import logging
+import sys
+import city_index
+import db
+import timeseries
+
+# Versioned schema migrations for weather_net.db.
+#
+# The schema version is kept in PRAGMA user_version. Each migration runs in its
+# own IMMEDIATE transaction, so several workers starting at once apply it only
+# once. Append new migrations to MIGRATIONS; never edit one that has shipped.
+
+logger = logging.getLogger(__name__)
+
+
+# 1: the original tables (previously created ad hoc by user_db and alerts_db)
+def _initial_schema(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS users (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        username TEXT NOT NULL UNIQUE,
+                        password TEXT NOT NULL
+                      )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS weather_data (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        city TEXT NOT NULL,
+                        date TEXT NOT NULL,
+                        temperature INTEGER NOT NULL,
+                        condition TEXT NOT NULL,
+                        UNIQUE(city, date, condition)
+                      )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS files (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        filename TEXT NOT NULL,
+                        uploader TEXT NOT NULL,
+                        upload_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+                      )''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS alerts (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        city TEXT NOT NULL,
+                        alert_description TEXT NOT NULL,
+                        username TEXT NOT NULL,
+                        timestamp DATETIME DEFAULT CURRENT_TIMESTAMP
+                      )''')
+
+
+# 2: store weather dates as a checked DATE column. SQLite has no native date
+# type, so the value stays canonical 'YYYY-MM-DD' (which sorts correctly and
+# compares equal to the strings the routes use) and the CHECK rejects anything
+# else. Rows whose date can't be parsed, or that collide with another row once
+# their date is normalized, are moved to weather_data_rejected for review.
+def _typed_weather_dates(conn):
+    conn.execute('''CREATE TABLE weather_data_new (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        city TEXT NOT NULL,
+                        date DATE NOT NULL CHECK (date = date(date)),
+                        temperature INTEGER NOT NULL,
+                        condition TEXT NOT NULL,
+                        UNIQUE(city, date, condition)
+                      )''')
+    conn.execute('''
+        INSERT OR IGNORE INTO weather_data_new (id, city, date, temperature, condition)
+        SELECT id, city, date(date), temperature, condition
+        FROM weather_data
+        WHERE date(date) IS NOT NULL
+    ''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS weather_data_rejected (
+                        id INTEGER PRIMARY KEY,
+                        city TEXT,
+                        date TEXT,
+                        temperature INTEGER,
+                        condition TEXT,
+                        reason TEXT NOT NULL
+                      )''')
+    conn.execute('''
+        INSERT INTO weather_data_rejected (id, city, date, temperature, condition, reason)
+        SELECT id, city, date, temperature, condition,
+               CASE WHEN date(date) IS NULL THEN 'unparseable date' ELSE 'duplicate after date normalization' END
+        FROM weather_data
+        WHERE id NOT IN (SELECT id FROM weather_data_new)
+    ''')
+    rejected = [row[0] for row in conn.execute('SELECT id FROM weather_data_rejected ORDER BY id')]
+    if rejected:
+        logger.warning("Moved %d weather_data rows with invalid dates to weather_data_rejected", len(rejected),
+                       extra={'row_ids': rejected})
+    conn.execute('DROP TABLE weather_data')
+    conn.execute('ALTER TABLE weather_data_new RENAME TO weather_data')
+
+
+# 3: indexes for the hot queries
+def _hot_query_indexes(conn):
+    # Covers search_weather_data entirely: no table lookups and no sort for ORDER BY date
+    conn.execute('''CREATE INDEX IF NOT EXISTS idx_weather_data_city_date
+                    ON weather_data (city, date, temperature, condition)''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_alerts_timestamp ON alerts (timestamp)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_files_filename ON files (filename)')
+
+
+# 4: indexes for the filtered, keyset-paginated alert listing
+def _alert_filter_indexes(conn):
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_alerts_city_timestamp ON alerts (city, timestamp)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_alerts_username_timestamp ON alerts (username, timestamp)')
+
+
+# 5: last alert id delivered to each alert server subscriber
+def _alert_cursors(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS alert_cursors (
+                        subscriber TEXT PRIMARY KEY,
+                        last_id INTEGER NOT NULL,
+                        updated_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                      ) WITHOUT ROWID''')
+
+
+# 6: event log behind the SQLite alert bus (see alert_bus.py)
+def _bus_events(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS bus_events (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        channel TEXT NOT NULL,
+                        payload TEXT NOT NULL,
+                        created_at REAL NOT NULL
+                      )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_bus_events_created_at ON bus_events (created_at)')
+
+
+# 7: content-addressed file storage and resumable upload sessions
+def _content_addressed_files(conn):
+    conn.execute('ALTER TABLE files ADD COLUMN sha256 TEXT')
+    conn.execute('ALTER TABLE files ADD COLUMN size INTEGER')
+    conn.execute('ALTER TABLE files ADD COLUMN storage_key TEXT')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_files_sha256 ON files (sha256)')
+    conn.execute('''CREATE TABLE IF NOT EXISTS upload_sessions (
+                        id TEXT PRIMARY KEY,
+                        filename TEXT NOT NULL,
+                        uploader TEXT NOT NULL,
+                        total_size INTEGER NOT NULL,
+                        received INTEGER NOT NULL DEFAULT 0,
+                        created_at DATETIME DEFAULT CURRENT_TIMESTAMP
+                      )''')
+
+
+# 8: soft-deleted files and the indexes behind the paginated file catalog.
+# Every index leads with `deleted`, so live and deleted listings never read
+# each other's rows; the rowid is implicitly the last column of each index and
+# serves as the keyset tie-breaker.
+def _file_catalog(conn):
+    conn.execute('ALTER TABLE files ADD COLUMN deleted INTEGER NOT NULL DEFAULT 0')
+    conn.execute('ALTER TABLE files ADD COLUMN deleted_at DATETIME')
+    conn.execute('ALTER TABLE files ADD COLUMN deleted_path TEXT')
+    conn.execute('DROP INDEX IF EXISTS idx_files_filename')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_files_deleted_time ON files (deleted, upload_time)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_files_deleted_name ON files (deleted, filename)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_files_deleted_uploader ON files (deleted, uploader, upload_time)')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_files_deleted_at ON files (deleted, deleted_at)')
+    conn.execute('''CREATE INDEX IF NOT EXISTS idx_files_deleted_path
+                    ON files (deleted_path) WHERE deleted_path IS NOT NULL''')
+
+
+# 9: durable background jobs (see job_queue.py). A job is 'pending' until it
+# succeeds (its row is deleted) or runs out of attempts ('failed');
+# available_at is when it may next be claimed, which also serves as the
+# visibility timeout of a claimed job.
+def _jobs(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS jobs (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        kind TEXT NOT NULL,
+                        payload TEXT NOT NULL,
+                        status TEXT NOT NULL DEFAULT 'pending',
+                        attempts INTEGER NOT NULL DEFAULT 0,
+                        max_attempts INTEGER NOT NULL,
+                        available_at REAL NOT NULL,
+                        created_at REAL NOT NULL,
+                        last_error TEXT
+                      )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_jobs_status_available ON jobs (status, available_at)')
+
+
+# 10: idempotency keys, so a retried or double-submitted alert is stored once
+def _alert_idempotency_keys(conn):
+    conn.execute('ALTER TABLE alerts ADD COLUMN idempotency_key TEXT')
+    conn.execute('''CREATE UNIQUE INDEX IF NOT EXISTS idx_alerts_idempotency_key
+                    ON alerts (idempotency_key) WHERE idempotency_key IS NOT NULL''')
+
+
+# 11: precomputed daily/weekly/monthly rollups of weather_data (see
+# timeseries.py). The primary key clusters rollups by period, then city and
+# date, so a date range for one city, or one period for every city in order,
+# is a contiguous b-tree range. Writes only record the
+# (city, date range) they touched in weather_rollup_dirty; rollups are brought
+# up to date from there before they are read.
+def _weather_rollups(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS weather_rollups (
+                        city TEXT NOT NULL,
+                        period TEXT NOT NULL,
+                        period_start DATE NOT NULL,
+                        count INTEGER NOT NULL,
+                        temp_min REAL NOT NULL,
+                        temp_max REAL NOT NULL,
+                        temp_sum REAL NOT NULL,
+                        conditions TEXT NOT NULL,
+                        PRIMARY KEY (period, city, period_start)
+                      ) WITHOUT ROWID''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS weather_rollup_dirty (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        city TEXT NOT NULL,
+                        start_date DATE NOT NULL,
+                        end_date DATE NOT NULL
+                      )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_weather_rollup_dirty_city ON weather_rollup_dirty (city)')
+    # Existing data is rolled up on first read
+    conn.execute('''INSERT INTO weather_rollup_dirty (city, start_date, end_date)
+                    SELECT city, min(date), max(date) FROM weather_data GROUP BY city''')
+
+
+# 12: registry of known cities with normalized names and aliases, behind the
+# /api/cities autocomplete (see city_index.py). `name` is the spelling used in
+# weather_data.city; `normalized` is lower-cased, accent- and punctuation-free.
+def _city_registry(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS cities (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        name TEXT NOT NULL UNIQUE,
+                        normalized TEXT NOT NULL,
+                        country TEXT,
+                        region TEXT
+                      )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_cities_normalized ON cities (normalized)')
+    conn.execute('''CREATE TABLE IF NOT EXISTS city_aliases (
+                        id INTEGER PRIMARY KEY AUTOINCREMENT,
+                        city_id INTEGER NOT NULL REFERENCES cities (id) ON DELETE CASCADE,
+                        alias TEXT NOT NULL,
+                        normalized TEXT NOT NULL,
+                        UNIQUE (city_id, normalized)
+                      )''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_city_aliases_normalized ON city_aliases (normalized)')
+    # Register the cities that already have forecasts
+    names = [row[0] for row in conn.execute('SELECT DISTINCT city FROM weather_data')]
+    conn.executemany('INSERT OR IGNORE INTO cities (name, normalized) VALUES (?, ?)',
+                     [(name, city_index.normalize(name)) for name in names])
+
+
+# 13: who is online, shared by every worker when WEATHER_PRESENCE_BACKEND is
+# 'sqlite' (see presence.py). A user row stays while the user has connections
+# or until last_seen is older than the presence TTL.
+def _presence(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS presence_users (
+                        username TEXT PRIMARY KEY,
+                        last_seen REAL NOT NULL
+                      ) WITHOUT ROWID''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_presence_users_last_seen ON presence_users (last_seen)')
+    conn.execute('''CREATE TABLE IF NOT EXISTS presence_connections (
+                        sid TEXT PRIMARY KEY,
+                        username TEXT NOT NULL
+                      ) WITHOUT ROWID''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_presence_connections_username ON presence_connections (username)')
+
+
+# 14: version counters for cached pages (see data_versions.py), one row per
+# kind of data, bumped in the same transaction as each change
+def _data_versions(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS data_versions (
+                        name TEXT PRIMARY KEY,
+                        version INTEGER NOT NULL DEFAULT 0
+                      ) WITHOUT ROWID''')
+    conn.executemany('INSERT OR IGNORE INTO data_versions (name) VALUES (?)',
+                     [('alerts',), ('files',), ('presence',)])
+
+
+# 15: per-city forecast versions and a log of changed rows for live forecast
+# updates (see forecast_updates.py)
+def _forecast_changes(conn):
+    conn.execute('''CREATE TABLE IF NOT EXISTS forecast_versions (
+                        city TEXT PRIMARY KEY,
+                        version INTEGER NOT NULL
+                      ) WITHOUT ROWID''')
+    conn.execute('''CREATE TABLE IF NOT EXISTS forecast_changes (
+                        city TEXT NOT NULL,
+                        version INTEGER NOT NULL,
+                        date DATE NOT NULL,
+                        temperature INTEGER NOT NULL,
+                        condition TEXT NOT NULL,
+                        changed_at REAL NOT NULL,
+                        PRIMARY KEY (city, version)
+                      ) WITHOUT ROWID''')
+    conn.execute('CREATE INDEX IF NOT EXISTS idx_forecast_changes_changed_at ON forecast_changes (changed_at)')
+
+
+# Forecasts for a few cities so a new installation has something to show
+SAMPLE_FORECASTS = {
+    'Montreal': [('2024-11-01', 5, 'Sunny'), ('2024-11-02', 6, 'Partly Cloudy'), ('2024-11-03', 4, 'Rainy'),
+                 ('2024-11-04', 3, 'Snowy'), ('2024-11-05', 7, 'Cloudy'), ('2024-11-06', 8, 'Windy'),
+                 ('2024-11-07', 5, 'Foggy')],
+    'Toronto': [('2024-11-01', 10, 'Sunny'), ('2024-11-02', 12, 'Partly Cloudy'), ('2024-11-03', 8, 'Rainy'),
+                ('2024-11-04', 9, 'Snowy'), ('2024-11-05', 13, 'Cloudy'), ('2024-11-06', 14, 'Windy'),
+                ('2024-11-07', 11, 'Foggy')],
+    'Vancouver': [('2024-11-01', 11, 'Sunny'), ('2024-11-02', 13, 'Partly Cloudy'), ('2024-11-03', 9, 'Rainy'),
+                  ('2024-11-04', 7, 'Snowy'), ('2024-11-05', 15, 'Cloudy'), ('2024-11-06', 16, 'Windy'),
+                  ('2024-11-07', 13, 'Foggy')],
+}
+
+
+# 16: the sample forecasts, previously upserted at every start. Rows that
+# already exist (edited since) are left alone.
+def _sample_forecasts(conn):
+    # The unique key includes the condition, so INSERT OR IGNORE would add the
+    # sample row back next to one whose condition was edited
+    inserted = []
+    for city, forecast in SAMPLE_FORECASTS.items():
+        for date, temperature, condition in forecast:
+            cursor = conn.execute('''
+                INSERT INTO weather_data (city, date, temperature, condition)
+                SELECT ?, ?, ?, ?
+                WHERE NOT EXISTS (SELECT 1 FROM weather_data WHERE city = ? AND date = ?)
+            ''', (city, date, temperature, condition, city, date))
+            if cursor.rowcount:
+                inserted.append((city, date, temperature, condition))
+    timeseries.mark_dirty_rows(inserted, commit=False)
+    city_index.register_cities(SAMPLE_FORECASTS, commit=False)
+
+
+# Ordered list of (version, description, function)
+MIGRATIONS = [
+    (1, 'initial schema', _initial_schema),
+    (2, 'typed weather_data dates', _typed_weather_dates),
+    (3, 'hot query indexes', _hot_query_indexes),
+    (4, 'alert filter indexes', _alert_filter_indexes),
+    (5, 'alert subscriber cursors', _alert_cursors),
+    (6, 'alert bus events', _bus_events),
+    (7, 'content-addressed files', _content_addressed_files),
+    (8, 'file catalog and soft delete', _file_catalog),
+    (9, 'background jobs', _jobs),
+    (10, 'alert idempotency keys', _alert_idempotency_keys),
+    (11, 'weather rollups', _weather_rollups),
+    (12, 'city registry', _city_registry),
+    (13, 'presence', _presence),
+    (14, 'data versions', _data_versions),
+    (15, 'forecast changes', _forecast_changes),
+    (16, 'sample forecasts', _sample_forecasts),
+]
+
+LATEST_VERSION = MIGRATIONS[-1][0]
+
+# Queries on the request path; none of them may fall back to a full table scan.
+# tests/test_query_plans.py checks the statements the data modules actually run.
+HOT_QUERIES = [
+    ('SELECT date, temperature, condition FROM weather_data WHERE city = ? ORDER BY date',
+     ('Montreal',)),
+    ('SELECT password FROM users WHERE username = ?', ('user',)),
+    ('SELECT city, alert_description, username, timestamp FROM alerts ORDER BY timestamp DESC',
+     ()),
+    ('SELECT id FROM alerts WHERE (timestamp, id) < (?, ?) ORDER BY timestamp DESC, id DESC LIMIT 50',
+     ('2024-11-01 00:00:00', 10)),
+    ('SELECT id FROM alerts WHERE city = ? ORDER BY timestamp DESC, id DESC LIMIT 50',
+     ('Montreal',)),
+    ('SELECT id FROM alerts WHERE username = ? ORDER BY timestamp DESC, id DESC LIMIT 50',
+     ('user',)),
+    ('SELECT id, city FROM alerts WHERE id > ? ORDER BY id LIMIT 500', (0,)),
+    ('SELECT city FROM alerts WHERE id = (SELECT max(id) FROM alerts)', ()),
+    ('SELECT last_id FROM alert_cursors WHERE subscriber = ?', ('client-1',)),
+    ('SELECT id, channel, payload FROM bus_events WHERE id > ? ORDER BY id LIMIT 1000', (0,)),
+    ('SELECT storage_key FROM files WHERE sha256 = ? LIMIT 1', ('0' * 64,)),
+    ('SELECT id FROM files WHERE filename = ? AND deleted = ? ORDER BY id DESC LIMIT 1', ('report.pdf', 0)),
+    ('SELECT id FROM files WHERE deleted = ? AND (upload_time, id) < (?, ?) '
+     'ORDER BY upload_time DESC, id DESC LIMIT 50', (0, '2024-11-01 00:00:00', 10)),
+    ('SELECT id FROM files WHERE deleted = ? AND filename >= ? AND filename < ? '
+     'ORDER BY filename, id LIMIT 50', (0, 'rep', 'rep\U0010ffff')),
+    ('SELECT id FROM files WHERE deleted = ? AND uploader = ? ORDER BY upload_time DESC, id DESC LIMIT 50',
+     (0, 'user')),
+    ('SELECT id FROM files WHERE deleted = ? ORDER BY deleted_at DESC, id DESC LIMIT 50', (1,)),
+    ('SELECT 1 FROM files WHERE deleted_path = ? LIMIT 1', ('./deleted_files/report.pdf',)),
+    ('SELECT id FROM files WHERE id > ? ORDER BY id LIMIT 1000', (0,)),
+    ("SELECT id, kind, payload FROM jobs WHERE status = 'pending' AND available_at <= ? "
+     "ORDER BY available_at LIMIT 1", (0.0,)),
+    ('SELECT status, count(*) FROM jobs GROUP BY status', ()),
+    ('UPDATE OR REPLACE weather_data SET temperature = ?, condition = ? WHERE id = '
+     '(SELECT max(id) FROM weather_data WHERE city = ? AND date = ?)',
+     (10, 'Sunny', 'Montreal', '2024-11-01')),
+    ('SELECT id FROM alerts WHERE idempotency_key = ?', ('key',)),
+    ("SELECT period_start, count FROM weather_rollups WHERE city = ? AND period = ? "
+     "AND period_start BETWEEN ? AND ? ORDER BY period_start", ('Montreal', 'month', '2024-01-01', '2024-12-31')),
+    ('SELECT id, start_date, end_date FROM weather_rollup_dirty WHERE city = ?', ('Montreal',)),
+    ('SELECT id, name, normalized, country, region FROM cities WHERE id > ? ORDER BY id', (0,)),
+    ('SELECT id, city_id, normalized FROM city_aliases WHERE id > ? ORDER BY id', (0,)),
+    ('SELECT id FROM cities WHERE normalized = ?', ('montreal',)),
+    ('SELECT username, last_seen FROM presence_users WHERE username > ? AND last_seen >= ? '
+     'ORDER BY username LIMIT ?', ('', 0, 50)),
+    ('SELECT count(*) FROM presence_users WHERE last_seen >= ?', (0,)),
+    ('SELECT 1 FROM presence_connections WHERE username = ? LIMIT 1', ('alice',)),
+    ('SELECT version FROM data_versions WHERE name = ?', ('alerts',)),
+    ('SELECT version FROM forecast_versions WHERE city = ?', ('Montreal',)),
+    ('SELECT version, date, temperature, condition FROM forecast_changes WHERE city = ? AND version > ? '
+     'AND version <= ? ORDER BY version', ('Montreal', 0, 10)),
+    ('DELETE FROM forecast_changes WHERE changed_at < ?', (0.0,)),
+]
+
+
+# Return the schema version recorded in the database
+def current_version(conn=None):
+    conn = conn or db.get_connection()
+    return conn.execute('PRAGMA user_version').fetchone()[0]
+
+
+# Apply every migration newer than the recorded version, up to `target`
+# (default: all of them)
+def migrate(target=LATEST_VERSION):
+    conn = db.get_connection()
+    if current_version(conn) >= target:
+        return current_version(conn)
+    for version, description, apply in MIGRATIONS:
+        if current_version(conn) >= version:
+            continue
+        if version > target:
+            break
+        conn.execute('BEGIN IMMEDIATE')
+        try:
+            # Another worker may have applied it while we waited for the lock
+            if current_version(conn) < version:
+                apply(conn)
+                conn.execute(f'PRAGMA user_version = {version}')
+            conn.commit()
+        except Exception:
+            conn.rollback()
+            raise
+    return current_version(conn)
+
+
+# Return (sql, plan detail) for every query in `queries` ((sql, params)
+# pairs, HOT_QUERIES by default) whose plan contains a full scan
+def full_scans(queries=None):
+    conn = db.get_connection()
+    offenders = []
+    for sql, params in (HOT_QUERIES if queries is None else queries):
+        for row in conn.execute('EXPLAIN QUERY PLAN ' + sql, params):
+            detail = row[-1]
+            # 'SCAN t USING INDEX' walks an index in order; a bare 'SCAN t' reads the table
+            if detail.startswith('SCAN') and 'USING' not in detail:
+                offenders.append((sql, detail))
+            if 'TEMP B-TREE' in detail:
+                offenders.append((sql, detail))
+    return offenders
+
+
+# python migrations.py [--check]
+if __name__ == '__main__':
+    print(f"Schema version: {migrate()}")
+    if '--check' in sys.argv:
+        offenders = full_scans()
+        for sql, detail in offenders:
+            print(f"Full scan: {detail}\n    {sql}")
+        sys.exit(1 if offenders else 0)
@@ -0,0 +1,61 @@
+import os
+import sys
+import threading
+
+# Running blocking calls off the event loop.
+#
+# Under eventlet or gevent every request and Socket.IO handler shares one OS
+# thread, so a slow SQLite query or password hash stalls every other client.
+# call() runs a function on the green library's pool of native threads and
+# suspends only the calling green thread; without monkey patching it just
+# calls the function. Offloaded functions must be self-contained units of
+# work: they run on another thread's pooled connection, so they can't join
+# the caller's transaction, and they must not use green primitives
+# (native_lock() gives locks that are safe on both sides).
+
+# Native threads for offloaded calls (serve.py passes this on to eventlet as
+# EVENTLET_THREADPOOL_SIZE)
+THREADS = int(os.environ.get('WEATHER_OFFLOAD_THREADS', '10'))
+
+
+# 'eventlet', 'gevent', or None when threading is not monkey patched. Neither
+# library is imported here unless something else already has (eventlet warns
+# on import).
+def green_library():
+    if 'eventlet' in sys.modules:
+        from eventlet import patcher
+        if patcher.is_monkey_patched('thread'):
+            return 'eventlet'
+    if 'gevent' in sys.modules:
+        from gevent import monkey
+        if monkey.is_module_patched('threading'):
+            return 'gevent'
+    return None
+
+
+def call(function, *args, **kwargs):
+    library = green_library()
+    if library == 'eventlet':
+        from eventlet import tpool
+        return tpool.execute(function, *args, **kwargs)
+    if library == 'gevent':
+        from gevent import get_hub
+        pool = get_hub().threadpool
+        if pool.maxsize < THREADS:
+            pool.maxsize = THREADS
+        return pool.apply(function, args, kwargs)
+    return function(*args, **kwargs)
+
+
+# A lock backed by an OS mutex even after monkey patching, for state shared
+# between green threads and offloaded calls. Only hold it briefly: a green
+# thread waiting on it blocks the loop.
+def native_lock():
+    library = green_library()
+    if library == 'eventlet':
+        from eventlet import patcher
+        return patcher.original('threading').Lock()
+    if library == 'gevent':
+        from gevent import monkey
+        return monkey.get_original('threading', 'Lock')()
+    return threading.Lock()
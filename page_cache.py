@@ -0,0 +1,177 @@
+import functools
+import gzip
+import hashlib
+import os
+import time
+from collections import OrderedDict
+from flask import Response, make_response, request, session
+import offload
+
+try:
+    import brotli
+except ImportError:  # optional: without it cached pages are offered as gzip only
+    brotli = None
+
+# Cache of rendered HTML pages for /dashboard, /files, /view_files, /alerts and
+# /view_clients.
+#
+# A page is keyed by its endpoint and query string, the user it was rendered
+# for and the current version of each kind of data it shows (see
+# data_versions.py), so any change to that data makes the next request
+# render afresh and old entries simply age out. Bodies are stored with gzip
+# (and brotli, if installed) variants compressed once at render time, and are
+# served with an ETag and Last-Modified so browsers revalidate with a
+# conditional GET and get a 304. Requests with pending flash messages always
+# render. Each process has its own cache; versions are shared through the
+# database, so workers never serve a page older than the data.
+#
+# WEATHER_PAGE_CACHE=0 turns caching off.
+
+ENABLED = os.environ.get('WEATHER_PAGE_CACHE', '1') != '0'
+MAX_ENTRIES = int(os.environ.get('WEATHER_PAGE_CACHE_SIZE', '1024'))
+TTL_SECONDS = float(os.environ.get('WEATHER_PAGE_CACHE_TTL', '300'))
+# Bodies smaller than this aren't worth compressing
+MIN_COMPRESS_SIZE = 512
+GZIP_LEVEL = 9
+BROTLI_QUALITY = 9
+
+# name -> function returning that data's current version
+_sources = {}
+
+
+# Make a version counter available to cached() as `name`
+def register_source(name, version):
+    _sources[name] = version
+
+
+# One rendered page and its pre-compressed variants
+class Entry:
+    def __init__(self, body, content_type, rendered_at, expires_at):
+        self.content_type = content_type
+        self.last_modified = int(rendered_at)
+        self.expires_at = expires_at
+        self.etag = hashlib.blake2b(body, digest_size=12).hexdigest()
+        # Content-Encoding -> body ('' is uncompressed)
+        self.bodies = {'': body}
+        if len(body) >= MIN_COMPRESS_SIZE:
+            self._add_variant('gzip', gzip.compress(body, GZIP_LEVEL))
+            if brotli is not None:
+                self._add_variant('br', brotli.compress(body, quality=BROTLI_QUALITY))
+
+    def _add_variant(self, encoding, body):
+        if len(body) < len(self.bodies['']):
+            self.bodies[encoding] = body
+
+    # The best encoding the client accepts
+    def encoding_for(self, accept_encodings):
+        for encoding in ('br', 'gzip'):
+            if encoding in self.bodies and accept_encodings[encoding]:
+                return encoding
+        return ''
+
+    # A response for the current request, 304 if the client's copy is current
+    def respond(self):
+        encoding = self.encoding_for(request.accept_encodings)
+        response = Response(self.bodies[encoding], content_type=self.content_type)
+        if encoding:
+            response.headers['Content-Encoding'] = encoding
+            # Each encoding is a different representation, so it gets its own tag
+            response.set_etag(f'{self.etag}-{encoding}')
+        else:
+            response.set_etag(self.etag)
+        response.last_modified = self.last_modified
+        response.vary.update(('Accept-Encoding', 'Cookie'))
+        # Per-user pages: browsers may keep them but must revalidate each time
+        response.cache_control.private = True
+        response.cache_control.no_cache = True
+        return response.make_conditional(request)
+
+
+# Bounded LRU of entries with per-entry expiry
+class PageCache:
+    def __init__(self, max_entries=MAX_ENTRIES, ttl=TTL_SECONDS):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries = OrderedDict()
+        # Shared by every green thread in the worker
+        self._lock = offload.native_lock()
+        self._stats = {'hits': 0, 'misses': 0, 'not_modified': 0, 'bypassed': 0, 'evictions': 0}
+
+    def get(self, key, now):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry.expires_at <= now:
+                del self._entries[key]
+                entry = None
+            if entry is None:
+                self._stats['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self._stats['hits'] += 1
+            return entry
+
+    # Store a rendered 200 response and return its entry
+    def store(self, key, response, now):
+        entry = Entry(response.get_data(), response.content_type, now, now + self.ttl)
+        with self._lock:
+            self._entries[key] = entry
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self._stats['evictions'] += 1
+        return entry
+
+    def count(self, stat):
+        with self._lock:
+            self._stats[stat] += 1
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+
+    def stats(self):
+        with self._lock:
+            return dict(self._stats, entries=len(self._entries))
+
+
+page_cache = PageCache()
+
+
+# Cacheable response for the current request, or None to render it uncached
+def _cacheable(response):
+    return (response.status_code == 200 and not response.direct_passthrough and not response.is_streamed
+            and response.mimetype == 'text/html' and 'Content-Encoding' not in response.headers)
+
+
+# Decorator for a logged-in page view whose output depends only on the user,
+# the query string, the URL and the data named in `sources`
+def cached(*sources):
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            username = session.get('username')
+            if not ENABLED or username is None or request.method != 'GET':
+                return view(*args, **kwargs)
+            if '_flashes' in session:
+                # The page will show (and consume) one-off messages
+                page_cache.count('bypassed')
+                return view(*args, **kwargs)
+
+            # Versions are read before rendering, so a change that lands
+            # mid-render is picked up by the next request
+            versions = tuple(_sources[name]() for name in sources)
+            key = (request.endpoint, tuple(sorted(kwargs.items())), tuple(sorted(request.args.items(multi=True))),
+                   username, versions)
+            now = time.time()
+            entry = page_cache.get(key, now)
+            if entry is None:
+                response = make_response(view(*args, **kwargs))
+                if not _cacheable(response):
+                    return response
+                entry = page_cache.store(key, response, now)
+            response = entry.respond()
+            if response.status_code == 304:
+                page_cache.count('not_modified')
+            return response
+        return wrapper
+    return decorator
@@ -0,0 +1,237 @@
+import bisect
+import os
+import threading
+import time
+from collections import OrderedDict
+import data_versions
+import db
+
+# Who is online, for /dashboard and /view_clients.
+#
+# A user is online while they have a Socket.IO connection or were seen within
+# TTL seconds (login, heartbeats, page views). Connections are tracked by
+# Socket.IO sid; clients send a heartbeat every HEARTBEAT_INTERVAL seconds, so
+# a worker that dies without delivering disconnects only leaves its users
+# listed until their TTL runs out. Listings are ordered by username and
+# paginated with a username cursor. version() changes whenever a user comes
+# online or goes offline (not on heartbeats), for caching rendered pages.
+#
+# WEATHER_PRESENCE_BACKEND selects where presence lives:
+#   'memory'  default; this process only (single worker, development)
+#   'sqlite'  the presence_users/presence_connections tables in
+#             weather_net.db, shared by every worker on the host
+
+BACKEND = os.environ.get('WEATHER_PRESENCE_BACKEND', 'memory')
+TTL = float(os.environ.get('WEATHER_PRESENCE_TTL', '90'))
+HEARTBEAT_INTERVAL = float(os.environ.get('WEATHER_PRESENCE_HEARTBEAT', '30'))
+# Expired entries are swept at most this often
+SWEEP_INTERVAL = 10.0
+PAGE_SIZE = 50
+MAX_PAGE_SIZE = 500
+
+
+# In-process presence: O(1) lookups by user and sid, users ordered by last
+# activity for expiry, and a sorted list of names for pages
+class MemoryBackend:
+    def __init__(self):
+        # username -> last seen, least recently seen first
+        self._last_seen = OrderedDict()
+        # username -> set of sids, and sid -> username
+        self._user_sids = {}
+        self._sid_user = {}
+        self._names = []
+        self._lock = threading.Lock()
+        # Bumped when the set of online users changes
+        self._version = 0
+
+    def _touch(self, username, now, cutoff):
+        last_seen = self._last_seen.get(username)
+        if last_seen is not None:
+            self._last_seen.move_to_end(username)
+        else:
+            bisect.insort(self._names, username)
+        if last_seen is None or last_seen < cutoff:
+            self._version += 1
+        self._last_seen[username] = now
+
+    def _remove(self, username):
+        if self._last_seen.pop(username, None) is not None:
+            self._version += 1
+        for sid in self._user_sids.pop(username, ()):
+            self._sid_user.pop(sid, None)
+        position = bisect.bisect_left(self._names, username)
+        if position < len(self._names) and self._names[position] == username:
+            del self._names[position]
+
+    def seen(self, username, sid, now, cutoff):
+        with self._lock:
+            self._touch(username, now, cutoff)
+            if sid is not None and sid not in self._sid_user:
+                self._sid_user[sid] = username
+                self._user_sids.setdefault(username, set()).add(sid)
+
+    def disconnect(self, sid, now):
+        with self._lock:
+            username = self._sid_user.pop(sid, None)
+            if username is None:
+                return
+            sids = self._user_sids.get(username)
+            sids.discard(sid)
+            if not sids:
+                self._remove(username)
+
+    def remove(self, username):
+        with self._lock:
+            self._remove(username)
+
+    def sweep(self, cutoff):
+        removed = 0
+        with self._lock:
+            while self._last_seen:
+                username, last_seen = next(iter(self._last_seen.items()))
+                if last_seen >= cutoff:
+                    break
+                self._remove(username)
+                removed += 1
+        return removed
+
+    def count(self, cutoff):
+        self.sweep(cutoff)
+        return len(self._last_seen)
+
+    def is_online(self, username, cutoff):
+        return self._last_seen.get(username, 0) >= cutoff
+
+    def page(self, after, limit, cutoff):
+        self.sweep(cutoff)
+        with self._lock:
+            names = self._names
+            start = bisect.bisect_right(names, after) if after else 0
+            return [(name, self._last_seen[name]) for name in names[start:start + limit]]
+
+    def version(self):
+        return self._version
+
+
+# Presence shared by every worker through SQLite
+class SQLiteBackend:
+    def seen(self, username, sid, now, cutoff):
+        conn = db.get_connection()
+        # Heartbeats from a user who is still online only move last_seen
+        cursor = conn.execute('UPDATE presence_users SET last_seen = ? WHERE username = ? AND last_seen >= ?',
+                              (now, username, cutoff))
+        if cursor.rowcount == 0:
+            conn.execute('''
+                INSERT INTO presence_users (username, last_seen) VALUES (?, ?)
+                ON CONFLICT (username) DO UPDATE SET last_seen = excluded.last_seen
+            ''', (username, now))
+            data_versions.bump(data_versions.PRESENCE, conn)
+        if sid is not None:
+            conn.execute('''
+                INSERT INTO presence_connections (sid, username) VALUES (?, ?)
+                ON CONFLICT (sid) DO NOTHING
+            ''', (sid, username))
+        conn.commit()
+
+    def disconnect(self, sid, now):
+        conn = db.get_connection()
+        row = conn.execute('SELECT username FROM presence_connections WHERE sid = ?', (sid,)).fetchone()
+        if row is None:
+            return
+        conn.execute('DELETE FROM presence_connections WHERE sid = ?', (sid,))
+        if conn.execute('SELECT 1 FROM presence_connections WHERE username = ? LIMIT 1', row).fetchone() is None:
+            conn.execute('DELETE FROM presence_users WHERE username = ?', row)
+            data_versions.bump(data_versions.PRESENCE, conn)
+        conn.commit()
+
+    def remove(self, username):
+        conn = db.get_connection()
+        conn.execute('DELETE FROM presence_connections WHERE username = ?', (username,))
+        if conn.execute('DELETE FROM presence_users WHERE username = ?', (username,)).rowcount:
+            data_versions.bump(data_versions.PRESENCE, conn)
+        conn.commit()
+
+    def sweep(self, cutoff):
+        conn = db.get_connection()
+        expired = [row[0] for row in conn.execute('SELECT username FROM presence_users WHERE last_seen < ?',
+                                                  (cutoff,))]
+        conn.executemany('DELETE FROM presence_connections WHERE username = ?', [(name,) for name in expired])
+        conn.execute('DELETE FROM presence_users WHERE last_seen < ?', (cutoff,))
+        if expired:
+            data_versions.bump(data_versions.PRESENCE, conn)
+        conn.commit()
+        return len(expired)
+
+    # Reads skip expired rows themselves, so they don't depend on the sweep
+    def count(self, cutoff):
+        conn = db.get_connection()
+        return conn.execute('SELECT count(*) FROM presence_users WHERE last_seen >= ?', (cutoff,)).fetchone()[0]
+
+    def is_online(self, username, cutoff):
+        conn = db.get_connection()
+        return conn.execute('SELECT 1 FROM presence_users WHERE username = ? AND last_seen >= ?',
+                            (username, cutoff)).fetchone() is not None
+
+    def page(self, after, limit, cutoff):
+        conn = db.get_connection()
+        return conn.execute('''
+            SELECT username, last_seen FROM presence_users
+            WHERE username > ? AND last_seen >= ?
+            ORDER BY username
+            LIMIT ?
+        ''', (after or '', cutoff, limit)).fetchall()
+
+    def version(self):
+        return data_versions.get(data_versions.PRESENCE)
+
+
+class Presence:
+    def __init__(self, backend=None, ttl=TTL, heartbeat_interval=HEARTBEAT_INTERVAL):
+        self.backend = backend or (SQLiteBackend() if BACKEND == 'sqlite' else MemoryBackend())
+        self.ttl = ttl
+        # How often clients should send a heartbeat event
+        self.heartbeat_interval = heartbeat_interval
+        self._swept_at = 0.0
+
+    def _maybe_sweep(self, now):
+        if now - self._swept_at >= SWEEP_INTERVAL:
+            self._swept_at = now
+            self.backend.sweep(now - self.ttl)
+
+    # Record activity from a user; `sid` ties it to a Socket.IO connection
+    # (connect and heartbeat events), None for plain HTTP requests
+    def seen(self, username, sid=None):
+        now = time.time()
+        self.backend.seen(username, sid, now, now - self.ttl)
+        self._maybe_sweep(now)
+
+    # A Socket.IO connection closed; the user goes offline with their last one
+    def disconnect(self, sid):
+        self.backend.disconnect(sid, time.time())
+
+    # The user logged out: drop them and all their connections
+    def remove(self, username):
+        self.backend.remove(username)
+
+    def count(self):
+        return self.backend.count(time.time() - self.ttl)
+
+    def is_online(self, username):
+        return self.backend.is_online(username, time.time() - self.ttl)
+
+    # One page of online users after the `after` username:
+    # ([{'username', 'last_seen'}], next cursor or None)
+    def page(self, after=None, limit=None):
+        limit = max(1, min(int(limit or PAGE_SIZE), MAX_PAGE_SIZE))
+        rows = self.backend.page(after, limit + 1, time.time() - self.ttl)
+        users = [{'username': username, 'last_seen': last_seen} for username, last_seen in rows[:limit]]
+        return users, (users[-1]['username'] if len(rows) > limit else None)
+
+    # Changes whenever a user comes online or goes offline; expiries are
+    # noticed within SWEEP_INTERVAL
+    def version(self):
+        self._maybe_sweep(time.time())
+        return self.backend.version()
+
+
+presence = Presence()
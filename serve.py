@@ -0,0 +1,149 @@
+# Production server: python serve.py
+#
+# Runs the Flask-SocketIO app on an explicit async backend instead of the
+# development server, with the TCP alert server from alert.py in the same
+# event loop. Configuration comes from the environment:
+#   WEATHER_ASYNC_MODE          'eventlet' (default) or 'gevent'
+#   WEATHER_HOST, WEATHER_PORT  address of the web server (127.0.0.1:5000)
+#   WEATHER_WORKERS             worker processes sharing the listening socket (1)
+#   WEATHER_ALERT_SERVER        'embedded' (default) runs the TCP alert server in
+#                               the first worker, a green thread per client with
+#                               a bounded outgoing queue (WEATHER_ALERT_QUEUE_SIZE,
+#                               WEATHER_ALERT_SLOW_CLIENT_POLICY); 'off' leaves it
+#                               to alert.py
+#   WEATHER_ALERT_HOST, WEATHER_ALERT_PORT  address of the alert server (127.0.0.1:5003)
+#   WEATHER_BACKLOG             listen backlog of both servers (4096)
+#   WEATHER_MAX_CONNECTIONS     concurrent connections per worker (10000)
+#   WEATHER_OFFLOAD_THREADS     native threads for blocking calls (see offload.py)
+#   WEATHER_PROXY_HOPS          proxies in front whose X-Forwarded-* headers are
+#                               trusted (0); the login throttle keys on the client IP
+#   WEATHER_DOWNLOAD_OFFLOAD    'x-accel' (recommended, behind nginx) or 'x-sendfile'
+#                               hands file downloads to the proxy; '' (default)
+#                               copies every download through the worker, since
+#                               neither eventlet nor gevent uses sendfile
+#
+# With more than one worker, Socket.IO clients must use the websocket
+# transport (or a load balancer with sticky sessions), and presence needs
+# WEATHER_PRESENCE_BACKEND=sqlite so every worker sees every user. Each
+# worker has its own forecast cache, checked against the database at most
+# once per WEATHER_FORECAST_CACHE_CHECK_INTERVAL per city;
+# WEATHER_FORECAST_CACHE_PATH shares one between them.
+import os
+
+ASYNC_MODE = os.environ.setdefault('WEATHER_ASYNC_MODE', 'eventlet')
+
+# Patch the standard library before anything else creates sockets, threads or locks
+if ASYNC_MODE == 'eventlet':
+    # eventlet sizes its native thread pool from its own variable
+    os.environ.setdefault('EVENTLET_THREADPOOL_SIZE', os.environ.get('WEATHER_OFFLOAD_THREADS', '10'))
+    import eventlet
+    eventlet.monkey_patch()
+elif ASYNC_MODE == 'gevent':
+    from gevent import monkey
+    monkey.patch_all()
+else:
+    raise SystemExit(f"WEATHER_ASYNC_MODE must be 'eventlet' or 'gevent', not '{ASYNC_MODE}'")
+
+import logging
+import signal
+import socket
+import sys
+import time
+
+import alert
+import app as weather_app
+import db
+
+WORKERS = int(os.environ.get('WEATHER_WORKERS', '1'))
+ALERT_SERVER = os.environ.get('WEATHER_ALERT_SERVER', 'embedded')
+BACKLOG = int(os.environ.get('WEATHER_BACKLOG', '4096'))
+MAX_CONNECTIONS = int(os.environ.get('WEATHER_MAX_CONNECTIONS', '10000'))
+
+logger = logging.getLogger(__name__)
+
+
+def listen(host, port, backlog=BACKLOG):
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((host, port))
+    sock.listen(backlog)
+    return sock
+
+
+def _serve_wsgi(sock):
+    if ASYNC_MODE == 'eventlet':
+        from eventlet import wsgi
+        wsgi.server(sock, weather_app.app, log_output=False, max_size=MAX_CONNECTIONS)
+        return
+    from gevent import pywsgi
+    try:
+        from geventwebsocket.handler import WebSocketHandler
+    except ImportError:  # without gevent-websocket, Socket.IO falls back to long-polling
+        WebSocketHandler = pywsgi.WSGIHandler
+    pywsgi.WSGIServer(sock, weather_app.app, handler_class=WebSocketHandler, log=None,
+                      spawn=MAX_CONNECTIONS).serve_forever()
+
+
+# Run one worker on the shared listening socket. Worker 0 also runs the
+# alert server and the file reconciler.
+def run_worker(sock, number=0):
+    first = number == 0
+    weather_app.start_services(reconciler=first)
+    if first and ALERT_SERVER == 'embedded':
+        weather_app.socketio.start_background_task(alert.start_alert_server, weather_app.ALERT_SERVER_HOST,
+                                                   weather_app.ALERT_SERVER_PORT)
+    logger.info("Worker %s serving on %s:%s (%s)", number, weather_app.MAIN_SERVER_HOST,
+                weather_app.MAIN_SERVER_PORT, ASYNC_MODE, extra={'pid': os.getpid()})
+    _serve_wsgi(sock)
+
+
+def _fork_worker(sock, number):
+    pid = os.fork()
+    if pid == 0:
+        try:
+            run_worker(sock, number)
+        finally:
+            os._exit(0)
+    return pid
+
+
+# Fork `workers` processes and restart any that exit, until SIGTERM/SIGINT
+def supervise(sock, workers):
+    children = {_fork_worker(sock, number): number for number in range(workers)}
+
+    def stop(signum, frame):
+        for pid in children:
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except ProcessLookupError:
+                pass
+        sys.exit(0)
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    while True:
+        pid, status = os.wait()
+        number = children.pop(pid, None)
+        if number is None:
+            continue
+        logger.warning("Worker %s exited with status %s, restarting", number, status)
+        time.sleep(1)
+        children[_fork_worker(sock, number)] = number
+
+
+def main():
+    weather_app.create_app()
+    if not weather_app.app.config['DOWNLOAD_OFFLOAD']:
+        logger.info("File downloads are copied through the workers; set WEATHER_DOWNLOAD_OFFLOAD=x-accel "
+                    "to let nginx send them")
+    # Workers open their own connections
+    db.close_all()
+    sock = listen(weather_app.MAIN_SERVER_HOST, weather_app.MAIN_SERVER_PORT)
+    if WORKERS > 1:
+        supervise(sock, WORKERS)
+    else:
+        run_worker(sock)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,32 @@
+import os
+import sys
+
+# The modules live at the top of the repository
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Settings that must be in place before the modules are imported
+os.environ.setdefault('WEATHER_ASYNC_MODE', 'threading')
+os.environ.setdefault('WEATHER_ALERT_BUS', 'local')
+os.environ.setdefault('WEATHER_LOG_LEVEL', 'WARNING')
+
+import pytest
+
+import db
+import migrations
+
+
+# A fresh database in a temporary directory, which is also the working
+# directory (for the upload folders). Migrated to `migration_target`, the
+# latest schema unless a test overrides that fixture.
+@pytest.fixture
+def migration_target():
+    return migrations.LATEST_VERSION
+
+
+@pytest.fixture
+def database(tmp_path, monkeypatch, migration_target):
+    monkeypatch.chdir(tmp_path)
+    db.set_database(str(tmp_path / 'weather.db'))
+    migrations.migrate(migration_target)
+    yield db.get_connection()
+    db.close_all()
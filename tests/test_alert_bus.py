@@ -0,0 +1,90 @@
+import asyncio
+import sqlite3
+import statistics
+import time
+
+import alert
+import alert_bus
+import alert_protocol
+import broadcast
+
+# Seconds from publishing in one process to the alert reaching a TCP client of
+# an alert server in another; the SQLite bus polls every 50 ms
+LATENCY_BUDGET = 0.25
+
+
+def committed_events(database_path):
+    with sqlite3.connect(database_path) as other:
+        return [row[0] for row in other.execute('SELECT payload FROM bus_events')]
+
+
+def test_publish_inside_a_transaction_commits_with_it(database, tmp_path):
+    bus = alert_bus.SQLiteBus()
+    database.execute("INSERT INTO alerts (city, alert_description, username) VALUES ('Montreal', 'Storm', 'alice')")
+
+    bus.publish(alert_bus.ALERT_CHANNEL, {'message': 'Storm'})
+
+    assert database.in_transaction
+    assert committed_events(tmp_path / 'weather.db') == []
+    database.rollback()
+    assert database.execute('SELECT count(*) FROM bus_events').fetchone()[0] == 0
+
+
+def test_publish_outside_a_transaction_commits_at_once(database, tmp_path):
+    alert_bus.SQLiteBus().publish(alert_bus.ALERT_CHANNEL, {'message': 'Storm'})
+
+    assert not database.in_transaction
+    assert len(committed_events(tmp_path / 'weather.db')) == 1
+
+
+def test_alert_reaches_a_tcp_client_of_another_process_within_budget(database):
+    # The server's bus only sees the publisher's rows by polling, as it would
+    # if the publisher were another process
+    server_bus = alert_bus.SQLiteBus(poll_interval=0.05)
+    publisher = alert_bus.SQLiteBus()
+
+    async def scenario():
+        server = alert.AsyncAlertServer('127.0.0.1', 0, replay_history=False, bus=server_bus)
+        await server.start()
+        reader, writer = await asyncio.open_connection('127.0.0.1', server.port)
+        writer.write(alert_protocol.hello(since=0))
+        await alert_protocol.read_frame(reader)
+
+        latencies = []
+        for n in range(20):
+            sent = time.perf_counter()
+            await server.loop.run_in_executor(None, lambda: alert_bus.publish_alert(
+                f'Storm {n}', n, 'Montreal', bus=publisher))
+            frame = await asyncio.wait_for(alert_protocol.read_frame(reader), 5)
+            latencies.append(time.perf_counter() - sent)
+            assert frame['message'] == f'Storm {n}'
+        writer.close()
+        server.server.close()
+        return latencies
+
+    try:
+        latencies = asyncio.run(scenario())
+    finally:
+        server_bus.close()
+        server_bus._poller.join()
+
+    assert statistics.quantiles(latencies, n=20)[-1] < LATENCY_BUDGET
+
+
+class RecordingSocketIO:
+    def __init__(self):
+        self.emitted = []
+
+    def emit(self, event, data):
+        self.emitted.append((event, data))
+
+
+def test_redis_mode_emits_the_batched_shape(database):
+    bus = alert_bus.LocalBus()
+    bus.socketio_message_queue = 'redis://localhost'
+    socketio = RecordingSocketIO()
+
+    alert_bus.publish_alert('Storm', 7, 'Montreal', socketio=socketio, bus=bus)
+
+    alerts = [{'city': 'Montreal', 'message': 'Storm', 'id': 7, 'merged': 0}]
+    assert socketio.emitted == [('new_alert', broadcast.batch_event(alerts))]
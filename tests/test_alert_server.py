@@ -0,0 +1,103 @@
+import asyncio
+import socket
+import time
+
+import pytest
+
+import alert
+import alert_bus
+import alert_protocol
+
+
+async def framed_client(server):
+    reader, writer = await asyncio.open_connection('127.0.0.1', server.port)
+    writer.write(alert_protocol.hello(since=0))
+    assert (await alert_protocol.read_frame(reader))['type'] == 'welcome'
+    return reader, writer
+
+
+@pytest.mark.parametrize('request_frame', [['get_latest_alert'], 'alert', 7, {'message': 'no type'},
+                                           {'type': 'ack', 'id': 'soon'}])
+def test_malformed_requests_get_an_error_reply(database, request_frame):
+    async def scenario():
+        server = alert.AsyncAlertServer('127.0.0.1', 0, replay_history=False, bus=alert_bus.LocalBus())
+        await server.start()
+        reader, writer = await framed_client(server)
+
+        writer.write(alert_protocol.encode_frame(request_frame))
+        reply = await asyncio.wait_for(alert_protocol.read_frame(reader), 5)
+
+        # The connection is still served afterwards
+        server.broadcast('Storm warning', 1)
+        alert_frame = await asyncio.wait_for(alert_protocol.read_frame(reader), 5)
+        writer.close()
+        server.server.close()
+        return reply, alert_frame, server.stats()
+
+    reply, alert_frame, stats = asyncio.run(scenario())
+
+    assert reply['type'] == 'error'
+    assert alert_frame['message'] == 'Storm warning'
+    assert stats['disconnected'] == 0
+
+
+def test_queue_size_and_policy_come_from_the_command_line(monkeypatch):
+    started = {}
+    monkeypatch.setattr(alert, 'start_async_alert_server',
+                        lambda host, port, **options: started.update(options, host=host, port=port))
+
+    alert.main(['--async', '--port', '6000', '--queue-size', '8', '--policy', 'disconnect'])
+
+    assert started == {'host': alert.ALERT_SERVER_HOST, 'port': 6000, 'queue_size': 8, 'policy': 'disconnect'}
+
+
+def test_unknown_policy_is_rejected():
+    with pytest.raises(SystemExit):
+        alert.main(['--async', '--policy', 'ignore'])
+
+
+def test_threaded_server_queues_broadcasts_without_waiting_for_a_stalled_client():
+    server_side, client_side = socket.socketpair()
+    outbox = alert.ClientOutbox(server_side, queue_size=4, policy='drop_oldest')
+    payload = b'x' * 65536
+
+    started = time.perf_counter()
+    for _ in range(200):  # far more than the socket buffers hold
+        assert outbox.offer(payload)
+    elapsed = time.perf_counter() - started
+
+    assert elapsed < 1
+    assert outbox.dropped > 0
+    outbox.close()
+    server_side.close()
+    client_side.close()
+
+
+def test_threaded_server_disconnect_policy_gives_up_on_a_stalled_client():
+    server_side, client_side = socket.socketpair()
+    outbox = alert.ClientOutbox(server_side, queue_size=4, policy='disconnect')
+
+    results = [outbox.offer(b'x' * 65536) for _ in range(200)]
+
+    assert results[0] and not results[-1]
+    outbox.close()
+    server_side.close()
+    client_side.close()
+
+
+def test_threaded_server_delivers_queued_alerts_in_order():
+    server_side, client_side = socket.socketpair()
+    outbox = alert.ClientOutbox(server_side)
+    for n in range(3):
+        outbox.offer(alert.AlertPayloads(f'Storm {n}', n).get('json'))
+
+    decoder = alert_protocol.FrameDecoder()
+    frames = []
+    client_side.settimeout(5)
+    while len(frames) < 3:
+        frames += decoder.feed(client_side.recv(65536))
+
+    assert [frame['message'] for frame in frames] == ['Storm 0', 'Storm 1', 'Storm 2']
+    outbox.close()
+    server_side.close()
+    client_side.close()
@@ -0,0 +1,26 @@
+import pytest
+
+import app as weather_app
+
+
+@pytest.fixture
+def client(database):
+    weather_app.create_app()
+    return weather_app.app.test_client()
+
+
+def test_city_autocomplete_requires_login(client):
+    response = client.get('/api/cities?prefix=mon')
+
+    assert response.status_code == 401
+    assert response.get_json() == {'error': 'login required'}
+
+
+def test_city_autocomplete_for_a_logged_in_user(client):
+    with client.session_transaction() as session:
+        session['username'] = 'alice'
+
+    response = client.get('/api/cities?prefix=mon')
+
+    assert response.status_code == 200
+    assert 'cities' in response.get_json()
@@ -0,0 +1,40 @@
+import pytest
+
+import auth
+import user_db
+
+
+@pytest.fixture
+def throttles(database, monkeypatch):
+    monkeypatch.setattr(auth, 'throttle', auth.LoginThrottle(free_attempts=3))
+    monkeypatch.setattr(auth, 'account_throttle', auth.LoginThrottle(free_attempts=10))
+    user_db.register_user('alice', 'secret')
+
+
+def fail(times, ip, username='alice'):
+    for _ in range(times):
+        auth.authenticate(username, 'wrong', ip)
+
+
+def test_failures_from_one_address_do_not_lock_the_owner_out(throttles):
+    fail(3, '203.0.113.9')
+
+    assert auth.authenticate('alice', 'secret', '203.0.113.9')[1] > 0
+    assert auth.authenticate('alice', 'secret', '198.51.100.7') == (True, 0.0)
+
+
+def test_the_account_limit_applies_across_addresses(throttles):
+    for number in range(5):
+        fail(2, f'203.0.113.{number}')
+
+    valid, retry_after = auth.authenticate('alice', 'secret', '198.51.100.7')
+
+    assert not valid and retry_after > 0
+
+
+def test_the_address_limit_applies_across_usernames(throttles):
+    for number in range(10):
+        fail(1, '203.0.113.9', username=f'user{number}')
+
+    assert auth.authenticate('alice', 'secret', '203.0.113.9')[1] > 0
+    assert auth.authenticate('alice', 'secret', '198.51.100.7') == (True, 0.0)
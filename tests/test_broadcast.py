@@ -0,0 +1,45 @@
+import broadcast
+
+
+def scheduler():
+    batches = []
+    return broadcast.BroadcastScheduler(batches.append, start_task=lambda run: None), batches
+
+
+def test_every_alert_for_a_city_is_sent_in_the_batch():
+    alerts, batches = scheduler()
+    alerts.submit('Montreal', 'Storm', 1)
+    alerts.submit('Toronto', 'Fog', 2)
+    alerts.submit('Montreal', 'Flooding', 3)
+
+    alerts.flush()
+
+    assert [(alert['city'], alert['id']) for alert in batches[0]] == [('Toronto', 2), ('Montreal', 1), ('Montreal', 3)]
+    assert broadcast.batch_event(batches[0])['message'] == 'Toronto: Fog; Montreal: Storm; Montreal: Flooding'
+    assert alerts.stats()['sent'] == 3
+
+
+def test_only_repeats_of_a_pending_alert_are_merged():
+    alerts, batches = scheduler()
+    alerts.submit('Montreal', 'Storm', 1)
+    alerts.submit('Montreal', 'Storm', 1)  # redelivered from the bus
+    alerts.submit('Test', 'This is a test alert')
+    alerts.submit('Test', 'This is a test alert')
+    alerts.submit('Montreal', 'Storm', 4)  # same text, a different alert
+
+    assert alerts.stats()['pending'] == 3
+    alerts.flush()
+
+    assert [(alert['id'], alert['merged']) for alert in batches[0]] == [(None, 1), (1, 1), (4, 0)]
+    assert alerts.stats()['merged'] == 2
+
+
+def test_batches_are_split_at_max_batch():
+    batches = []
+    alerts = broadcast.BroadcastScheduler(batches.append, max_batch=2, start_task=lambda run: None)
+    for alert_id in range(5):
+        alerts.submit('Montreal', 'Storm', alert_id)
+
+    alerts.flush()
+
+    assert [len(batch) for batch in batches] == [2, 2, 1]
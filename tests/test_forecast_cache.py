@@ -0,0 +1,57 @@
+import forecast_cache
+
+
+class Versions:
+    def __init__(self):
+        self.current = {}
+        self.reads = 0
+
+    def __call__(self, city):
+        self.reads += 1
+        return self.current.get(city, 0)
+
+
+def make_cache(check_interval):
+    versions = Versions()
+    loads = []
+
+    def loader(city):
+        loads.append(city)
+        return [(city, versions.current.get(city, 0))]
+
+    cache = forecast_cache.ForecastCache(version=versions, check_interval=check_interval)
+    return cache, versions, loads, loader
+
+
+def test_hits_within_the_interval_skip_the_version_read():
+    cache, versions, loads, loader = make_cache(check_interval=60)
+
+    for _ in range(5):
+        assert cache.get('Montreal', loader) == [('Montreal', 0)]
+
+    assert versions.reads == 1
+    assert loads == ['Montreal']
+    assert cache.stats()['hits'] == 4
+
+
+def test_a_newer_version_is_loaded_once_the_interval_has_passed():
+    cache, versions, loads, loader = make_cache(check_interval=0)
+    cache.get('Montreal', loader)
+    assert cache.get('Montreal', loader) == [('Montreal', 0)]
+
+    versions.current['Montreal'] = 1
+
+    assert cache.get('Montreal', loader) == [('Montreal', 1)]
+    assert loads == ['Montreal', 'Montreal']
+    assert cache.stats()['stale'] == 1
+
+
+def test_invalidate_drops_an_entry_inside_the_interval():
+    cache, versions, loads, loader = make_cache(check_interval=60)
+    cache.get('Montreal', loader)
+    versions.current['Montreal'] = 1
+
+    cache.invalidate('Montreal')
+
+    assert cache.get('Montreal', loader) == [('Montreal', 1)]
+    assert versions.reads == 2
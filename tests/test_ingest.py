@@ -0,0 +1,32 @@
+import ingest
+import user_db
+
+
+def test_invalid_rows_are_reported_and_the_rest_loaded(database, tmp_path):
+    feed = tmp_path / 'feed.csv'
+    feed.write_text('city,date,temperature,condition\n'
+                    'Quebec,2024-11-01,2,Snowy\n'
+                    'Quebec,2024-11-31,3,Snowy\n'
+                    'Quebec,2024-11-02,warm,Sunny\n'
+                    ',2024-11-03,1,Cloudy\n'
+                    'Quebec,2024-11-04,-1,Foggy\n')
+    lines = tmp_path / 'feed.ndjson'
+    lines.write_text('{"city": "Quebec", "date": "2024-11-05", "temperature": 0, "condition": "Windy"}\n'
+                     'not json\n'
+                     '["Quebec", "2024-11-06", 1, "Rainy"]\n')
+
+    stats = ingest.ingest_files([str(feed), str(lines)], batch_size=2)
+
+    assert stats['rows'] == 3
+    assert stats['rejected_count'] == 5
+    assert [location for location, _ in stats['rejected']] == [
+        f'{feed}:3', f'{feed}:4', f'{feed}:5', f'{lines}:2', f'{lines}:3']
+    assert [day[0] for day in user_db.search_weather_data('Quebec')] == ['2024-11-01', '2024-11-04', '2024-11-05']
+
+
+def test_main_exits_nonzero_when_rows_are_rejected(database, tmp_path, capsys):
+    feed = tmp_path / 'feed.csv'
+    feed.write_text('city,date,temperature,condition\nQuebec,11/01/2024,2,Snowy\n')
+
+    assert ingest.main([str(feed)]) == 1
+    assert f'Rejected {feed}:2' in capsys.readouterr().err
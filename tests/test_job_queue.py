@@ -0,0 +1,36 @@
+import job_queue
+import migrations
+
+
+# Run `exercise` and return its result and every statement it sent to SQLite
+def traced(conn, exercise):
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        return exercise(), statements
+    finally:
+        conn.set_trace_callback(None)
+
+
+def test_idle_poll_is_one_indexed_read(database):
+    jobs = job_queue.JobQueue(start_task=lambda run: None)
+    jobs.enqueue('later', {}, delay=60)
+
+    job, statements = traced(database, jobs._claim)
+
+    assert job is None
+    assert len(statements) == 1
+    assert not database.in_transaction
+    assert migrations.full_scans([(statements[0], ())]) == []
+
+
+def test_due_job_is_claimed_under_the_write_lock(database):
+    jobs = job_queue.JobQueue(start_task=lambda run: None)
+    job_id = jobs.enqueue('now', {'city': 'Montreal'})
+
+    job, statements = traced(database, jobs._claim)
+
+    assert job['id'] == job_id and job['payload'] == {'city': 'Montreal'}
+    assert 'BEGIN IMMEDIATE' in statements
+    # Not due again until its visibility timeout passes
+    assert jobs._claim() is None
@@ -0,0 +1,33 @@
+import pytest
+
+import migrations
+
+
+@pytest.mark.parametrize('migration_target', [1])
+def test_unparseable_dates_are_quarantined(database):
+    database.executemany('INSERT INTO weather_data (id, city, date, temperature, condition) VALUES (?, ?, ?, ?, ?)',
+                         [(1, 'Montreal', '2024-11-01', 5, 'Sunny'),
+                          (2, 'Montreal', 'next tuesday', 6, 'Rainy'),
+                          (3, 'Montreal', '2024-11-01 08:00:00', 7, 'Sunny')])
+    database.commit()
+
+    migrations.migrate(2)
+
+    assert database.execute('SELECT id, date FROM weather_data').fetchall() == [(1, '2024-11-01')]
+    assert database.execute('SELECT id, date, reason FROM weather_data_rejected ORDER BY id').fetchall() == [
+        (2, 'next tuesday', 'unparseable date'),
+        (3, '2024-11-01 08:00:00', 'duplicate after date normalization'),
+    ]
+
+
+@pytest.mark.parametrize('migration_target', [15])
+def test_sample_forecasts_leave_edited_rows_alone(database):
+    database.execute("INSERT INTO weather_data (city, date, temperature, condition) "
+                     "VALUES ('Montreal', '2024-11-01', -2, 'Hail')")
+    database.commit()
+
+    migrations.migrate(16)
+
+    assert database.execute("SELECT temperature, condition FROM weather_data "
+                            "WHERE city = 'Montreal' AND date = '2024-11-01'").fetchall() == [(-2, 'Hail')]
+    assert database.execute("SELECT count(*) FROM weather_data WHERE city = 'Montreal'").fetchone()[0] == 7
@@ -0,0 +1,60 @@
+import alerts_db
+import data_versions
+import forecast_updates
+import migrations
+import user_db
+
+
+# Run `exercise` and return every statement it sent to SQLite, with the
+# parameters bound in, that reads or modifies rows
+def traced_statements(conn, exercise):
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        exercise()
+    finally:
+        conn.set_trace_callback(None)
+    return [sql for sql in statements if sql.lstrip().split(None, 1)[0].upper() in ('SELECT', 'UPDATE', 'DELETE')]
+
+
+def request_path(conn):
+    user_db.register_user('alice', 'secret')
+    user_db.verify_login('alice', 'secret')
+    user_db.search_weather_data('Montreal')
+    user_db.update_weather('Montreal', '2024-11-01', 3, 'Cloudy', 'alice', 'Cold snap')
+    forecast_updates.catch_up('Montreal', 0)
+    data_versions.get(data_versions.ALERTS)
+
+    file_id = user_db.save_file_metadata('report.pdf', 'alice', '0' * 64, 10, 'objects/00/00/' + '0' * 64)
+    user_db.get_file(file_id)
+    user_db.get_file_metadata('report.pdf')
+    user_db.is_content_referenced('0' * 64)
+    for sort in user_db.FILE_SORTS:
+        files, cursor = user_db.get_files_page(1, sort=sort)
+        user_db.get_files_page(1, cursor, sort=sort)
+    user_db.get_files_page(uploader='alice')
+    user_db.get_files_page(prefix='rep')
+    user_db.soft_delete_file(file_id)
+    user_db.get_files_page(deleted=True, sort='deleted')
+    user_db.get_file_metadata('report.pdf', deleted=True)
+
+    alerts_db.add_weather_alert('Montreal', 'Storm', 'alice')
+    alerts_db.add_weather_alert('Toronto', 'Fog', 'bob')
+    alerts, cursor = alerts_db.get_alerts_page(1)
+    alerts_db.get_alerts_page(1, cursor)
+    alerts_db.get_alerts_page(city='Montreal')
+    alerts_db.get_alerts_page(username='bob')
+    alerts_db.get_alerts_since(0)
+    alerts_db.get_latest_alert()
+    alerts_db.set_alert_cursor('client-1', 1)
+    alerts_db.get_unsent_alerts('client-1')
+
+
+def test_request_path_queries_use_indexes(database):
+    statements = traced_statements(database, lambda: request_path(database))
+    assert len(statements) > 20
+    assert migrations.full_scans([(sql, ()) for sql in statements]) == []
+
+
+def test_hot_queries_use_indexes(database):
+    assert migrations.full_scans() == []
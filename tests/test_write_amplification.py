@@ -0,0 +1,65 @@
+import time
+
+import forecast_updates
+import job_queue
+import user_db
+
+# Per update with an alert: UPDATE weather, rollup dirty mark, forecast version
+# and change, INSERT alert, alerts data version, INSERT broadcast job, plus
+# BEGIN/COMMIT
+MAX_STATEMENTS = 9
+MAX_COMMITS = 1
+
+
+# Run fn() and return the statements it sent to SQLite, without PRAGMAs
+def statements_of(conn, fn):
+    statements = []
+    conn.set_trace_callback(statements.append)
+    try:
+        fn()
+    finally:
+        conn.set_trace_callback(None)
+    return [sql.strip() for sql in statements if not sql.lstrip().upper().startswith('PRAGMA')]
+
+
+def row_counts(conn):
+    return {table: conn.execute(f'SELECT count(*) FROM {table}').fetchone()[0]
+            for table in ('weather_data', 'alerts', 'jobs', 'forecast_changes')}
+
+
+# An update of an existing row that stores an alert and queues its broadcast
+def update_with_alert(monkeypatch):
+    # Leave out the periodic prune of old forecast changes
+    monkeypatch.setattr(forecast_updates, '_pruned_at', time.time())
+    # No workers: only the enqueue is measured
+    jobs = job_queue.JobQueue(workers=0)
+    user_db.store_weather_data('Bench', [('2024-11-01', 10, 'Sunny')])
+    return lambda: user_db.update_weather(
+        'Bench', '2024-11-01', 2, 'Snow', 'bench', 'Snow storm', 'bench-key-1',
+        on_alert=lambda alert_id: jobs.enqueue('alert.publish', {'id': alert_id}, commit=False))
+
+
+def test_update_with_alert_is_one_transaction_within_budget(database, monkeypatch):
+    update = update_with_alert(monkeypatch)
+    before = row_counts(database)
+
+    statements = statements_of(database, update)
+
+    assert len(statements) <= MAX_STATEMENTS
+    assert statements.count('COMMIT') == MAX_COMMITS
+    assert row_counts(database) == dict(before, alerts=before['alerts'] + 1, jobs=before['jobs'] + 1,
+                                        forecast_changes=before['forecast_changes'] + 1)
+    assert database.execute("SELECT temperature, condition FROM weather_data WHERE city = 'Bench'").fetchall() == [
+        (2, 'Snow')]
+
+
+def test_repeated_idempotency_key_stores_no_second_alert(database, monkeypatch):
+    update = update_with_alert(monkeypatch)
+    update()
+    before = row_counts(database)
+
+    statements = statements_of(database, update)
+
+    assert len(statements) < MAX_STATEMENTS
+    assert statements.count('COMMIT') == MAX_COMMITS
+    assert row_counts(database) == dict(before, forecast_changes=before['forecast_changes'] + 1)
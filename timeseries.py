@@ -0,0 +1,311 @@
+import datetime
+import itertools
+import json
+import db
+
+# Time-series layer over weather_data: range queries and precomputed
+# daily/weekly/monthly rollups (count, min/mean/max temperature and a
+# histogram of conditions) per city.
+#
+# Writers only record the (city, date range) they touched with mark_dirty();
+# refresh() recomputes the affected days, weeks and months from weather_data
+# in SQL, and runs before any rollup is read. Weeks start on Monday; periods
+# are keyed by their first date.
+
+PERIODS = ('day', 'week', 'month')
+# aggregate() can also group by year or over the whole range
+AGGREGATE_PERIODS = PERIODS + ('year', 'all')
+
+MIN_DATE = '0001-01-01'
+MAX_DATE = '9999-12-31'
+
+# Cities per query when reading rollups for many cities
+CITY_CHUNK = 500
+
+# NumPy is optional (aggregate() falls back to plain Python) and is only
+# imported the first time it is needed, so importing this module stays cheap
+numpy = None
+_numpy_checked = False
+
+
+def load_numpy():
+    global numpy, _numpy_checked
+    if not _numpy_checked:
+        try:
+            import numpy
+        except ImportError:
+            numpy = None
+        _numpy_checked = True
+    return numpy
+
+
+# SQL for the first date of the period containing `date`
+PERIOD_START_SQL = {
+    'day': 'date',
+    'week': "date(date, '-' || ((strftime('%w', date) + 6) % 7) || ' days')",
+    'month': "date(date, 'start of month')",
+}
+
+# Rollups of one city's rows between two dates, grouped by period and condition
+# first so the histogram can be built with json_group_object
+ROLLUP_SQL = '''
+    INSERT INTO weather_rollups (city, period, period_start, count, temp_min, temp_max, temp_sum, conditions)
+    SELECT ?, ?, period_start, sum(n), min(lo), max(hi), sum(total), json_group_object(condition, n)
+    FROM (
+        SELECT {period_start} AS period_start, condition, count(*) AS n, min(temperature) AS lo,
+               max(temperature) AS hi, sum(temperature) AS total
+        FROM weather_data
+        WHERE city = ? AND date BETWEEN ? AND ?
+        GROUP BY 1, condition
+    )
+    GROUP BY period_start
+'''
+
+
+def _date(value):
+    if isinstance(value, datetime.date):
+        return value
+    return datetime.date.fromisoformat(value)
+
+
+# First date of the period containing `day`
+def period_start(day, period):
+    day = _date(day)
+    if period == 'week':
+        return day - datetime.timedelta(days=day.weekday())
+    if period == 'month':
+        return day.replace(day=1)
+    if period == 'year':
+        return day.replace(month=1, day=1)
+    return day
+
+
+# Last date of the period starting at `start`
+def period_end(start, period):
+    if period == 'week':
+        return start + datetime.timedelta(days=6)
+    if period == 'month':
+        if start.month == 12:
+            return start.replace(day=31)
+        return start.replace(month=start.month + 1) - datetime.timedelta(days=1)
+    if period == 'year':
+        return start.replace(month=12, day=31)
+    return start
+
+
+# Record that rows for `city` between two dates changed. With commit=False it
+# joins the caller's transaction, so the mark commits with the data.
+def mark_dirty(city, start, end=None, commit=True):
+    conn = db.get_connection()
+    conn.execute('INSERT INTO weather_rollup_dirty (city, start_date, end_date) VALUES (?, ?, ?)',
+                 (city, str(start), str(end or start)))
+    if commit:
+        conn.commit()
+
+
+# mark_dirty() for a batch of (city, date, ...) rows: one range per city
+def mark_dirty_rows(rows, commit=True):
+    ranges = {}
+    for row in rows:
+        city, date = row[0], str(row[1])
+        low, high = ranges.get(city, (date, date))
+        ranges[city] = (min(low, date), max(high, date))
+    conn = db.get_connection()
+    conn.executemany('INSERT INTO weather_rollup_dirty (city, start_date, end_date) VALUES (?, ?, ?)',
+                     [(city, low, high) for city, (low, high) in ranges.items()])
+    if commit:
+        conn.commit()
+
+
+# Recompute every rollup touching [start, end] for one city
+def _rebuild_range(conn, city, start, end):
+    for period in PERIODS:
+        # Whole periods, so partly changed weeks and months are recomputed in full
+        first = period_start(start, period).isoformat()
+        last = period_end(period_start(end, period), period).isoformat()
+        conn.execute('DELETE FROM weather_rollups WHERE city = ? AND period = ? AND period_start BETWEEN ? AND ?',
+                     (city, period, first, last))
+        conn.execute(ROLLUP_SQL.format(period_start=PERIOD_START_SQL[period]), (city, period, city, first, last))
+
+
+# Bring rollups up to date for the given cities (all cities if None).
+# Returns the number of cities recomputed.
+def refresh(cities=None):
+    conn = db.get_connection()
+    if cities is not None:
+        cities = list(cities)
+    # Cheap check first, so reads don't take the write lock when nothing changed
+    if cities is None or len(cities) > CITY_CHUNK:
+        pending = conn.execute('SELECT 1 FROM weather_rollup_dirty LIMIT 1').fetchone()
+        cities = None
+    else:
+        pending = any(conn.execute('SELECT 1 FROM weather_rollup_dirty WHERE city = ? LIMIT 1', (city,)).fetchone()
+                      for city in cities)
+    if not pending:
+        return 0
+
+    conn.execute('BEGIN IMMEDIATE')
+    try:
+        if cities is None:
+            marks = conn.execute('SELECT id, city, start_date, end_date FROM weather_rollup_dirty').fetchall()
+        else:
+            marks = []
+            for city in cities:
+                marks.extend(conn.execute('SELECT id, city, start_date, end_date FROM weather_rollup_dirty '
+                                          'WHERE city = ?', (city,)))
+        ranges = {}
+        for _, city, start, end in marks:
+            low, high = ranges.get(city, (start, end))
+            ranges[city] = (min(low, start), max(high, end))
+        for city, (start, end) in ranges.items():
+            _rebuild_range(conn, city, _date(start), _date(end))
+        conn.executemany('DELETE FROM weather_rollup_dirty WHERE id = ?', [(mark[0],) for mark in marks])
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return len(ranges)
+
+
+def _rollup_dict(row):
+    start, count, low, high, total, conditions = row
+    return {'period_start': start, 'count': count, 'min': low, 'mean': total / count if count else None,
+            'max': high, 'conditions': json.loads(conditions)}
+
+
+# Precomputed rollups for one city, oldest first. Periods overlapping
+# [start, end] are included.
+def rollups(city, period='month', start=None, end=None):
+    if period not in PERIODS:
+        raise ValueError(f"Unknown period '{period}'")
+    refresh([city])
+    first = period_start(start, period).isoformat() if start else MIN_DATE
+    conn = db.get_connection()
+    rows = conn.execute('''
+        SELECT period_start, count, temp_min, temp_max, temp_sum, conditions
+        FROM weather_rollups
+        WHERE city = ? AND period = ? AND period_start BETWEEN ? AND ?
+        ORDER BY period_start
+    ''', (city, period, first, str(end or MAX_DATE))).fetchall()
+    return [_rollup_dict(row) for row in rows]
+
+
+# One observation per day for a city between two dates (inclusive): the mean
+# temperature and the most frequent condition
+def series(city, start=None, end=None):
+    return [(day['period_start'], day['mean'], max(day['conditions'], key=day['conditions'].get))
+            for day in rollups(city, 'day', start, end)]
+
+
+# Split [start, end] into (source period, first, last) pieces to read: whole
+# weeks or months from their own rollups, and the partial periods at either
+# end from daily rollups
+def _segments(period, start, end):
+    if period == 'day':
+        return [('day', start, end)]
+    source = 'week' if period == 'week' else 'month'
+    inner_start = period_start(start, source)
+    if inner_start != start:
+        inner_start = period_end(inner_start, source) + datetime.timedelta(days=1)
+    inner_end = period_end(period_start(end, source), source)
+    if inner_end != end:
+        inner_end = period_start(end, source) - datetime.timedelta(days=1)
+    if inner_start > inner_end:
+        return [('day', start, end)]
+    segments = [(source, inner_start, inner_end)]
+    if start < inner_start:
+        segments.append(('day', start, inner_start - datetime.timedelta(days=1)))
+    if inner_end < end:
+        segments.append(('day', inner_end + datetime.timedelta(days=1), end))
+    return segments
+
+
+# Rows (city, period_start, count, min, max, sum) from `source` rollups, ordered by city and date
+def _read(cities, source, start, end):
+    conn = db.get_connection()
+    if cities is None:
+        yield from conn.execute('''
+            SELECT city, period_start, count, temp_min, temp_max, temp_sum
+            FROM weather_rollups
+            WHERE period = ? AND period_start BETWEEN ? AND ?
+            ORDER BY city, period_start
+        ''', (source, start, end))
+        return
+    cities = sorted(set(cities))
+    for offset in range(0, len(cities), CITY_CHUNK):
+        chunk = cities[offset:offset + CITY_CHUNK]
+        yield from conn.execute(f'''
+            SELECT city, period_start, count, temp_min, temp_max, temp_sum
+            FROM weather_rollups
+            WHERE city IN ({','.join('?' * len(chunk))}) AND period = ? AND period_start BETWEEN ? AND ?
+            ORDER BY city, period_start
+        ''', chunk + [source, start, end])
+
+
+def _aggregate_numpy(rows, period, start):
+    cities, dates, counts, lows, highs, sums = zip(*rows)
+    cities = numpy.array(cities, dtype=object)
+    days = numpy.array(dates, dtype='datetime64[D]')
+    counts = numpy.array(counts, dtype=numpy.int64)
+    lows = numpy.array(lows, dtype=numpy.float64)
+    highs = numpy.array(highs, dtype=numpy.float64)
+    sums = numpy.array(sums, dtype=numpy.float64)
+
+    # Period start of every row; rows are sorted by city and date, so groups are contiguous
+    if period == 'week':
+        day_numbers = days.astype(numpy.int64)
+        # 1970-01-01 was a Thursday; shift so weeks start on Monday
+        starts = ((day_numbers + 3) // 7 * 7 - 3).astype('datetime64[D]')
+    elif period == 'month':
+        starts = days.astype('datetime64[M]').astype('datetime64[D]')
+    elif period == 'year':
+        starts = days.astype('datetime64[Y]').astype('datetime64[D]')
+    elif period == 'all':
+        starts = numpy.full(len(days), numpy.datetime64(start, 'D'))
+    else:
+        starts = days
+    boundary = numpy.ones(len(days), dtype=bool)
+    boundary[1:] = (cities[1:] != cities[:-1]) | (starts[1:] != starts[:-1])
+    index = numpy.flatnonzero(boundary)
+
+    count = numpy.add.reduceat(counts, index)
+    total = numpy.add.reduceat(sums, index)
+    low = numpy.minimum.reduceat(lows, index)
+    high = numpy.maximum.reduceat(highs, index)
+    mean = total / count
+    return list(zip(cities[index].tolist(), starts[index].astype(str).tolist(), count.tolist(),
+                    low.tolist(), mean.tolist(), high.tolist()))
+
+
+def _aggregate_python(rows, period, start):
+    def key(row):
+        return row[0], (start if period == 'all' else period_start(row[1], period).isoformat())
+
+    result = []
+    for (city, group_start), group in itertools.groupby(rows, key=key):
+        group = list(group)
+        count = sum(row[2] for row in group)
+        result.append((city, group_start, count, min(row[3] for row in group),
+                       sum(row[5] for row in group) / count, max(row[4] for row in group)))
+    return result
+
+
+# Temperature statistics per city and period over [start, end], computed from
+# the precomputed rollups (vectorized with NumPy when it is installed).
+# Returns (city, period_start, count, min, mean, max) tuples ordered by city and date.
+def aggregate(cities=None, start=MIN_DATE, end=MAX_DATE, period='month'):
+    if period not in AGGREGATE_PERIODS:
+        raise ValueError(f"Unknown period '{period}'")
+    start, end = _date(start), _date(end)
+    refresh(cities)
+    segments = _segments(period, start, end)
+    rows = []
+    for source, first, last in segments:
+        rows.extend(_read(cities, source, first.isoformat(), last.isoformat()))
+    if not rows:
+        return []
+    if len(segments) > 1:
+        rows.sort(key=lambda row: (row[0], row[1]))
+    if load_numpy() is not None:
+        return _aggregate_numpy(rows, period, start.isoformat())
+    return _aggregate_python(rows, period, start.isoformat())
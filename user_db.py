@@ -1,105 +1,115 @@
 import sqlite3
-from passlib.hash import pbkdf2_sha256
+import alerts_db
+import data_versions
+import db
+import forecast_updates
+import ingest
+import migrations
+import timeseries
+import os
+from passlib.context import CryptContext
 import logging
 
-# Path to SQLite database file
-DATABASE = 'weather_net.db'
+logger = logging.getLogger(__name__)
 
-# Connect to the SQLite database
+# Path to SQLite database file (the connection pool lives in db.py)
+DATABASE = db.DATABASE
+
+# Password hashing. Raising or lowering WEATHER_PBKDF2_ROUNDS takes effect for
+# new passwords at once and for existing ones at their owner's next login.
+PBKDF2_ROUNDS = int(os.environ.get('WEATHER_PBKDF2_ROUNDS', '29000'))
+password_context = CryptContext(schemes=['pbkdf2_sha256'], pbkdf2_sha256__rounds=PBKDF2_ROUNDS)
+
+# Get the pooled connection for the current thread; callers must not close it
 def connect_db():
-    conn = sqlite3.connect(DATABASE)
-    return conn
+    return db.get_connection()
 
-# Create tables if they don't exist
+# Create tables if they don't exist and bring the schema up to date
 def create_tables():
-    conn = connect_db()
-    cursor = conn.cursor()
-
-    # Create users table with username and hashed password
-    cursor.execute('''CREATE TABLE IF NOT EXISTS users (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        username TEXT NOT NULL UNIQUE,
-                        password TEXT NOT NULL
-                      )''')
-    
-    # Create weather data table for storing forecast (with city, date, temperature, and condition)
-    cursor.execute('''CREATE TABLE IF NOT EXISTS weather_data (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        city TEXT NOT NULL,
-                        date TEXT NOT NULL,
-                        temperature INTEGER NOT NULL,
-                        condition TEXT NOT NULL,
-                        UNIQUE(city, date, condition)  -- Ensuring no duplicates for city, date, and condition
-                      )''')
-    
-     # Create files table for storing uploaded file metadata
-    cursor.execute('''CREATE TABLE IF NOT EXISTS files (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        filename TEXT NOT NULL,
-                        uploader TEXT NOT NULL,
-                        upload_time TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-                      )''')
-    
-    conn.commit()
-    conn.close()
+    return migrations.migrate()
 
 # Register a new user
 def register_user(username, password):
     if not username or not password:
-        print("Username and password cannot be empty.")
+        logger.info("Registration rejected: username and password cannot be empty")
         return False
 
     conn = connect_db()
     cursor = conn.cursor()
     try:
         # Use pbkdf2_sha256 for hashing the password
-        hashed_password = pbkdf2_sha256.hash(password)
+        hashed_password = password_context.hash(password)
 
         cursor.execute("INSERT INTO users (username, password) VALUES (?, ?)", (username, hashed_password))
         conn.commit()
         return True
     except sqlite3.IntegrityError:
-        print("Username already taken!")
+        conn.rollback()
+        logger.info("Registration rejected: username already taken", extra={'username': username})
         return False
     except Exception as e:
-        print(f"An error occurred: {e}")
+        conn.rollback()
+        logger.exception("Error registering user")
         return False
-    finally:
-        conn.close()
 
-# Verify user login
+# Verify user login, rehashing the stored password if the hash settings changed
 def verify_login(username, password):
     conn = connect_db()
     cursor = conn.cursor()
 
     cursor.execute("SELECT password FROM users WHERE username=?", (username,))
     user = cursor.fetchone()
-    conn.close()
+    if not user:
+        return False
 
-    if user and pbkdf2_sha256.verify(password, user[0]):  # Verify with pbkdf2_sha256
-        return True
-    return False
+    valid, new_hash = password_context.verify_and_update(password, user[0])  # Verify with pbkdf2_sha256
+    if valid and new_hash:
+        # Only replace the hash we verified, in case it changed meanwhile
+        cursor.execute("UPDATE users SET password = ? WHERE username = ? AND password = ?",
+                       (new_hash, username, user[0]))
+        conn.commit()
+    return valid
 
 # Store weather data for 7-day forecast into the database
 def store_weather_data(city, forecast_data):
+    rows = ((city, date, temperature, condition) for date, temperature, condition in forecast_data)
+    return ingest.ingest_rows(rows)
+
+# Set the weather for one city and date, optionally raising an alert, in a
+# single transaction. The newest row for (city, date) is updated in place
+# (replacing any other row that already has the new condition); a new row is
+# inserted only if the date has none. An alert whose idempotency_key was
+# already used is not stored again. on_alert(alert_id) runs inside the
+# transaction for a newly stored alert, e.g. to queue its broadcast, and
+# on_change(delta) likewise for the forecast change (see forecast_updates.py).
+# Returns the new alert's id, or None.
+def update_weather(city, date, temperature, condition, username=None, alert_description=None,
+                   idempotency_key=None, on_alert=None, on_change=None):
     conn = connect_db()
-    cursor = conn.cursor()
-
-    for date, temperature, condition in forecast_data:
-        # Check if the weather data already exists for the specific city and date
-        cursor.execute('''
-            SELECT COUNT(*) FROM weather_data
-            WHERE city = ? AND date = ? AND condition = ?
-        ''', (city, date, condition))
-        
-        if cursor.fetchone()[0] == 0:  # No existing entry for this city and date
-            cursor.execute('''
-                INSERT INTO weather_data (city, date, temperature, condition) 
-                VALUES (?, ?, ?, ?)
-            ''', (city, date, temperature, condition))
-    
-    conn.commit()
-    conn.close()
+    try:
+        cursor = conn.execute('''
+            UPDATE OR REPLACE weather_data
+            SET temperature = ?, condition = ?
+            WHERE id = (SELECT max(id) FROM weather_data WHERE city = ? AND date = ?)
+        ''', (temperature, condition, city, date))
+        if cursor.rowcount == 0:
+            conn.execute(ingest.UPSERT_SQL, (city, date, temperature, condition))
+        timeseries.mark_dirty(city, date, commit=False)
+        delta = forecast_updates.record(city, date, temperature, condition, conn)
+        if on_change:
+            on_change(delta)
+
+        alert_id = None
+        if alert_description:
+            alert_id = alerts_db.add_weather_alert(city, alert_description, username, commit=False,
+                                                   idempotency_key=idempotency_key)
+            if alert_id is not None and on_alert:
+                on_alert(alert_id)
+        conn.commit()
+    except Exception:
+        conn.rollback()
+        raise
+    return alert_id
 
 # Retrieve weather data based on city for a 7-day forecast
 def search_weather_data(city):
@@ -115,110 +125,228 @@ def search_weather_data(city):
     ''', (city,))
     
     weather_info = cursor.fetchall()
-    conn.close()
 
     return weather_info
 
-# Create file metadata table
+# Create file metadata table (part of the versioned schema)
 def create_files_table():
+    return migrations.migrate()
+
+# Save file metadata in the database and return the new row's id.
+# sha256/size/storage_key describe the stored content (see file_store.py).
+def save_file_metadata(filename, uploader, sha256=None, size=None, storage_key=None):
     conn = connect_db()
     cursor = conn.cursor()
 
-    cursor.execute('''CREATE TABLE IF NOT EXISTS files (
-                        id INTEGER PRIMARY KEY AUTOINCREMENT,
-                        filename TEXT NOT NULL,
-                        uploader TEXT NOT NULL,
-                        upload_time DATETIME DEFAULT CURRENT_TIMESTAMP
-                      )''')
+    # Insert file metadata into the database
+    cursor.execute('''
+        INSERT INTO files (filename, uploader, sha256, size, storage_key)
+        VALUES (?, ?, ?, ?, ?)
+    ''', (filename, uploader, sha256, size, storage_key))
+    data_versions.bump(data_versions.FILES, conn)
 
     conn.commit()
-    conn.close()
+    return cursor.lastrowid
+
+# Columns returned for a file, in order
+FILE_KEYS = ('id', 'filename', 'uploader', 'upload_time', 'sha256', 'size', 'storage_key',
+             'deleted_at', 'deleted_path')
+FILE_COLUMNS = ', '.join(FILE_KEYS)
 
-# Save file metadata in the database
-def save_file_metadata(filename, uploader):
+# Retrieve the newest live (or, with deleted=True, soft-deleted) file stored
+# under a name, as a dictionary (None if missing)
+def get_file_metadata(filename, deleted=False):
     conn = connect_db()
-    cursor = conn.cursor()
+    row = conn.execute(f'''
+        SELECT {FILE_COLUMNS}
+        FROM files
+        WHERE filename = ? AND deleted = ?
+        ORDER BY id DESC
+        LIMIT 1
+    ''', (filename, 1 if deleted else 0)).fetchone()
+    if row is None:
+        return None
+    return dict(zip(FILE_KEYS, row))
+
+# Retrieve a file (live or deleted) by id, as a dictionary (None if missing)
+def get_file(file_id):
+    conn = connect_db()
+    row = conn.execute(f'SELECT {FILE_COLUMNS}, deleted FROM files WHERE id = ?', (file_id,)).fetchone()
+    if row is None:
+        return None
+    return dict(zip(FILE_KEYS + ('deleted',), row))
 
-    # Insert file metadata into the database
-    cursor.execute('''
-        INSERT INTO files (filename, uploader)
-        VALUES (?, ?)
-    ''', (filename, uploader))
+# Start a resumable upload session
+def create_upload_session(upload_id, filename, uploader, total_size):
+    conn = connect_db()
+    conn.execute('''
+        INSERT INTO upload_sessions (id, filename, uploader, total_size)
+        VALUES (?, ?, ?, ?)
+    ''', (upload_id, filename, uploader, total_size))
+    conn.commit()
 
+# Retrieve an upload session as a dictionary (None if missing)
+def get_upload_session(upload_id):
+    conn = connect_db()
+    row = conn.execute('''
+        SELECT id, filename, uploader, total_size, received
+        FROM upload_sessions
+        WHERE id = ?
+    ''', (upload_id,)).fetchone()
+    if row is None:
+        return None
+    return dict(zip(('id', 'filename', 'uploader', 'total_size', 'received'), row))
+
+# Record how many bytes of an upload have been received
+def update_upload_session(upload_id, received):
+    conn = connect_db()
+    conn.execute('UPDATE upload_sessions SET received = ? WHERE id = ?', (received, upload_id))
     conn.commit()
-    conn.close()
 
+def delete_upload_session(upload_id):
+    conn = connect_db()
+    conn.execute('DELETE FROM upload_sessions WHERE id = ?', (upload_id,))
+    conn.commit()
 
+# Default and maximum number of files per catalog page
+FILE_PAGE_SIZE = 50
+MAX_FILE_PAGE_SIZE = 1000
+
+# Catalog sort orders: column and direction. 'deleted' (time of deletion) is
+# meant for the deleted-files listing.
+FILE_SORTS = {
+    'time': ('upload_time', 'DESC'),
+    'name': ('filename', 'ASC'),
+    'deleted': ('deleted_at', 'DESC'),
+}
+
+
+# Encode the sort value and id of the last file on a page as an opaque cursor
+def encode_file_cursor(value, file_id):
+    return f"{value}|{file_id}"
+
+
+# Decode a cursor from encode_file_cursor(); returns None for a missing or bad cursor
+def decode_file_cursor(cursor):
+    if not cursor:
+        return None
+    value, _, file_id = cursor.rpartition('|')
+    if not value or not file_id.isdigit():
+        return None
+    return value, int(file_id)
+
+
+# Sort order actually used: a filename prefix search lists matches by name,
+# which walks the name index instead of sorting the whole range
+def _file_sort(sort, prefix):
+    return FILE_SORTS['name'] if prefix else FILE_SORTS.get(sort, FILE_SORTS['time'])
+
+
+# Iterate over the file catalog with keyset pagination, without loading the
+# whole table. Filters: uploader, filename prefix and an upload time range;
+# deleted=True lists soft-deleted files instead of live ones.
+def iter_files(limit=FILE_PAGE_SIZE, cursor=None, sort='time', uploader=None, prefix=None,
+               since=None, until=None, deleted=False):
+    column, direction = _file_sort(sort, prefix)
+    clauses = ['deleted = ?']
+    params = [1 if deleted else 0]
+    position = decode_file_cursor(cursor)
+    if position:
+        clauses.append(f"({column}, id) {'<' if direction == 'DESC' else '>'} (?, ?)")
+        params.extend(position)
+    if uploader:
+        clauses.append('uploader = ?')
+        params.append(uploader)
+    if prefix:
+        # A range rather than LIKE, so the filename index is used
+        clauses.append('filename >= ? AND filename < ?')
+        params.extend((prefix, prefix + '\U0010ffff'))
+    if since:
+        clauses.append('upload_time >= ?')
+        params.append(since)
+    if until:
+        clauses.append('upload_time < ?')
+        params.append(until)
+    # One row over the maximum lets callers detect a following page
+    params.append(max(1, min(int(limit), MAX_FILE_PAGE_SIZE + 1)))
 
+    conn = connect_db()
+    for row in conn.execute(f'''
+        SELECT {FILE_COLUMNS}
+        FROM files
+        WHERE {' AND '.join(clauses)}
+        ORDER BY {column} {direction}, id {direction}
+        LIMIT ?
+    ''', params):
+        yield dict(zip(FILE_KEYS, row))
+
+
+# Retrieve one page of the file catalog. Returns (files, next_cursor);
+# next_cursor is None on the last page.
+def get_files_page(limit=FILE_PAGE_SIZE, cursor=None, sort='time', uploader=None, prefix=None,
+                   since=None, until=None, deleted=False):
+    limit = max(1, min(int(limit), MAX_FILE_PAGE_SIZE))
+    files = list(iter_files(limit + 1, cursor, sort, uploader, prefix, since, until, deleted))
+    next_cursor = None
+    if len(files) > limit:
+        files = files[:limit]
+        column = _file_sort(sort, prefix)[0]
+        next_cursor = encode_file_cursor(files[-1][column], files[-1]['id'])
+    return files, next_cursor
+
+
+# Retrieve the newest uploaded files (one catalog page)
+def get_uploaded_files(limit=FILE_PAGE_SIZE):
+    return get_files_page(limit)[0]
+
+
+# Mark a file as deleted. deleted_path is where its content was moved, for
+# files that live outside the content-addressed store.
+def soft_delete_file(file_id, deleted_path=None):
+    conn = connect_db()
+    try:
+        conn.execute('''
+            UPDATE files
+            SET deleted = 1, deleted_at = CURRENT_TIMESTAMP, deleted_path = ?
+            WHERE id = ?
+        ''', (deleted_path, file_id))
+        data_versions.bump(data_versions.FILES, conn)
+        conn.commit()
+    except Exception as e:
+        conn.rollback()
+        logger.exception("Error deleting file metadata")
 
 
-# Retrieve all uploaded files
-def get_uploaded_files():
+# Remove a file's row entirely (used once its content is gone)
+def purge_file_metadata(file_id):
     conn = connect_db()
-    cursor = conn.cursor()
+    conn.execute('DELETE FROM files WHERE id = ?', (file_id,))
+    data_versions.bump(data_versions.FILES, conn)
+    conn.commit()
 
-    # Fetch the filenames and uploader info from the files table
-    cursor.execute('''
-        SELECT filename, uploader
+
+# Files with an id above after_id, live and deleted, oldest first (for the reconciler)
+def get_files_after(after_id=0, limit=1000):
+    conn = connect_db()
+    rows = conn.execute(f'''
+        SELECT {FILE_COLUMNS}, deleted
         FROM files
-    ''')
-    
-    files = cursor.fetchall()
-    conn.close()
+        WHERE id > ?
+        ORDER BY id
+        LIMIT ?
+    ''', (after_id, limit)).fetchall()
+    return [dict(zip(FILE_KEYS + ('deleted',), row)) for row in rows]
 
-    # Ensure files are returned as a list of dictionaries
-    return [{'filename': file[0], 'uploader': file[1]} for file in files]
+
+# Whether any file row (live or deleted) refers to stored content with this hash
+def is_content_referenced(sha256):
+    conn = connect_db()
+    return conn.execute('SELECT 1 FROM files WHERE sha256 = ? LIMIT 1', (sha256,)).fetchone() is not None
 
 
-def delete_file_metadata(filename):
+# Whether a file in the deleted-files folder is already tracked by a row
+def is_deleted_path_tracked(deleted_path):
     conn = connect_db()
-    cursor = conn.cursor()
+    return conn.execute('SELECT 1 FROM files WHERE deleted_path = ? LIMIT 1',
+                        (deleted_path,)).fetchone() is not None
 
-    try:
-        # Delete the file's metadata based on the filename
-        cursor.execute('''
-            DELETE FROM files WHERE filename = ?
-        ''', (filename,))
-        conn.commit()
-    except Exception as e:
-        print(f"Error deleting file metadata: {e}")
-    finally:
-        conn.close()
-
-
-
-
-# Pre-populate the weather data for Montreal, Toronto, and Vancouver (for testing purposes)
-def prepopulate_weather_data():
-    weather_data = {
-        'Montreal': [
-            ('2024-11-01', 5, 'Sunny'),
-            ('2024-11-02', 6, 'Partly Cloudy'),
-            ('2024-11-03', 4, 'Rainy'),
-            ('2024-11-04', 3, 'Snowy'),
-            ('2024-11-05', 7, 'Cloudy'),
-            ('2024-11-06', 8, 'Windy'),
-            ('2024-11-07', 5, 'Foggy')
-        ],
-        'Toronto': [
-            ('2024-11-01', 10, 'Sunny'),
-            ('2024-11-02', 12, 'Partly Cloudy'),
-            ('2024-11-03', 8, 'Rainy'),
-            ('2024-11-04', 9, 'Snowy'),
-            ('2024-11-05', 13, 'Cloudy'),
-            ('2024-11-06', 14, 'Windy'),
-            ('2024-11-07', 11, 'Foggy')
-        ],
-        'Vancouver': [
-            ('2024-11-01', 11, 'Sunny'),
-            ('2024-11-02', 13, 'Partly Cloudy'),
-            ('2024-11-03', 9, 'Rainy'),
-            ('2024-11-04', 7, 'Snowy'),
-            ('2024-11-05', 15, 'Cloudy'),
-            ('2024-11-06', 16, 'Windy'),
-            ('2024-11-07', 13, 'Foggy')
-        ]
-    }
-
-    for city, forecast in weather_data.items():
-        store_weather_data(city, forecast)